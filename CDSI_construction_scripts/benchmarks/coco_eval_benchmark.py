@@ -0,0 +1,127 @@
+"""
+evaluation time of evaluation/coco_eval.py against pycocotools COCOeval (when installed),
+checking that the 12 summary metrics agree to 1e-4
+
+A ground truth and results file can be given, otherwise synthetic dense car scenes are made:
+boxes of all COCO area ranges, a few crowd boxes, detections jittered from the ground truth
+with duplicates and background false positives, and rounded scores so that ties occur.
+
+usage:
+    python benchmarks/coco_eval_benchmark.py --num_images 2000 --objects_per_image 80 --workers 8
+    python benchmarks/coco_eval_benchmark.py --gt_json ../VME_annotations/annotations_HBB/test.json --results_json results.json
+"""
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import fire
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from evaluation.coco_eval import SUMMARY, evaluate, load_coco_ground_truth, load_detections
+from utils.json_io import save_json
+
+try:
+    from pycocotools.coco import COCO
+    from pycocotools.cocoeval import COCOeval
+except ImportError:
+    COCO = None
+
+CATEGORIES = [{"id": 1, "name": "car", "supercategory": "car"}, {"id": 2, "name": "other", "supercategory": "other"}]
+
+
+def make_coco_scenes(gt_path, results_path, num_images, objects_per_image, seed=0):
+    """
+    Writes a synthetic ground truth file and a results file of noisy detections
+    """
+    rng = random.Random(seed)
+    images, annotations, results = [], [], []
+    for image_id in range(1, num_images + 1):
+        images.append({"height": 512, "width": 512, "id": image_id, "file_name": "{}.png".format(image_id)})
+        for _ in range(rng.randint(0, 2 * objects_per_image)):
+            # mostly cars under 32x32, some medium and large objects
+            side = rng.choice([rng.uniform(4, 30), rng.uniform(4, 30), rng.uniform(30, 90), rng.uniform(90, 200)])
+            w, h = side * rng.uniform(0.5, 1.5), side * rng.uniform(0.5, 1.5)
+            x, y = rng.uniform(0, 512 - w), rng.uniform(0, 512 - h)
+            category_id = 1 if rng.random() < 0.8 else 2
+            annotations.append({
+                "iscrowd": int(rng.random() < 0.02), "image_id": image_id, "bbox": [x, y, w, h], "segmentation": [],
+                "category_id": category_id, "id": len(annotations) + 1, "area": w * h,
+            })
+            for _ in range(rng.choice([0, 1, 1, 1, 2])):
+                jitter = [rng.gauss(0, 0.1 * w), rng.gauss(0, 0.1 * h), rng.gauss(0, 0.1 * w), rng.gauss(0, 0.1 * h)]
+                results.append({
+                    "image_id": image_id, "category_id": category_id, "score": round(rng.random(), 2),
+                    "bbox": [x + jitter[0], y + jitter[1], max(1.0, w + jitter[2]), max(1.0, h + jitter[3])],
+                })
+        for _ in range(rng.randint(0, objects_per_image // 2)):
+            w, h = rng.uniform(4, 60), rng.uniform(4, 60)
+            results.append({
+                "image_id": image_id, "category_id": rng.choice([1, 2]), "score": round(rng.random() * 0.5, 2),
+                "bbox": [rng.uniform(0, 512 - w), rng.uniform(0, 512 - h), w, h],
+            })
+    save_json({"images": images, "annotations": annotations, "categories": CATEGORIES}, gt_path)
+    save_json(results, results_path)
+
+
+def _run_pycocotools(gt_json, results_json):
+    ground_truth = COCO(gt_json)
+    coco_eval = COCOeval(ground_truth, ground_truth.loadRes(results_json), "bbox")
+    coco_eval.evaluate()
+    coco_eval.accumulate()
+    coco_eval.summarize()
+    return dict(zip([name for name, *_ in SUMMARY], coco_eval.stats.tolist()))
+
+
+def _run_coco_eval(gt_json, results_json, workers):
+    ground_truth = load_coco_ground_truth(gt_json)
+    return evaluate(ground_truth, load_detections(results_json, ground_truth), workers=workers)["stats"]
+
+
+def coco_eval_benchmark(gt_json=None, results_json=None, num_images=1000, objects_per_image=60, workers=1, seed=0):
+    """
+    Args:
+        gt_json: str
+            COCO ground truth file, synthetic scenes if not provided
+        results_json: str
+            COCO results file of gt_json
+        num_images: int
+            Number of synthetic images
+        objects_per_image: int
+            Mean number of objects of the synthetic images
+        workers: int
+            Number of processes of coco_eval
+        seed: int
+            Random seed of the synthetic scenes
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if gt_json is None:
+            gt_json, results_json = os.path.join(tmp_dir, "gt.json"), os.path.join(tmp_dir, "results.json")
+            make_coco_scenes(gt_json, results_json, num_images, objects_per_image, seed)
+
+        start = time.perf_counter()
+        stats = _run_coco_eval(gt_json, results_json, workers)
+        seconds = time.perf_counter() - start
+        print("coco_eval ({} workers): {:.2f} s".format(workers, seconds))
+        if COCO is None:
+            print("pycocotools is not installed, no reference run")
+            for name, value in stats.items():
+                print("    {:<6}{:>9.4f}".format(name, value))
+            return
+
+        start = time.perf_counter()
+        reference = _run_pycocotools(gt_json, results_json)
+        reference_seconds = time.perf_counter() - start
+        print("pycocotools: {:.2f} s ({:.1f}x)".format(reference_seconds, reference_seconds / seconds))
+        for name, value in stats.items():
+            print("    {:<6}{:>9.4f}{:>9.4f}".format(name, value, reference[name]))
+        worst = max(abs(stats[name] - reference[name]) for name in stats)
+        if worst > 1e-4:
+            raise AssertionError("coco_eval differs from pycocotools by {}".format(worst))
+        print("max difference to pycocotools: {:.2e}".format(worst))
+
+
+if __name__ == "__main__":
+    fire.Fire(coco_eval_benchmark)
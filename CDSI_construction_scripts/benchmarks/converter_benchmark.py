@@ -0,0 +1,144 @@
+"""
+throughput and peak memory of every *_to_coco converter on synthetic data
+
+Each converter runs in its own process (as from the command line) for every mode, and the
+benchmark reports images/s, annotations/s (written annotations) and the peak RSS of that
+process. The data is made by benchmarks/synthetic_data.py, so it runs offline on any machine.
+
+usage:
+    python benchmarks/converter_benchmark.py --num_images 500 --objects_per_image 40
+    python benchmarks/converter_benchmark.py --data_dir /tmp/cdsi_synthetic --converters dior,xview --workers 4
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fire
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SCRIPTS_DIR))
+from benchmarks.synthetic_data import SOURCES, generate
+from utils.json_io import load_json, save_json
+from utils.modes import MODES
+
+
+def converter_command(source, data_dir, output_dir, mode):
+    """
+    Returns the command line of the converter of a source on the synthetic data
+    """
+    data_dir = Path(data_dir)
+    split_path = str(data_dir / "{}_split.txt".format(source))
+    if source == "xview":
+        args = [str(data_dir / "xview" / "train_images"), split_path, str(data_dir / "xview" / "xView_train.geojson")]
+    elif source == "vme":
+        args = [
+            str(data_dir / "vme" / "images"), split_path, str(output_dir), mode,
+            "--obb_annotations", str(data_dir / "vme" / "annotations_OBB"),
+        ]
+        return [sys.executable, str(SCRIPTS_DIR / "vme" / "vme_to_coco.py")] + args
+    else:
+        args = [str(data_dir / source), split_path]
+    return [sys.executable, str(SCRIPTS_DIR / source / "{}_to_coco.py".format(source))] + args + [str(output_dir), mode]
+
+
+def run_measured(command, cwd):
+    """
+    Runs a command and returns its (wall time in s, peak RSS in MB)
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # wait4 gives the resource usage of this child only
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    stderr = process.stderr.read().decode(errors="replace")
+    process.stderr.close()
+    if process.returncode != 0:
+        raise RuntimeError("{} failed:\n{}".format(" ".join(command), stderr[-2000:]))
+    return elapsed, rusage.ru_maxrss / 1024
+
+
+def converter_benchmark(
+    data_dir=None,
+    num_images=200,
+    objects_per_image=30,
+    converters="all",
+    modes="original,car_other,car",
+    workers=1,
+    prefetch=0,
+    report=None,
+):
+    """
+    Benchmarks the converters and prints one row per converter and mode.
+
+    Args:
+        data_dir: str
+            Synthetic data directory, generated there if it has no split lists yet.
+            A temporary directory is used if not provided.
+        num_images: int
+            Number of images of every source when generating the data
+        objects_per_image: int
+            Number of objects of every image when generating the data
+        converters: str or list
+            Sources to benchmark (comma separated), 'all' for every converter
+        modes: str or list
+            Conversion modes (comma separated), 'all' is run as a single multi-mode conversion
+        workers: int
+            --workers of the converters
+        prefetch: int
+            --prefetch of the converters
+        report: str
+            If provided, the results are also saved to this json file
+    """
+    sources = SOURCES if converters == "all" else (converters.split(",") if isinstance(converters, str) else list(converters))
+    modes = modes.split(",") if isinstance(modes, str) else list(modes)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if data_dir is None:
+            data_dir = os.path.join(tmp_dir, "data")
+        missing = [source for source in sources if not (Path(data_dir) / "{}_split.txt".format(source)).exists()]
+        if missing:
+            generate(data_dir, num_images=num_images, objects_per_image=objects_per_image, sources=missing)
+
+        results = []
+        print("{:<8}{:<11}{:>8}{:>10}{:>9}{:>10}{:>12}{:>9}".format(
+            "source", "mode", "images", "anns", "time s", "images/s", "anns/s", "RSS MB"))
+        for source in sources:
+            for mode in modes:
+                output_dir = os.path.join(tmp_dir, "out", source, mode)
+                command = converter_command(source, data_dir, output_dir, mode)
+                command += ["--workers", str(workers), "--prefetch", str(prefetch), "--image_size_cache", "False"]
+                elapsed, peak_rss = run_measured(command, cwd=str(SCRIPTS_DIR / source))
+
+                # count what was written, every mode of a multi-mode run
+                num_images = num_annotations = 0
+                written_modes = MODES if mode == "all" else [mode]
+                for written_mode in written_modes:
+                    mode_dir = Path(output_dir) / written_mode if mode == "all" else Path(output_dir)
+                    coco = load_json(mode_dir / "{}_split.json".format(source))
+                    num_images += len(coco["images"])
+                    num_annotations += len(coco["annotations"])
+                results.append({
+                    "source": source,
+                    "mode": mode,
+                    "images": num_images,
+                    "annotations": num_annotations,
+                    "seconds": elapsed,
+                    "images_per_s": num_images / elapsed,
+                    "annotations_per_s": num_annotations / elapsed,
+                    "peak_rss_mb": peak_rss,
+                })
+                print("{:<8}{:<11}{:>8}{:>10}{:>9.2f}{:>10.0f}{:>12.0f}{:>9.0f}".format(
+                    source, mode, num_images, num_annotations, elapsed,
+                    num_images / elapsed, num_annotations / elapsed, peak_rss))
+
+    if report is not None:
+        save_json(results, report)
+    return None
+
+
+if __name__ == "__main__":
+    fire.Fire(converter_benchmark)
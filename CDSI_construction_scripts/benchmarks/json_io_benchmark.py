@@ -0,0 +1,109 @@
+"""
+load/dump times of utils.json_io against the former json.load/json.dump calls, on the VME
+annotations_HBB test split replicated to the size of a CDSI split file
+
+usage:
+    python benchmarks/json_io_benchmark.py --scale 50 --repeat 3
+"""
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import fire
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils import json_io
+
+VME_TEST_JSON = Path(__file__).resolve().parents[2] / "VME_annotations" / "annotations_HBB" / "test.json"
+
+
+def scale_coco(data, scale):
+    """
+    Returns data with its images and annotations replicated scale times (with new ids)
+    """
+    num_images, num_annotations = len(data["images"]), len(data["annotations"])
+    images, annotations = [], []
+    for k in range(scale):
+        for image in data["images"]:
+            images.append(dict(image, id=image["id"] + k * num_images))
+        for annotation in data["annotations"]:
+            annotations.append(
+                dict(
+                    annotation,
+                    id=annotation["id"] + k * num_annotations,
+                    image_id=annotation["image_id"] + k * num_images,
+                )
+            )
+    return {"images": images, "annotations": annotations, "categories": data["categories"]}
+
+
+def _best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _stdlib_load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _stdlib_dump(data, path):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def json_io_benchmark(input_file=str(VME_TEST_JSON), scale=50, repeat=3, float_precision=2):
+    """
+    Prints the best load and dump time of each method.
+
+    Args:
+        input_file: str
+            COCO json to replicate, the VME test split by default
+        scale: int
+            Number of copies of the images and annotations
+        repeat: int
+            Number of runs of each measure
+        float_precision: int
+            Precision of the rounded dump
+    """
+    data = scale_coco(json_io.load_json(input_file), scale)
+    print(
+        "backend: {}, {} images, {} annotations".format(
+            json_io.BACKEND, len(data["images"]), len(data["annotations"])
+        )
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stdlib_path = os.path.join(tmp_dir, "stdlib.json")
+        json_io_path = os.path.join(tmp_dir, "json_io.json")
+        rounded_path = os.path.join(tmp_dir, "json_io_rounded.json")
+
+        dump_times = [
+            ("json.dump", stdlib_path, lambda: _stdlib_dump(data, stdlib_path)),
+            ("json_io.save_json", json_io_path, lambda: json_io.save_json(data, json_io_path)),
+            (
+                "json_io.save_json (float_precision={})".format(float_precision),
+                rounded_path,
+                lambda: json_io.save_json(data, rounded_path, float_precision=float_precision),
+            ),
+        ]
+        print("{:<45}{:>10}{:>10}{:>10}".format("method", "dump (s)", "load (s)", "MB"))
+        for name, path, dump in dump_times:
+            dump_time = _best_time(dump, repeat)
+            if name == "json.dump":
+                load_time = _best_time(lambda: _stdlib_load(path), repeat)
+            else:
+                load_time = _best_time(lambda: json_io.load_json(path), repeat)
+            size = os.path.getsize(path) / 2 ** 20
+            print("{:<45}{:>10.3f}{:>10.3f}{:>10.1f}".format(name, dump_time, load_time, size))
+
+
+if __name__ == "__main__":
+    fire.Fire(json_io_benchmark)
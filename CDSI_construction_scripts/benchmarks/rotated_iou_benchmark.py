@@ -0,0 +1,85 @@
+"""
+time of evaluation/rotated_iou.py against the shapely polygon-by-polygon IoU on dense synthetic
+tiles of rotated cars, checking that both give the same IoU matrices
+
+usage:
+    python benchmarks/rotated_iou_benchmark.py --num_tiles 50 --cars_per_tile 150
+"""
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+from shapely.geometry import Polygon
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from evaluation.rotated_iou import rotated_iou
+
+
+def random_cars(rng, num_cars, tile_size=512):
+    """
+    Returns (N, 8) corners of rotated car sized rectangles
+    """
+    centers = rng.uniform(0, tile_size, (num_cars, 2))
+    half_sizes = np.stack([rng.uniform(4, 12, num_cars), rng.uniform(2, 6, num_cars)], axis=1)
+    angles = rng.uniform(0, np.pi, num_cars)
+    axes = np.stack([np.cos(angles), np.sin(angles)], axis=1), np.stack([-np.sin(angles), np.cos(angles)], axis=1)
+    corners = [
+        centers + sx * half_sizes[:, :1] * axes[0] + sy * half_sizes[:, 1:] * axes[1]
+        for sx, sy in ((-1, -1), (1, -1), (1, 1), (-1, 1))
+    ]
+    return np.stack(corners, axis=1).reshape(-1, 8)
+
+
+def jitter_cars(rng, corners, scale=1.5):
+    """
+    Returns detections of the cars, the rectangles being shifted
+    """
+    shifts = rng.normal(0, scale, (len(corners), 2))
+    return corners + np.tile(shifts, 4)
+
+
+def shapely_iou(dt_corners, gt_corners):
+    dt_polygons = [Polygon(corners.reshape(4, 2)) for corners in dt_corners]
+    gt_polygons = [Polygon(corners.reshape(4, 2)) for corners in gt_corners]
+    ious = np.zeros((len(dt_polygons), len(gt_polygons)))
+    for i, dt_polygon in enumerate(dt_polygons):
+        for j, gt_polygon in enumerate(gt_polygons):
+            intersection = dt_polygon.intersection(gt_polygon).area
+            union = dt_polygon.area + gt_polygon.area - intersection
+            ious[i, j] = intersection / union if union > 0 else 0.0
+    return ious
+
+
+def rotated_iou_benchmark(num_tiles=50, cars_per_tile=150, seed=0):
+    """
+    Args:
+        num_tiles: int
+            Number of synthetic tiles
+        cars_per_tile: int
+            Number of cars (and of detections) of every tile
+        seed: int
+            Random seed
+    """
+    rng = np.random.default_rng(seed)
+    tiles = []
+    for _ in range(num_tiles):
+        gt_corners = random_cars(rng, cars_per_tile)
+        tiles.append((jitter_cars(rng, gt_corners), gt_corners))
+
+    start = time.perf_counter()
+    results = [rotated_iou(dt_corners, gt_corners) for dt_corners, gt_corners in tiles]
+    seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    references = [shapely_iou(dt_corners, gt_corners) for dt_corners, gt_corners in tiles]
+    reference_seconds = time.perf_counter() - start
+
+    worst = max(np.abs(result - reference).max() for result, reference in zip(results, references))
+    print("{} tiles of {} cars, max IoU difference {:.2e}".format(num_tiles, cars_per_tile, worst))
+    print("    {:<16}{:>9.3f} s".format("shapely", reference_seconds))
+    print("    {:<16}{:>9.3f} s  ({:.1f}x)".format("rotated_iou", seconds, reference_seconds / seconds))
+
+
+if __name__ == "__main__":
+    fire.Fire(rotated_iou_benchmark)
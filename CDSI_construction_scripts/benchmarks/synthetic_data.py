@@ -0,0 +1,248 @@
+"""
+synthetic datasets in the native format of every source, for benchmarking the converters
+offline (the real datasets can not be redistributed)
+
+Every source gets num_images images with objects_per_image objects each, laid out as its
+converter expects, and a '<source>_split.txt' split list with all its images:
+    dior/JPEGImages-all/*.jpg, dior/Annotations/Horizontal Bounding Boxes/*.xml (VOC xml)
+    fair1m/images/*.tif, fair1m/labelXml/*.xml
+    vedai/Vehicules512/*_co.png, vedai/Annotations512/*.txt
+    dota2/images/*.png, dota2/labelTxt/*.txt
+    xview/train_images/*.tif, xview/xView_train.geojson
+    vme/images/*.png, vme/annotations_OBB/*.txt
+Images are blank (only their header is read by the converters), one file per size is written
+and hard linked to every image name.
+
+usage:
+    python synthetic_data.py /tmp/cdsi_synthetic --num_images 1000 --objects_per_image 30
+"""
+import os
+import random
+import shutil
+from pathlib import Path
+
+import fire
+from PIL import Image
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.json_io import save_json
+
+SOURCES = ["dior", "fair1m", "vedai", "dota2", "xview", "vme"]
+
+# source prefix of the split list lines
+SPLIT_SOURCES = {
+    "dior": "DIOR",
+    "fair1m": "fair1m",
+    "vedai": "vedai",
+    "dota2": "DOTA-v2.0",
+    "xview": "xview",
+    "vme": "VME",
+}
+
+DIOR_CATEGORIES = ["vehicle", "ship", "airplane", "storagetank", "harbor", "bridge", "windmill"]
+FAIR1M_CATEGORIES = ["Small Car", "Van", "Bus", "Cargo Truck", "Boeing737", "Motorboat", "Dump Truck"]
+VEDAI_CATEGORIES = ["1", "2", "4", "9", "10", "11", "31"]
+DOTA_CATEGORIES = ["small-vehicle", "large-vehicle", "plane", "ship", "harbor", "storage-tank"]
+XVIEW_TYPE_IDS = [18, 17, 11, 19, 20, 23, 73, 91]
+VME_CLASSES = [0, 0, 0, 1, 2]
+
+# half sides of the boxes, mostly small objects as in the car splits
+HALF_SIDES = [2, 4, 6, 8, 12, 20, 40]
+
+
+def _blank_images(names, folder, size, fmt, suffix):
+    """
+    Writes one blank image and hard links it to every name in folder
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    template = folder.parent / ("_template" + suffix)
+    save_kwargs = {"compression": "tiff_deflate"} if fmt == "TIFF" else {}
+    Image.new("RGB", size).save(template, format=fmt, **save_kwargs)
+    for name in names:
+        path = folder / name
+        if path.exists():
+            path.unlink()
+        try:
+            os.link(template, path)
+        except OSError:
+            shutil.copyfile(template, path)
+    template.unlink()
+
+
+def _random_corners(rng, width, height):
+    """
+    Returns the 4 (x, y) corners of a random rotated box inside the image
+    """
+    cx, cy = rng.uniform(50, width - 50), rng.uniform(50, height - 50)
+    hw, hh = rng.choice(HALF_SIDES) * rng.uniform(0.5, 1.5), rng.choice(HALF_SIDES) * rng.uniform(0.5, 1.5)
+    dx, dy = rng.uniform(-0.3, 0.3) * hh, rng.uniform(-0.3, 0.3) * hw
+    return [(cx - hw + dx, cy - hh - dy), (cx + hw + dx, cy - hh + dy), (cx + hw - dx, cy + hh + dy), (cx - hw - dx, cy + hh - dy)]
+
+
+def make_dior(root, num_images, objects_per_image, rng):
+    names = ["{:05d}.jpg".format(i + 1) for i in range(num_images)]
+    _blank_images(names, root / "JPEGImages-all", (800, 800), "JPEG", ".jpg")
+    ann_folder = root / "Annotations" / "Horizontal Bounding Boxes"
+    ann_folder.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        objects = []
+        for _ in range(objects_per_image):
+            xs, ys = zip(*_random_corners(rng, 800, 800))
+            objects.append(
+                "<object><name>{}</name><pose>Unspecified</pose>"
+                "<bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax><ymax>{}</ymax></bndbox></object>".format(
+                    rng.choice(DIOR_CATEGORIES), int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys))
+                )
+            )
+        (ann_folder / name.replace(".jpg", ".xml")).write_text(
+            "<annotation><filename>{}</filename><source><database>DIOR</database></source>"
+            "<size><width>800</width><height>800</height><depth>3</depth></size><segmented>0</segmented>"
+            "{}</annotation>".format(name, "".join(objects))
+        )
+    return names
+
+
+def make_fair1m(root, num_images, objects_per_image, rng):
+    names = ["{}.tif".format(i) for i in range(num_images)]
+    _blank_images(names, root / "images", (1000, 1000), "TIFF", ".tif")
+    ann_folder = root / "labelXml"
+    ann_folder.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        objects = []
+        for _ in range(objects_per_image):
+            corners = _random_corners(rng, 1000, 1000)
+            points = "".join("<point>{:.6f},{:.6f}</point>".format(x, y) for x, y in corners + corners[:1])
+            objects.append(
+                "<object><coordinate>pixel</coordinate><type>rectangle</type><description>None</description>"
+                "<possibleresult><name>{}</name><probability>1</probability></possibleresult>"
+                "<points>{}</points></object>".format(rng.choice(FAIR1M_CATEGORIES), points)
+            )
+        (ann_folder / name.replace(".tif", ".xml")).write_text(
+            '<?xml version="1.0" encoding="utf-8"?>\n<annotation>\n'
+            "<source><filename>{}</filename><origin>GF2/GF3</origin></source>\n"
+            "<research><version>1.0</version><provider>FAIR1M</provider></research>\n"
+            "<size><width>1000</width><height>1000</height><depth>3</depth></size>\n"
+            "<objects>{}</objects>\n</annotation>".format(name, "".join(objects))
+        )
+    return names
+
+
+def make_vedai(root, num_images, objects_per_image, rng):
+    names = ["{:08d}_co.png".format(i) for i in range(num_images)]
+    _blank_images(names, root / "Vehicules512", (512, 512), "PNG", ".png")
+    ann_folder = root / "Annotations512"
+    ann_folder.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        lines = []
+        for _ in range(objects_per_image):
+            xs, ys = zip(*_random_corners(rng, 512, 512))
+            # cx cy angle class contained occluded x1..x4 y1..y4
+            lines.append(
+                "{:.6f} {:.6f} {:.6f} {} 1 0 {} {}\n".format(
+                    sum(xs) / 4, sum(ys) / 4, rng.uniform(-3.14, 3.14), rng.choice(VEDAI_CATEGORIES),
+                    " ".join(str(int(x)) for x in xs), " ".join(str(int(y)) for y in ys),
+                )
+            )
+        (ann_folder / name.replace("_co.png", ".txt")).write_text("".join(lines))
+    return names
+
+
+def make_dota2(root, num_images, objects_per_image, rng):
+    names = ["P{:04d}.png".format(i) for i in range(num_images)]
+    _blank_images(names, root / "images", (1024, 1024), "PNG", ".png")
+    ann_folder = root / "labelTxt"
+    ann_folder.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        lines = ["imagesource:GoogleEarth\n", "gsd:0.146343590398\n"]
+        for _ in range(objects_per_image):
+            corners = _random_corners(rng, 1024, 1024)
+            lines.append(
+                " ".join("{:.1f} {:.1f}".format(x, y) for x, y in corners)
+                + " {} {}\n".format(rng.choice(DOTA_CATEGORIES), rng.randint(0, 1))
+            )
+        (ann_folder / name.replace(".png", ".txt")).write_text("".join(lines))
+    return names
+
+
+def make_xview(root, num_images, objects_per_image, rng):
+    names = ["{}.tif".format(i + 1) for i in range(num_images)]
+    _blank_images(names, root / "train_images", (3000, 3000), "TIFF", ".tif")
+    features = []
+    for name in names:
+        for _ in range(objects_per_image):
+            xs, ys = zip(*_random_corners(rng, 3000, 3000))
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [[[-0.1, 0.1], [-0.1, 0.2], [-0.2, 0.2], [-0.1, 0.1]]]},
+                "properties": {
+                    "bounds_imcoords": "{},{},{},{}".format(int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys))),
+                    "edited_by": "synthetic",
+                    "cat_id": len(features),
+                    "type_id": rng.choice(XVIEW_TYPE_IDS),
+                    "ingest_time": "2017/07/24 12:49:09.118+00",
+                    "index_right": 2356,
+                    "image_id": name,
+                    "point_geom": "0101000020E6100000",
+                    "feature_id": len(features),
+                    "grande_batch": 0,
+                },
+            })
+    save_json({"type": "FeatureCollection", "features": features}, root / "xView_train.geojson")
+    return names
+
+
+def make_vme(root, num_images, objects_per_image, rng):
+    names = ["VME{:04d}.png".format(i + 1) for i in range(num_images)]
+    _blank_images(names, root / "images", (512, 512), "PNG", ".png")
+    ann_folder = root / "annotations_OBB"
+    ann_folder.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        lines = []
+        for _ in range(objects_per_image):
+            corners = _random_corners(rng, 512, 512)
+            lines.append(" ".join("{!r} {!r}".format(x, y) for x, y in corners) + " {}\n".format(rng.choice(VME_CLASSES)))
+        (ann_folder / name.replace(".png", ".txt")).write_text("".join(lines) or "\n")
+    return names
+
+
+MAKERS = {
+    "dior": make_dior,
+    "fair1m": make_fair1m,
+    "vedai": make_vedai,
+    "dota2": make_dota2,
+    "xview": make_xview,
+    "vme": make_vme,
+}
+
+
+def generate(root, num_images=200, objects_per_image=30, sources="all", seed=0):
+    """
+    Writes the synthetic datasets under root.
+
+    Args:
+        root: str
+            Output directory
+        num_images: int
+            Number of images of every source
+        objects_per_image: int
+            Number of objects of every image
+        sources: str or list
+            Sources to generate (comma separated), 'all' for SOURCES
+        seed: int
+            Random seed, the same arguments give the same data
+    """
+    root = Path(root)
+    if isinstance(sources, str):
+        sources = SOURCES if sources == "all" else sources.split(",")
+    for source in sources:
+        rng = random.Random("{}-{}".format(seed, source))
+        names = MAKERS[source](root / source, num_images, objects_per_image, rng)
+        with open(root / "{}_split.txt".format(source), "w") as f:
+            for name in names:
+                f.write("{}/{}\n".format(SPLIT_SOURCES[source], name))
+        print("{}: {} images, {} objects".format(source, num_images, num_images * objects_per_image))
+
+
+if __name__ == "__main__":
+    fire.Fire(generate)
@@ -0,0 +1,158 @@
+"""
+read times and peak memory of utils.xml_labels against the former ET.parse tree walk of the
+DIOR and FAIR1M converters, checking that both give the same labels and boxes
+
+The label folders of the real datasets can be given, synthetic FAIR1M/DIOR labels (written
+indented like the released FAIR1M files) are used otherwise.
+
+usage:
+    python benchmarks/xml_labels_benchmark.py --fair1m_dir ../fair1m/labelXml --dior_dir "../dior/Annotations/Horizontal Bounding Boxes"
+    python benchmarks/xml_labels_benchmark.py --num_files 2000 --objects_per_image 100
+"""
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import fire
+import numpy as np
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from benchmarks.synthetic_data import DIOR_CATEGORIES, FAIR1M_CATEGORIES, _random_corners
+from utils.xml_labels import read_dior_labels, read_fair1m_labels
+
+
+def tree_fair1m_labels(annotation_filepath):
+    """
+    Former fair1m_to_coco label parsing: ET.parse and positional indexing
+    """
+    xml_root = ET.parse(annotation_filepath).getroot()
+    labels, boxes = [], []
+    for obj in xml_root[3]:
+        x_corners, y_corners = [], []
+        for p in obj[4]:
+            broken = p.text.split(',')
+            x_corners.append(float(broken[0]))
+            y_corners.append(float(broken[1]))
+        minx, miny = min(x_corners), min(y_corners)
+        labels.append(obj[3][0].text)
+        boxes.append([minx, miny, max(x_corners) - minx, max(y_corners) - miny])
+    return labels, boxes
+
+
+def tree_dior_labels(annotation_filepath):
+    """
+    Former dior_to_coco label parsing: ET.parse and positional indexing
+    """
+    xml_root = ET.parse(annotation_filepath).getroot()
+    labels, boxes = [], []
+    for obj in xml_root.findall('object'):
+        xmin, ymin, xmax, ymax = (int(obj[2][i].text) for i in range(4))
+        labels.append(obj[0].text)
+        boxes.append([xmin, ymin, xmax - xmin, ymax - ymin])
+    return labels, boxes
+
+
+def write_fair1m_xml(path, objects_per_image, rng):
+    objects = []
+    for _ in range(objects_per_image):
+        corners = _random_corners(rng, 1000, 1000)
+        points = "\n".join("\t\t\t\t<point>{:.6f},{:.6f}</point>".format(x, y) for x, y in corners + corners[:1])
+        objects.append(
+            "\t\t<object>\n\t\t\t<coordinate>pixel</coordinate>\n\t\t\t<type>rectangle</type>\n"
+            "\t\t\t<description>None</description>\n\t\t\t<possibleresult>\n\t\t\t\t<name>{}</name>\n"
+            "\t\t\t</possibleresult>\n\t\t\t<points>\n{}\n\t\t\t</points>\n\t\t</object>".format(
+                rng.choice(FAIR1M_CATEGORIES), points
+            )
+        )
+    Path(path).write_text(
+        '<?xml version="1.0" encoding="utf-8"?>\n<annotation>\n\t<source>\n\t\t<filename>{}</filename>\n'
+        "\t\t<origin>GF2/GF3</origin>\n\t</source>\n\t<research>\n\t\t<version>1.0</version>\n\t</research>\n"
+        "\t<size>\n\t\t<width>1000</width>\n\t\t<height>1000</height>\n\t\t<depth>3</depth>\n\t</size>\n"
+        "\t<objects>\n{}\n\t</objects>\n</annotation>\n".format(Path(path).stem + ".tif", "\n".join(objects))
+    )
+
+
+def write_dior_xml(path, objects_per_image, rng):
+    objects = []
+    for _ in range(objects_per_image):
+        xs, ys = zip(*_random_corners(rng, 800, 800))
+        objects.append(
+            "\t<object>\n\t\t<name>{}</name>\n\t\t<pose>Unspecified</pose>\n\t\t<bndbox>\n"
+            "\t\t\t<xmin>{}</xmin>\n\t\t\t<ymin>{}</ymin>\n\t\t\t<xmax>{}</xmax>\n\t\t\t<ymax>{}</ymax>\n"
+            "\t\t</bndbox>\n\t</object>".format(
+                rng.choice(DIOR_CATEGORIES), int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys))
+            )
+        )
+    Path(path).write_text(
+        "<annotation>\n\t<filename>{}</filename>\n\t<source>\n\t\t<database>DIOR</database>\n\t</source>\n"
+        "\t<size>\n\t\t<width>800</width>\n\t\t<height>800</height>\n\t\t<depth>3</depth>\n\t</size>\n"
+        "\t<segmented>0</segmented>\n{}\n</annotation>\n".format(Path(path).stem + ".jpg", "\n".join(objects))
+    )
+
+
+def _measure(func, paths):
+    """
+    Returns (seconds, peak traced MB of a single file read, results) of func over the files
+    """
+    start = time.perf_counter()
+    results = [func(path) for path in paths]
+    seconds = time.perf_counter() - start
+    peak = 0
+    for path in paths[:200]:
+        tracemalloc.start()
+        func(path)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return seconds, peak / 2 ** 20, results
+
+
+def _compare(name, reference, reader, paths):
+    reference_seconds, reference_peak, expected = _measure(reference, paths)
+    seconds, peak, results = _measure(reader, paths)
+    for path, (expected_labels, expected_boxes), (labels, boxes) in zip(paths, expected, results):
+        if list(labels) != list(expected_labels) or not np.array_equal(
+            np.asarray(boxes, dtype=np.float64).reshape(-1, 4), np.asarray(expected_boxes, dtype=np.float64).reshape(-1, 4)
+        ):
+            raise AssertionError("{}: {} differs from the ET.parse result".format(name, path))
+    num_objects = sum(len(labels) for labels, _ in results)
+    print("{}: {} files, {} objects, identical labels and boxes".format(name, len(paths), num_objects))
+    print("    {:<22}{:>9.3f} s{:>10.2f} MB peak".format("ET.parse tree walk", reference_seconds, reference_peak))
+    print("    {:<22}{:>9.3f} s{:>10.2f} MB peak  ({:.1f}x)".format(
+        reader.__name__, seconds, peak, reference_seconds / seconds if seconds else float("inf")))
+
+
+def xml_labels_benchmark(fair1m_dir=None, dior_dir=None, num_files=1000, objects_per_image=60, seed=0):
+    """
+    Args:
+        fair1m_dir: str
+            FAIR1M labelXml folder, synthetic files if not provided
+        dior_dir: str
+            DIOR 'Annotations/Horizontal Bounding Boxes' folder, synthetic files if not provided
+        num_files: int
+            Number of synthetic files of every format
+        objects_per_image: int
+            Mean number of objects of the synthetic files
+        seed: int
+            Random seed of the synthetic files
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        folders = {}
+        for name, folder, write in [("fair1m", fair1m_dir, write_fair1m_xml), ("dior", dior_dir, write_dior_xml)]:
+            if folder is None:
+                folder = os.path.join(tmp_dir, name)
+                os.makedirs(folder)
+                for i in range(num_files):
+                    write(os.path.join(folder, "{}.xml".format(i)), rng.randint(1, 2 * objects_per_image), rng)
+            folders[name] = sorted(str(path) for path in Path(folder).glob("*.xml"))
+        _compare("fair1m", tree_fair1m_labels, read_fair1m_labels, folders["fair1m"])
+        _compare("dior", tree_dior_labels, read_dior_labels, folders["dior"])
+
+
+if __name__ == "__main__":
+    fire.Fire(xml_labels_benchmark)
@@ -1,13 +1,19 @@
 import os
+from functools import partial
 from pathlib import Path
 import fire
-from PIL import Image
-from sahi.utils.coco import Coco, CocoAnnotation, CocoCategory, CocoImage
-from sahi.utils.file import save_json
-from tqdm import tqdm
-import xml.etree.ElementTree as ET
 import sys;
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.annotation_store import AnnotationStore
+from utils.coco_writer import CocoJsonWriter
+from utils.instrumentation import count, stage, start_run
+from utils.modes import get_output_path, get_report_path, parse_modes
+from utils.image_meta import open_image_size_cache, probe_image
+from utils.parallel import map_images
+from utils.split_manifest import load_split_members
+from utils.xml_labels import read_dior_labels
+
 
 NAME_TO_COCO_CATEGORY = {
     "stadium": {"name": "stadium", "supercategory": "stadium"},
@@ -56,12 +62,78 @@ CATEGORY_ID_REMAPPING = {
 }
 
 
+def parse_dior_image(image_filename, data_folder_dir, input_image_folder, input_ann_folder):
+    """
+    Reads the size and the horizontal boxes of a single DIOR image.
+
+    Returns:
+        (cocoimage_filename, image_info, labels, boxes) where labels holds the
+        category_name and boxes the [xmin, ymin, width, height] of every object
+    """
+    # get image properties
+    image_filepath = str(Path(input_image_folder) / image_filename)
+    annotation_filename = image_filename.split(".jpg")[0] + ".xml"
+    annotation_filepath = str(Path(input_ann_folder) / annotation_filename)
+    image_info = probe_image(image_filepath)
+    cocoimage_filename = str(Path(image_filepath)).split(str(Path(data_folder_dir)))[1]
+    if cocoimage_filename[0] == os.sep:
+        cocoimage_filename = cocoimage_filename[1:]
+    # read xml annotation file
+    with stage("label_parse"):
+        labels, boxes = read_dior_labels(annotation_filepath)
+    count("label_files")
+    count("bytes_read", os.path.getsize(annotation_filepath))
+    return cocoimage_filename, image_info, labels, boxes
+
+
+# (min_area, max_area) of the boxes kept by each mode, min_area < area < max_area
+MODE_AREA_RANGE = {'original': (0, None), 'car_other': (0, 400), 'car': (0, 400)}
+
+
+def get_mode_setup(mode, category_id_remapping):
+    """
+    Returns the coco categories and the category id remapping of a conversion mode
+    """
+    category_id_remapping = dict(category_id_remapping)
+    categories = []
+    if mode == 'original':
+        # append categories
+        category_names = ["stadium", "Expressway-toll-station", "bridge", "groundtrackfield", "Expressway-Service-area", "dam",
+                      "ship", "basketballcourt", "vehicle", "golffield", "airplane", "baseballfield", "airport",
+                      "harbor", "chimney", "tenniscourt", "trainstation", "overpass", "storagetank", "windmill"]
+        for i, cat in enumerate(category_names):
+            categories.append(dict(id=i, name=cat))
+    
+    elif mode == 'car_other':
+        print('"car_other" mode categories')
+        categories.append(dict(id=0, name='Other'))
+        categories.append(dict(id=1, name='Car'))
+        for k,v in category_id_remapping.items():
+            if k in 'vehicle':
+                category_id_remapping[k] =1
+            else:
+                category_id_remapping[k]=0
+    elif mode == 'car':
+        # car related categories: car, pickup, van
+        print('"car" mode categories')
+        categories.append(dict(id=0, name='Car'))
+        category_id_remapping = {'vehicle': '0'}
+    else:
+        print('pick a defined mode: [original/car_other/car]')
+        sys.exit()
+    return categories, category_id_remapping
+
+
 def dior_to_coco(
     data_folder_dir,
     split_images_path,
     output_file_path,
     mode,
     category_id_remapping=None,
+    workers=1,
+    prefetch=0,
+    image_size_cache=None,
+    stats=True,
 ):
     """
     Converts DIOR annotations into coco annotation.
@@ -70,125 +142,71 @@ def dior_to_coco(
         data_folder_dir: str
             'dior' folder directory
         split_images_path: str
-            split_images_path txt file
+            split list txt file or split name of the manifest (e.g. CDSI_train)
         output_file_path: str
             Output file path
-        mode: str
-            mode original|car_other|car
+        mode: str or list
+            mode original|car_other|car, 'all' or several modes (e.g. original,car) converted
+            in a single pass, each written to <output>/<mode>/<split>.json
         category_id_remapping: dict
             Used for selecting desired category ids and mapping them.
             If not provided, vedai mapping will be used.
             format: str(id) to str(id)
+        workers: int
+            Number of processes used to parse the images, 1 runs serially
+        prefetch: int
+            Number of images parsed ahead on a thread pool when running serially, so that their
+            file reads overlap with the current one, 0 disables it
+        image_size_cache: str
+            Image size cache file, the default one if not provided, False disables it
+        stats: bool
+            Saves the run statistics (stage times, counters, peak memory) to
+            <output>/<split>.stats.json
     """
 
     # init paths/folders
     input_image_folder = str(Path(data_folder_dir) / "JPEGImages-all")
     input_ann_folder = str(Path(data_folder_dir) / "Annotations/Horizontal Bounding Boxes")
 
-    image_filepath_list = os.listdir(input_image_folder)
-    
     if category_id_remapping is None:
         category_id_remapping = CATEGORY_ID_REMAPPING
-    
-    # init coco object
-    coco = Coco()
-    
-    if mode == 'original':
-        # append categories
-        categories = ["stadium", "Expressway-toll-station", "bridge", "groundtrackfield", "Expressway-Service-area", "dam",
-                      "ship", "basketballcourt", "vehicle", "golffield", "airplane", "baseballfield", "airport",
-                      "harbor", "chimney", "tenniscourt", "trainstation", "overpass", "storagetank", "windmill"]
-        for i, cat in enumerate(categories):
-            coco.add_category(CocoCategory(id=i, name=cat))
-    
-    elif mode == 'car_other':
-        print('"car_other" mode categories')
-        coco.add_category(CocoCategory(id=0, name='Other'))
-        coco.add_category(CocoCategory(id=1, name='Car'))
-        for k,v in category_id_remapping.items():
-            if k in 'vehicle':
-                category_id_remapping[k] =1
-            else:
-                category_id_remapping[k]=0
-    elif mode == 'car':
-        # car related categories: car, pickup, van
-        print('"car" mode categories')
-        coco.add_category(CocoCategory(id=0, name='Car'))
-        category_id_remapping = {'vehicle': '0'}
-    else:
-        print('pick a defined mode: [original/car_other/car]')
-        sys.exit()
+
+    modes = parse_modes(mode)
+    mode_setups = [get_mode_setup(m, category_id_remapping) for m in modes]
+    run = start_run("dior_to_coco", split=str(split_images_path), modes=modes, workers=workers, prefetch=prefetch)
     
     
-    split_images_lst = []
-    with open(split_images_path, 'r') as f:
-        for line in f:
-            split_images_lst.append(line.strip().split('/')[1])
+    # split members, in split list order
+    image_filename_list = load_split_members(split_images_path, 'DIOR', input_image_folder)
+    image_cache = open_image_size_cache(image_size_cache)
+    parse_image = partial(
+        parse_dior_image,
+        data_folder_dir=data_folder_dir,
+        input_image_folder=input_image_folder,
+        input_ann_folder=input_ann_folder,
+    )
 
     # convert dior annotations to coco
-    for image_filename in tqdm(image_filepath_list):
-        if image_filename in split_images_lst:
-            # get image properties
-            image_filepath = str(Path(input_image_folder) / image_filename)
-            annotation_filename = image_filename.split(".jpg")[0] + ".xml"
-            annotation_filepath = str(Path(input_ann_folder) / annotation_filename)
-            image = Image.open(image_filepath)
-            cocoimage_filename = str(Path(image_filepath)).split(str(Path(data_folder_dir)))[1]
-            if cocoimage_filename[0] == os.sep:
-                cocoimage_filename = cocoimage_filename[1:]
-            # create coco image object
-            coco_image = CocoImage(file_name=cocoimage_filename, height=image.size[1], width=image.size[0])
-            # read xml annotation file
-            tree = ET.parse(annotation_filepath)
-            xml_root = tree.getroot()
-
-            # get all object tags in the xml file
-            objects = xml_root.findall('object')
-
-            for obj in objects:
-                cat_name = obj[0].text
-                bbox_tag = obj[2]
-                xmin = int(obj[2][0].text)
-                ymin = int(obj[2][1].text)
-                xmax = int(obj[2][2].text)
-                ymax = int(obj[2][3].text)
-                #
-                # width = maxx-minx, height = maxy-miny
-                width = xmax - xmin
-                height = ymax - ymin
-
-                bbox = [xmin,
-                        ymin,
-                        width,
-                        height]
-
-                # get category id and name
-                category_name = cat_name
-                if category_name in category_id_remapping.keys():
-                        remapped_category_id = category_id_remapping[category_name]
-                else:
-                    continue
-
-                # create coco annotation and append it to coco image
-                coco_annotation = CocoAnnotation.from_coco_bbox(
-                    bbox=bbox,
-                    category_id=int(remapped_category_id),
-                    category_name=category_name,
-                )
-                if mode == 'original':
-                    if coco_annotation.area > 0:
-                        coco_image.add_annotation(coco_annotation)
-                elif mode == 'car_other':
-                    if 0 < coco_annotation.area < 400:
-                        coco_image.add_annotation(coco_annotation)
-                elif mode == 'car':
-                    if 0 < coco_annotation.area < 400:
-                        coco_image.add_annotation(coco_annotation)
-            coco.add_image(coco_image)
-
-    save_path = output_file_path
-    all_json_path = Path(save_path) / "{}.json".format(split_images_path.split('.')[0])
-    save_json(data=coco.json, save_path=all_json_path)
+    store = AnnotationStore()
+    for cocoimage_filename, image_info, labels, boxes in map_images(parse_image, image_filename_list, workers=workers, prefetch=prefetch):
+        count("images")
+        count("annotations_parsed", len(boxes))
+        if image_cache is not None:
+            image_cache.store(image_info)
+        store.add_image(cocoimage_filename, image_info.width, image_info.height, labels, boxes)
+
+    if image_cache is not None:
+        image_cache.save()
+    # write every mode from the same parsed data
+    for m, (categories, mode_category_id_remapping) in zip(modes, mode_setups):
+        coco = CocoJsonWriter(get_output_path(output_file_path, split_images_path, m, modes))
+        for category in categories:
+            coco.add_category(**category)
+        min_area, max_area = MODE_AREA_RANGE[m]
+        store.write_coco(coco, mode_category_id_remapping, min_area=min_area, max_area=max_area, group=m)
+        coco.close()
+    if stats:
+        run.save(get_report_path(output_file_path, split_images_path))
 
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
 import os
+from functools import partial
 from pathlib import Path
 import fire
-from PIL import Image
-from sahi.utils.coco import Coco, CocoAnnotation, CocoCategory, CocoImage
-from sahi.utils.file import save_json
-from tqdm import tqdm
 import sys
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.annotation_store import AnnotationStore
+from utils.coco_writer import CocoJsonWriter
+from utils.instrumentation import count, stage, start_run
+from utils.modes import get_output_path, get_report_path, parse_modes
+from utils.image_meta import open_image_size_cache, probe_image
+from utils.parallel import map_images
+from utils.split_manifest import load_split_members
+
 
 CATEGORY_ID_REMAPPING = {
     "plane": "0",
@@ -29,156 +35,179 @@ CATEGORY_ID_REMAPPING = {
     "helipad": "17"
 }
 
+def parse_dota2_image(image_filename, data_folder_dir, input_image_folder, input_ann_folder):
+    """
+    Reads the size and the oriented boxes (as horizontal boxes) of a single dota2 image.
+
+    Returns:
+        (cocoimage_filename, image_info, labels, boxes) where labels holds the
+        category_name and boxes the [xmin, ymin, width, height] of every object
+    """
+    # get image properties
+    image_filepath = str(Path(input_image_folder) / image_filename)
+    annotation_filename = image_filename.split(".png")[0] + ".txt"
+    annotation_filepath = str(Path(input_ann_folder) / annotation_filename)
+    image_info = probe_image(image_filepath)
+    cocoimage_filename = str(Path(image_filepath)).split(str(Path(data_folder_dir)))[1]
+    if cocoimage_filename[0] == os.sep:
+        cocoimage_filename = cocoimage_filename[1:]
+    # parse annotation file
+    with stage("label_parse"):
+        labels, boxes = parse_dota2_labels(annotation_filepath)
+    return cocoimage_filename, image_info, labels, boxes
+
+
+def parse_dota2_labels(annotation_filepath):
+    """
+    Returns the (labels, boxes) of a dota2 label file, the header lines (imagesource, gsd)
+    have a single token and are skipped
+    """
+    with open(annotation_filepath, "r") as file:
+        lines = file.readlines()
+    count("label_files")
+    count("bytes_read", sum(len(line) for line in lines))
+    labels = []
+    boxes = []
+    for line in lines:
+        # x1 y1 x2 y2 x3 y3 x4 y4 category difficult
+        broken = line.strip().split(' ')
+        if len(broken) > 1:
+            x_corners = [int(float(broken[0])), int(float(broken[2])), int(float(broken[4])), int(float(broken[6]))]
+            y_corners = [int(float(broken[1])), int(float(broken[3])), int(float(broken[5])), int(float(broken[7]))]
+
+            minx = min(x_corners)
+            miny = min(y_corners)
+            # width = maxx-minx, height = maxy-miny
+            width = max(x_corners) - minx
+            height = max(y_corners) - miny
+
+            bbox = [minx,
+                    miny,
+                    width,
+                    height]
+            labels.append(broken[8])
+            boxes.append(bbox)
+
+    return labels, boxes
+
+
+# (min_area, max_area) of the boxes kept by each mode, min_area < area < max_area
+MODE_AREA_RANGE = {'original': (0, None), 'car_other': (0, 400), 'car': (0, 400)}
+
+
+def get_mode_setup(mode, category_id_remapping):
+    """
+    Returns the coco categories and the category id remapping of a conversion mode
+    """
+    category_id_remapping = dict(category_id_remapping)
+    categories = []
+    if mode == 'original':
+        # append categories
+        category_names = ["plane", "baseball-diamond", "bridge", "ground-track-field", "small-vehicle", "large-vehicle", "ship", "tennis-court", "basketball-court", "storage-tank", "soccer-ball-field", "roundabout", "harbor", "swimming-pool", "helicopter", "container-crane", "airport", "helipad"]
+        for i, cat in enumerate(category_names):
+            categories.append(dict(id=i, name=cat))
+    elif mode == 'car_other':
+        print('"car_other" mode categories')
+        categories.append(dict(id=0, name='Other'))
+        categories.append(dict(id=1, name='Car'))
+        for k,v in category_id_remapping.items():
+            if k in 'small-vehicle':
+                category_id_remapping[k] =1
+            else:
+                category_id_remapping[k]=0
+    elif mode == 'car':
+        # car related categories: car, pickup, van
+        print('"car" mode categories')
+        categories.append(dict(id=0, name='Car'))
+        category_id_remapping = {'small-vehicle': '0'}
+    else:
+        print('pick a defined mode: [original/car_other/car]')
+        sys.exit()
+    return categories, category_id_remapping
+
+
 def dota2_to_coco(
     data_folder_dir,
     split_images_path,
     output_file_path,
     mode,
     category_id_remapping=None,
+    workers=1,
+    prefetch=0,
+    image_size_cache=None,
+    stats=True,
 ):
     """
     Converts dota2 annotations into coco annotation.
 
     Args:
         data_folder_dir: str
-            'fair1m' folder directory
+            'dota2' folder directory
+        split_images_path: str
+            split list txt file or split name of the manifest (e.g. CDSI_train)
         output_file_path: str
             Output file path
+        mode: str or list
+            mode original|car_other|car, 'all' or several modes (e.g. original,car) converted
+            in a single pass, each written to <output>/<mode>/<split>.json
         category_id_remapping: dict
             Used for selecting desired category ids and mapping them.
             If not provided, vedai mapping will be used.
             format: str(id) to str(id)
+        workers: int
+            Number of processes used to parse the images, 1 runs serially
+        prefetch: int
+            Number of images parsed ahead on a thread pool when running serially, so that their
+            file reads overlap with the current one, 0 disables it
+        image_size_cache: str
+            Image size cache file, the default one if not provided, False disables it
+        stats: bool
+            Saves the run statistics (stage times, counters, peak memory) to
+            <output>/<split>.stats.json
     """
 
     # init paths/folders
     input_image_folder = str(Path(data_folder_dir) / "images")
     input_ann_folder = str(Path(data_folder_dir) / "labelTxt")
 
-    image_filepath_list = os.listdir(input_image_folder)
-    
     if category_id_remapping is None:
         category_id_remapping = CATEGORY_ID_REMAPPING
+
+    modes = parse_modes(mode)
+    mode_setups = [get_mode_setup(m, category_id_remapping) for m in modes]
+    run = start_run("dota2_to_coco", split=str(split_images_path), modes=modes, workers=workers, prefetch=prefetch)
     
-    # init coco object
-    coco = Coco()
-    
-    if mode == 'original':
-        # append categories
-        categories = ["plane", "baseball-diamond", "bridge", "ground-track-field", "small-vehicle", "large-vehicle", "ship", "tennis-court", "basketball-court", "storage-tank", "soccer-ball-field", "roundabout", "harbor", "swimming-pool", "helicopter", "container-crane", "airport", "helipad"]
-        for i, cat in enumerate(categories):
-            coco.add_category(CocoCategory(id=i, name=cat))
-    elif mode == 'car_other':
-        print('"car_other" mode categories')
-        coco.add_category(CocoCategory(id=0, name='Other'))
-        coco.add_category(CocoCategory(id=1, name='Car'))
-        for k,v in category_id_remapping.items():
-            if k in 'small-vehicle':
-                category_id_remapping[k] =1
-            else:
-                category_id_remapping[k]=0
-    elif mode == 'car':
-        # car related categories: car, pickup, van
-        print('"car" mode categories')
-        coco.add_category(CocoCategory(id=0, name='Car'))
-        category_id_remapping = {'small-vehicle': '0'}
-    else:
-        print('pick a defined mode: [original/car_other/car]')
-        sys.exit()
-    
-    split_images_lst = []
-    with open(split_images_path, 'r') as f:
-        for line in f:
-            broken = line.strip().split('/')
-            if len(broken) > 1:
-                split_images_lst.append(broken[1])
-            else:
-                split_images_lst.append(broken[0])
-    
-    cnt=0
-    broken_set = set()
-    # convert fair1m annotations to coco
-    for image_filename in tqdm(image_filepath_list):
-        if image_filename in split_images_lst:
-            cnt+=1
-            # get image properties
-            image_filepath = str(Path(input_image_folder) / image_filename)
-            annotation_filename = image_filename.split(".png")[0] + ".txt"
-            annotation_filepath = str(Path(input_ann_folder) / annotation_filename)
-            image = Image.open(image_filepath)
-            cocoimage_filename = str(Path(image_filepath)).split(str(Path(data_folder_dir)))[1]
-            if cocoimage_filename[0] == os.sep:
-                cocoimage_filename = cocoimage_filename[1:]
-            # create coco image object
-            coco_image = CocoImage(file_name=cocoimage_filename, height=image.size[1], width=image.size[0])
-            # parse annotation file
-            ###
-            file = open(annotation_filepath, "r")
-            lines = file.readlines()
-            for line in lines:
-                # x1 y1 x2 y2 x3 y3 x4 y4 category difficult
-                broken = line.strip().split(' ')
-                broken_set.add(len(broken))
-                if len(broken) > 1:
-                    x_corners = []
-                    y_corners = []
-                
-                    x_corners.append(int(float(broken[0])))
-                    x_corners.append(int(float(broken[2])))
-                    x_corners.append(int(float(broken[4])))
-                    x_corners.append(int(float(broken[6])))
-                    #
-                    y_corners.append(int(float(broken[1])))
-                    y_corners.append(int(float(broken[3])))
-                    y_corners.append(int(float(broken[5])))
-                    y_corners.append(int(float(broken[7])))
-
-                    minx = min(x_corners)
-                    miny = min(y_corners)
-                    maxx = max(x_corners)
-                    maxy = max(y_corners)
-
-                    tbox = [minx, miny, maxx, maxy]
-                    # width = maxx-minx, height = maxy-miny
-                    width = tbox[2] - tbox[0]
-                    height = tbox[3] - tbox[1]
-
-                    bbox = [minx,
-                            miny,
-                            width,
-                            height]
-                    obj_area = width * height
-
-                    category_name = broken[8]
-                    if category_name in category_id_remapping.keys():
-                        remapped_category_id = category_id_remapping[category_name]
-                    else:
-                        continue
-
-                    # create coco annotation and append it to coco image
-                    coco_annotation = CocoAnnotation.from_coco_bbox(
-                        bbox=bbox,
-                        category_id=int(remapped_category_id),
-                        category_name=category_name,
-                    )
-                    if mode == 'original':
-                        if coco_annotation.area > 0:
-                            coco_image.add_annotation(coco_annotation)
-                    elif mode == 'car_other':
-                        if 0 < coco_annotation.area < 400:
-                            coco_image.add_annotation(coco_annotation)
-                    elif mode == 'car':
-                        if 0 < coco_annotation.area < 400:
-#                         if 0 < obj_area < 400:
-                            coco_image.add_annotation(coco_annotation)
-                else:
-                    continue
-            
-            coco.add_image(coco_image)
-    
-    print('cnt', cnt, 'broken_set', broken_set)
-    save_path = output_file_path
-    all_json_path = Path(save_path) / "{}.json".format(split_images_path.split('.')[0])
-    save_json(data=coco.json, save_path=all_json_path)
+    # split members, in split list order
+    image_filename_list = load_split_members(split_images_path, 'DOTA-v2.0', input_image_folder)
+    image_cache = open_image_size_cache(image_size_cache)
+    parse_image = partial(
+        parse_dota2_image,
+        data_folder_dir=data_folder_dir,
+        input_image_folder=input_image_folder,
+        input_ann_folder=input_ann_folder,
+    )
+
+    # convert dota2 annotations to coco
+    store = AnnotationStore()
+    for cocoimage_filename, image_info, labels, boxes in map_images(parse_image, image_filename_list, workers=workers, prefetch=prefetch):
+        count("images")
+        count("annotations_parsed", len(boxes))
+        if image_cache is not None:
+            image_cache.store(image_info)
+        store.add_image(cocoimage_filename, image_info.width, image_info.height, labels, boxes)
+
+    if image_cache is not None:
+        image_cache.save()
+    # write every mode from the same parsed data
+    for m, (categories, mode_category_id_remapping) in zip(modes, mode_setups):
+        coco = CocoJsonWriter(get_output_path(output_file_path, split_images_path, m, modes))
+        for category in categories:
+            coco.add_category(**category)
+        min_area, max_area = MODE_AREA_RANGE[m]
+        store.write_coco(coco, mode_category_id_remapping, min_area=min_area, max_area=max_area, group=m)
+        coco.close()
+    if stats:
+        run.save(get_report_path(output_file_path, split_images_path))
 
 
 if __name__ == "__main__":
@@ -1,32 +1,133 @@
 """
 this script is written to filter existing dota-coco files generated using dotadevkit for all categories
+
+The input is streamed (annotations first, then images), so memory does not depend on its size.
 """
+import os
 import sys
 import argparse
-import json
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.instrumentation import count, stage, start_run
+from utils.json_io import dumps
+from utils.json_stream import JsonArray, iter_json_sections
+
 
+# ids from 0 to MAX_BITMAP_ID - 1 are kept in the bitmap (16 MiB at most), others in a set
+MAX_BITMAP_ID = 1 << 27
 
-def read_json_data(filename):
+
+class ImageIdBitmap:
     """
-    Get json object from file
-    :param filename: path with filename
-    :return: json data
+    Compact set of the kept image ids: a packed bitmap (one bit per id) for the non negative
+    integer ids under MAX_BITMAP_ID, a set for any other id (negative, large sparse or str ids)
     """
-    with open(filename) as json_file:
-        data = json.load(json_file)
-    return data
 
+    def __init__(self, size=1024):
+        self.bits = np.zeros((size + 7) >> 3, dtype=np.uint8)
+        self.others = set()
+
+    @staticmethod
+    def _in_bitmap(image_id):
+        return isinstance(image_id, (int, np.integer)) and not isinstance(image_id, bool) and (
+            0 <= image_id < MAX_BITMAP_ID)
+
+    def add(self, image_id):
+        if not self._in_bitmap(image_id):
+            self.others.add(image_id)
+            return
+        index = image_id >> 3
+        if index >= len(self.bits):
+            size = max(index + 1, 2 * len(self.bits))
+            self.bits = np.concatenate([self.bits, np.zeros(size - len(self.bits), dtype=np.uint8)])
+        self.bits[index] |= 1 << (image_id & 7)
 
-def write_to_json(data, filename):
+    def __contains__(self, image_id):
+        if not self._in_bitmap(image_id):
+            return image_id in self.others
+        index = image_id >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (image_id & 7)))
+
+    def __len__(self):
+        return int(np.unpackbits(self.bits).sum()) + len(self.others)
+
+
+def filter_annotations(input_file, spool, car_only_mode, max_area):
+    """
+    First pass: streams the annotations, writes the kept (remapped) ones to spool
+    :return: (kept image ids, number of images, number of annotations, number of kept annotations, categories)
     """
-    Write dictionary to json file
-    :param data: dictionary data
-    :param filename: filename to write
-    :return: None
+    img_ids = ImageIdBitmap()
+    num_images = num_annotations = num_kept = 0
+    categories = []
+    for key, value in iter_json_sections(input_file):
+        if key == 'images':
+            for _ in value:
+                num_images += 1
+        elif key == 'categories':
+            categories = list(value)
+        elif key == 'annotations':
+            for ann in value:
+                num_annotations += 1
+                if ann['area'] >= max_area:
+                    count('dropped_area')
+                    continue
+                if car_only_mode:
+                    if ann['category_id'] != 5:
+                        count('dropped_category')
+                        continue
+                    ann['category_id'] = 0
+                elif ann['category_id'] == 5: # car category
+                    ann['category_id'] = 1
+                else:
+                    ann['category_id'] = 0
+                if num_kept:
+                    spool.write(',')
+                spool.write(dumps(ann))
+                num_kept += 1
+                img_ids.add(ann['image_id'])
+    return img_ids, num_images, num_annotations, num_kept, categories
+
+
+def write_filtered_json(input_file, out_file, spool, img_ids, categories):
+    """
+    Second pass: writes the input keys in order (compact json) with the kept images,
+    the spooled annotations and the new categories
+    :return: number of kept images
     """
     print('writing the result in json file')
-    with open(filename, 'w') as outfile:
-        json.dump(data, outfile)
+    num_images = 0
+    with open(out_file, 'w', encoding='utf-8') as outfile:
+        outfile.write('{')
+        for i, (key, value) in enumerate(iter_json_sections(input_file)):
+            if i:
+                outfile.write(',')
+            outfile.write(dumps(key) + ':')
+            if key == 'images':
+                outfile.write('[')
+                for img in value:
+                    if img['id'] in img_ids:
+                        if num_images:
+                            outfile.write(',')
+                        outfile.write(dumps(img))
+                        num_images += 1
+                outfile.write(']')
+            elif key == 'annotations':
+                outfile.write('[')
+                spool.seek(0)
+                shutil.copyfileobj(spool, outfile)
+                outfile.write(']')
+            elif key == 'categories':
+                outfile.write(dumps(categories))
+            else:
+                outfile.write(dumps(list(value) if isinstance(value, JsonArray) else value))
+        outfile.write('}')
+    return num_images
 
 
 parser = argparse.ArgumentParser(description='DOTA-v2.0 coco files filter')
@@ -34,6 +135,8 @@ parser.add_argument('-f', '--input-file', dest='input_file', metavar='PATH', hel
 parser.add_argument('-o', '--out-file', dest='out_file', metavar='PATH', help='out coco json file')
 parser.add_argument('-x', '--max', dest='max', type=int, metavar='N', help='max area')
 parser.add_argument('--car-only', action='store_true', help='car-only mode')
+parser.add_argument('--no-stats', dest='stats', action='store_false',
+                    help='do not save the run statistics to <out-file>.stats.json')
 args = parser.parse_args()
 
 coco_json_file = args.input_file
@@ -41,62 +144,39 @@ out_coco_json_file = args.out_file
 car_only_mode = args.car_only
 max_area = args.max
 
-data = read_json_data(coco_json_file)
-
-print('original_images_len', len(data['images']))
-print('original_annotations_len', len(data['annotations']))
-print('original_categories_len', len(data['categories']))
-print('original_categories', data['categories'])
-
-new_lst = []
-img_ids = set()
-
 if car_only_mode:
-    for ann in data['annotations']:
-        if ann['area'] < max_area and ann['category_id'] == 5:
-            ann['category_id'] = 0
-            new_lst.append(ann)
-            img_ids.add(ann['image_id'])
-
-    data['annotations'] = new_lst
-
-    imgs_uniq = []
-    for i in data['images']:
-        if i['id'] in img_ids:
-            imgs_uniq.append(i)
-
-
-    data['images'] = imgs_uniq
-    data['categories'] = [{'id': 0, 'name': 'Car', 'supercategory': 'Car'}]
-
+    categories = [{'id': 0, 'name': 'Car', 'supercategory': 'Car'}]
 else:
-    print('=== car-other mode ===')
-    
-    for ann in data['annotations']:
-        if ann['area'] < max_area:
-            if ann['category_id'] == 5: # car category
-                ann['category_id'] = 1
-            else:
-                ann['category_id'] = 0
-            new_lst.append(ann)
-            img_ids.add(ann['image_id'])
-
-    data['annotations'] = new_lst
-
-    imgs_uniq = []
-    for i in data['images']:
-        if i['id'] in img_ids:
-            imgs_uniq.append(i)
-
-
-    data['images'] = imgs_uniq
-    data['categories'] = [{'id': 0, 'name': 'Other', 'supercategory': 'Other'}, {'id': 1, 'name': 'Car', 'supercategory': 'Car'}]
-    
-    print('=== END car-other mode ===')
+    categories = [{'id': 0, 'name': 'Other', 'supercategory': 'Other'}, {'id': 1, 'name': 'Car', 'supercategory': 'Car'}]
+
+run = start_run('filter_dota_coco', input_file=coco_json_file, car_only=car_only_mode, max_area=max_area)
+# the input is streamed twice (annotations, then images and output), only the kept image ids
+# and the kept annotations (spooled to disk) are held
+with tempfile.TemporaryFile('w+') as spool:
+    with stage('filter_remap'):
+        img_ids, num_images, num_annotations, num_kept, original_categories = filter_annotations(
+            coco_json_file, spool, car_only_mode, max_area)
+
+    print('original_images_len', num_images)
+    print('original_annotations_len', num_annotations)
+    print('original_categories_len', len(original_categories))
+    print('original_categories', original_categories)
+    if not car_only_mode:
+        print('=== car-other mode ===')
+        print('=== END car-other mode ===')
+
+    with stage('serialization'):
+        num_kept_images = write_filtered_json(coco_json_file, out_coco_json_file, spool, img_ids, categories)
 
 print('====================================')
-print('modified_images_len', len(data['images']))
-print('modified_annotations_len', len(data['annotations']))
-print('modified_categories_len', len(data['categories']))
-
-write_to_json(data, out_coco_json_file)
+print('modified_images_len', num_kept_images)
+print('modified_annotations_len', num_kept)
+print('modified_categories_len', len(categories))
+
+count('bytes_read', 2 * os.path.getsize(coco_json_file))
+count('images', num_images)
+count('annotations_parsed', num_annotations)
+count('images_written', num_kept_images)
+count('annotations_kept', num_kept)
+if args.stats:
+    run.save('{}.stats.json'.format(os.path.splitext(out_coco_json_file)[0]))
@@ -0,0 +1,472 @@
+"""
+COCO bbox mAP of a detection results file against a COCO ground truth file (annotations_HBB,
+a converter output or a merged CDSI split), giving the numbers of pycocotools COCOeval
+
+The pycocotools per-image python loops are replaced by array operations:
+    - the IoU matrix of the detections and ground truths of an image and category is computed
+      at once with numpy broadcasting
+    - the greedy matching only visits the detection/ground truth pairs above IoU 0.5, sorted
+      at once in the COCOeval order of preference, instead of every pair at every threshold
+    - the matching is shared by the area ranges ignoring the same ground truths (e.g. 'all' and
+      'small' on car scenes)
+    - the images are spread over worker processes, the precision/recall accumulation runs
+      on the concatenated arrays of every category and area range
+Boxes with an empty bbox (the zero area boxes of the converters) are ignored ground truths.
+
+usage:
+    python evaluation/coco_eval.py ../VME_annotations/annotations_HBB/test.json results.json --workers 8
+    python evaluation/coco_eval.py CDSI_test.json results.json --output CDSI_test_metrics.json
+"""
+from functools import partial
+from pathlib import Path
+
+import fire
+import numpy as np
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from evaluation.prediction_cache import PredictionCache, is_prediction_cache
+from utils.json_io import load_json, save_json
+from utils.parallel import map_images
+
+# COCOeval default bbox parameters
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_THRESHOLDS = np.linspace(0.0, 1.0, 101)
+MAX_DETS = (1, 10, 100)
+AREA_RANGES = (("all", (0, 1e10)), ("small", (0, 32 ** 2)), ("medium", (32 ** 2, 96 ** 2)), ("large", (96 ** 2, 1e10)))
+# name, average precision (else recall), IoU threshold (None for 0.50:0.95), area range, max detections
+SUMMARY = (
+    ("AP", True, None, "all", 100),
+    ("AP50", True, 0.5, "all", 100),
+    ("AP75", True, 0.75, "all", 100),
+    ("APs", True, None, "small", 100),
+    ("APm", True, None, "medium", 100),
+    ("APl", True, None, "large", 100),
+    ("AR1", False, None, "all", 1),
+    ("AR10", False, None, "all", 10),
+    ("AR100", False, None, "all", 100),
+    ("ARs", False, None, "small", 100),
+    ("ARm", False, None, "medium", 100),
+    ("ARl", False, None, "large", 100),
+)
+
+
+class GroundTruthIndex:
+    """
+    Ground truth boxes grouped by image, images and categories sorted by id as in COCOeval.
+    Annotations of unknown images or categories are dropped.
+
+    Args:
+        image_ids: list
+            Ids of the evaluated images
+        categories: list
+            COCO category dicts (id, name)
+        annotation_image_ids, category_ids, areas, annotation_ids: np.ndarray
+            (N,) columns of the annotations
+        boxes: np.ndarray
+            (N, K) boxes, [xmin, ymin, width, height] or the 8 corners of oriented boxes
+        iscrowd: np.ndarray
+            (N,) crowd flags, no crowd if not provided
+        ignore: np.ndarray
+            (N,) annotations always ignored (crowds are), none if not provided
+    """
+
+    def __init__(self, image_ids, categories, annotation_image_ids, category_ids, boxes, areas, annotation_ids,
+                 iscrowd=None, ignore=None):
+        self.image_ids = np.array(sorted(image_ids), dtype=np.int64)
+        self.categories = sorted(categories, key=lambda category: category["id"])
+        self.category_ids = np.array([category["id"] for category in self.categories], dtype=np.int64)
+
+        category_ids = np.asarray(category_ids, dtype=np.int64)
+        image_index = self.index_images(annotation_image_ids)
+        keep = (image_index >= 0) & np.isin(category_ids, self.category_ids)
+        iscrowd = np.zeros(len(keep), dtype=bool) if iscrowd is None else np.asarray(iscrowd, dtype=bool)
+        ignore = iscrowd if ignore is None else iscrowd | np.asarray(ignore, dtype=bool)
+
+        order = np.flatnonzero(keep)[np.argsort(image_index[keep], kind="stable")]
+        self.annotation_category_ids = category_ids[order]
+        self.boxes = np.asarray(boxes, dtype=np.float64)[order]
+        self.areas = np.asarray(areas, dtype=np.float64)[order]
+        self.iscrowd = iscrowd[order]
+        self.ignore = ignore[order]
+        self.annotation_ids = np.asarray(annotation_ids, dtype=np.int64)[order]
+        self.image_offsets = np.searchsorted(image_index[order], np.arange(len(self.image_ids) + 1))
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def index_images(self, image_ids):
+        """
+        Returns the positions of image ids in self.image_ids, -1 for unknown ids
+        """
+        image_ids = np.asarray(image_ids, dtype=np.int64)
+        if len(self.image_ids) == 0:
+            return np.full(len(image_ids), -1)
+        index = np.searchsorted(self.image_ids, image_ids)
+        index[index == len(self.image_ids)] = 0
+        return np.where(self.image_ids[index] == image_ids, index, -1)
+
+    def image(self, index):
+        """
+        Returns the (category_ids, boxes, areas, iscrowd, ignore, annotation_ids) of the
+        index-th image
+        """
+        start, end = self.image_offsets[index], self.image_offsets[index + 1]
+        return (
+            self.annotation_category_ids[start:end],
+            self.boxes[start:end],
+            self.areas[start:end],
+            self.iscrowd[start:end],
+            self.ignore[start:end],
+            self.annotation_ids[start:end],
+        )
+
+
+class DetectionIndex:
+    """
+    Detections grouped by the images of a GroundTruthIndex, in input order within an image.
+    Detections of categories missing from the ground truth are dropped, as in COCOeval.
+
+    Args:
+        ground_truth: GroundTruthIndex
+        image_ids, category_ids, scores: np.ndarray
+            (N,) columns of the detections
+        boxes: np.ndarray
+            (N, K) boxes, in the format of the ground truth boxes
+    """
+
+    def __init__(self, ground_truth, image_ids, category_ids, boxes, scores):
+        image_index = ground_truth.index_images(image_ids)
+        if np.any(image_index < 0):
+            raise ValueError("Results do not correspond to current coco set: unknown image ids")
+        keep = np.flatnonzero(np.isin(category_ids, ground_truth.category_ids))
+        order = keep[np.argsort(image_index[keep], kind="stable")]
+        self.category_ids = np.asarray(category_ids, dtype=np.int64)[order]
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, ground_truth.boxes.shape[1])[order]
+        self.scores = np.asarray(scores, dtype=np.float64)[order]
+        self.image_offsets = np.searchsorted(image_index[order], np.arange(len(ground_truth) + 1))
+
+    def image(self, index):
+        """
+        Returns the (category_ids, boxes, scores) of the index-th image
+        """
+        start, end = self.image_offsets[index], self.image_offsets[index + 1]
+        return self.category_ids[start:end], self.boxes[start:end], self.scores[start:end]
+
+
+def load_coco_ground_truth(coco_json):
+    """
+    Reads a COCO ground truth file into a GroundTruthIndex
+    """
+    data = load_json(coco_json)
+    annotations = data["annotations"]
+    # zero area boxes are written with an empty bbox, they can not be matched
+    empty = [len(annotation["bbox"]) != 4 for annotation in annotations]
+    return GroundTruthIndex(
+        [image["id"] for image in data["images"]],
+        data["categories"],
+        [annotation["image_id"] for annotation in annotations],
+        [annotation["category_id"] for annotation in annotations],
+        np.array([[0.0] * 4 if e else annotation["bbox"] for annotation, e in zip(annotations, empty)],
+                 dtype=np.float64).reshape(-1, 4),
+        [annotation["area"] for annotation in annotations],
+        [annotation["id"] for annotation in annotations],
+        iscrowd=[bool(annotation.get("iscrowd", 0)) for annotation in annotations],
+        ignore=empty,
+    )
+
+
+def load_detections(results_json, ground_truth):
+    """
+    Reads a COCO results file (list of image_id, category_id, bbox, score dicts) or a
+    prediction cache directory (evaluation/prediction_cache.py)
+    """
+    if is_prediction_cache(results_json):
+        cache = PredictionCache(results_json)
+        return DetectionIndex(ground_truth, cache.image_ids, cache.category_ids, cache.boxes, cache.scores)
+    results = load_json(results_json)
+    return DetectionIndex(
+        ground_truth,
+        [result["image_id"] for result in results],
+        [result["category_id"] for result in results],
+        [result["bbox"] for result in results],
+        [result["score"] for result in results],
+    )
+
+
+def bbox_areas(boxes):
+    """
+    Returns the areas of [xmin, ymin, width, height] boxes
+    """
+    return boxes[:, 2] * boxes[:, 3]
+
+
+def bbox_iou(dt_boxes, gt_boxes, iscrowd):
+    """
+    Returns the (D, G) IoU matrix of [xmin, ymin, width, height] boxes, the union of a crowd
+    ground truth being the detection area (pycocotools maskUtils.iou)
+    """
+    dt_boxes = dt_boxes[:, None, :]
+    gt_boxes = gt_boxes[None, :, :]
+    widths = np.minimum(dt_boxes[..., 2] + dt_boxes[..., 0], gt_boxes[..., 2] + gt_boxes[..., 0]) - np.maximum(
+        dt_boxes[..., 0], gt_boxes[..., 0])
+    heights = np.minimum(dt_boxes[..., 3] + dt_boxes[..., 1], gt_boxes[..., 3] + gt_boxes[..., 1]) - np.maximum(
+        dt_boxes[..., 1], gt_boxes[..., 1])
+    overlap = (widths > 0) & (heights > 0)
+    intersection = widths * heights
+    dt_areas = dt_boxes[..., 2] * dt_boxes[..., 3]
+    union = np.where(iscrowd[None, :], dt_areas, dt_areas + gt_boxes[..., 2] * gt_boxes[..., 3] - intersection)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(overlap, intersection / union, 0.0)
+
+
+def match_detections(ious, gt_ignore, gt_crowd, gt_ids):
+    """
+    COCOeval greedy matching of score sorted detections, at every IoU threshold.
+
+    Only the (detection, ground truth) pairs above the lowest threshold are visited. Isolated
+    pairs are matched for all thresholds at once, the other ones are ordered in the order
+    COCOeval prefers them (valid ground truths first, then by decreasing IoU, the last one on
+    ties), so that a detection takes its first free pair above the threshold.
+
+    Args:
+        ious: np.ndarray
+            (D, G) IoU matrix
+        gt_ignore, gt_crowd, gt_ids: np.ndarray
+            (G,) columns of the ground truths
+    Returns:
+        (T, D) ids of the matched ground truths (0 when unmatched) and (T, D) mask of the
+        detections matched to an ignored ground truth
+    """
+    num_dt, num_gt = ious.shape
+    thresholds = np.minimum(IOU_THRESHOLDS, 1 - 1e-10)
+    matched_ids = np.zeros((len(thresholds), num_dt), dtype=np.int64)
+    matched_ignore = np.zeros((len(thresholds), num_dt), dtype=bool)
+    dt_index, gt_index = np.nonzero(ious >= thresholds[0])
+    if len(dt_index) == 0:
+        return matched_ids, matched_ignore
+
+    pair_ious = ious[dt_index, gt_index]
+    # a pair sharing its detection and its ground truth with no other pair matches at the
+    # thresholds it passes, whatever the other detections do
+    isolated = (np.bincount(dt_index, minlength=num_dt)[dt_index] == 1) & (
+        np.bincount(gt_index, minlength=num_gt)[gt_index] == 1)
+    hit = pair_ious[isolated][None, :] >= thresholds[:, None]
+    matched_ids[:, dt_index[isolated]] = np.where(hit, gt_ids[gt_index[isolated]], 0)
+    matched_ignore[:, dt_index[isolated]] = hit & gt_ignore[gt_index[isolated]]
+    dt_index, gt_index, pair_ious = dt_index[~isolated], gt_index[~isolated], pair_ious[~isolated]
+
+    order = np.lexsort((-gt_index, -pair_ious, gt_ignore[gt_index], dt_index))
+    # per detection (in score order), its valid and ignored candidate (gt, iou) lists
+    candidates = []
+    for d, g, iou, ignored in zip(
+        dt_index[order].tolist(), gt_index[order].tolist(), pair_ious[order].tolist(), gt_ignore[gt_index[order]].tolist()
+    ):
+        if not candidates or candidates[-1][0] != d:
+            candidates.append((d, ([], [])))
+        candidates[-1][1][ignored].append((g, iou))
+
+    crowd, ignore, ids = gt_crowd.tolist(), gt_ignore.tolist(), gt_ids.tolist()
+    for t, threshold in enumerate(thresholds.tolist()):
+        taken = [False] * num_gt
+        for d, groups in candidates:
+            for group in groups:
+                m = -1
+                for g, iou in group:
+                    if iou < threshold:
+                        break
+                    # crowds can be matched many times
+                    if crowd[g] or not taken[g]:
+                        m = g
+                        break
+                if m >= 0:
+                    matched_ids[t, d] = ids[m]
+                    matched_ignore[t, d] = ignore[m]
+                    taken[m] = True
+                    break
+    return matched_ids, matched_ignore
+
+
+def evaluate_image(item, iou_func=bbox_iou, area_func=bbox_areas):
+    """
+    Matches the detections of an image, for every category and area range.
+
+    Args:
+        item: tuple
+            (GroundTruthIndex.image, DetectionIndex.image) of the image
+        iou_func: callable
+            Returns the (D, G) IoU matrix of (D, K) detection boxes, (G, K) ground truth boxes
+            and (G,) crowd flags
+        area_func: callable
+            Returns the areas of (D, K) detection boxes
+    Returns:
+        list of (category_id, area range index, (D,) scores, (T, D) true positives,
+        (T, D) false positives, number of non ignored ground truths), detections sorted by
+        score and cut to the largest max detections
+    """
+    (gt_categories, gt_boxes, gt_areas, gt_crowd, gt_base_ignore, gt_ids), (dt_categories, dt_boxes, dt_scores) = item
+    results = []
+    for category in np.union1d(gt_categories, dt_categories):
+        g = np.flatnonzero(gt_categories == category)
+        d = np.flatnonzero(dt_categories == category)
+        d = d[np.argsort(-dt_scores[d], kind="mergesort")[:MAX_DETS[-1]]]
+        ious = iou_func(dt_boxes[d], gt_boxes[g], gt_crowd[g])
+        dt_areas = area_func(dt_boxes[d])
+        matches = {}
+        for area_index, (_, (low, high)) in enumerate(AREA_RANGES):
+            ignore = gt_base_ignore[g] | (gt_areas[g] < low) | (gt_areas[g] > high)
+            key = ignore.tobytes()
+            if key not in matches:
+                matches[key] = match_detections(ious, ignore, gt_crowd[g], gt_ids[g])
+            matched_ids, matched_ignore = matches[key]
+            matched = matched_ids != 0
+            # unmatched detections outside the area range are ignored
+            dt_ignore = matched_ignore | (~matched & ((dt_areas < low) | (dt_areas > high)))
+            results.append((
+                int(category), area_index, dt_scores[d],
+                matched & ~dt_ignore, ~matched & ~dt_ignore, int(np.count_nonzero(~ignore)),
+            ))
+    return results
+
+
+def precision_recall(scores, ranks, true_positives, false_positives, num_positives, max_det):
+    """
+    Returns the (T, R) interpolated precision at the recall thresholds and the (T,) recall of
+    the detections of a category and area range (ranks within their image) up to max_det
+    per image
+    """
+    keep = ranks < max_det
+    order = np.argsort(-scores[keep], kind="mergesort")
+    tp_sum = np.cumsum(true_positives[:, keep][:, order], axis=1).astype(np.float64)
+    fp_sum = np.cumsum(false_positives[:, keep][:, order], axis=1).astype(np.float64)
+    num_thresholds, num_dt = tp_sum.shape
+    precision = np.zeros((num_thresholds, len(RECALL_THRESHOLDS)))
+    if num_dt == 0:
+        return precision, np.zeros(num_thresholds)
+    recall = tp_sum / num_positives
+    # precision envelope, made non increasing from the last detection
+    envelope = np.maximum.accumulate((tp_sum / (fp_sum + tp_sum + np.spacing(1)))[:, ::-1], axis=1)[:, ::-1]
+    for t in range(num_thresholds):
+        inds = np.searchsorted(recall[t], RECALL_THRESHOLDS, side="left")
+        valid = inds < num_dt
+        precision[t, valid] = envelope[t, inds[valid]]
+    return precision, recall[:, -1]
+
+
+def accumulate(image_results, category_ids):
+    """
+    Returns the (T, R, K, A, M) precision and (T, K, A, M) recall arrays of COCOeval (-1 where
+    a category has no ground truth in an area range) from the evaluate_image results, in image
+    order
+    """
+    category_index = {int(category_id): k for k, category_id in enumerate(category_ids)}
+    entries = {}
+    for results in image_results:
+        for category, area_index, scores, true_positives, false_positives, num_positives in results:
+            entry = entries.setdefault((category_index[category], area_index), ([], [], [], [], [0]))
+            entry[0].append(scores)
+            entry[1].append(np.arange(len(scores)))
+            entry[2].append(true_positives)
+            entry[3].append(false_positives)
+            entry[4][0] += num_positives
+
+    shape = (len(IOU_THRESHOLDS), len(category_ids), len(AREA_RANGES), len(MAX_DETS))
+    precision = -np.ones(shape[:1] + (len(RECALL_THRESHOLDS),) + shape[1:])
+    recall = -np.ones(shape)
+    for (k, a), (scores, ranks, true_positives, false_positives, (num_positives,)) in entries.items():
+        if num_positives == 0:
+            continue
+        scores, ranks = np.concatenate(scores), np.concatenate(ranks)
+        true_positives = np.concatenate(true_positives, axis=1)
+        false_positives = np.concatenate(false_positives, axis=1)
+        for m, max_det in enumerate(MAX_DETS):
+            precision[:, :, k, a, m], recall[:, k, a, m] = precision_recall(
+                scores, ranks, true_positives, false_positives, num_positives, max_det)
+    return precision, recall
+
+
+def summarize(precision, recall):
+    """
+    Returns the 12 COCOeval summary metrics as a dict
+    """
+    area_names = [name for name, _ in AREA_RANGES]
+    stats = {}
+    for name, is_precision, iou, area, max_det in SUMMARY:
+        a, m = area_names.index(area), MAX_DETS.index(max_det)
+        values = precision[..., a, m] if is_precision else recall[..., a, m]
+        if iou is not None:
+            values = values[np.flatnonzero(IOU_THRESHOLDS == iou)]
+        values = values[values > -1]
+        stats[name] = float(np.mean(values)) if len(values) else -1.0
+    return stats
+
+
+def print_summary(stats):
+    for name, is_precision, iou, area, max_det in SUMMARY:
+        print(" {:<18} {} @[ IoU={:<9} | area={:>6s} | maxDets={:>3d} ] = {:0.3f}".format(
+            "Average Precision" if is_precision else "Average Recall",
+            "(AP)" if is_precision else "(AR)",
+            "{:0.2f}:{:0.2f}".format(IOU_THRESHOLDS[0], IOU_THRESHOLDS[-1]) if iou is None else "{:0.2f}".format(iou),
+            area, max_det, stats[name],
+        ))
+
+
+def evaluate(ground_truth, detections, workers=1, iou_func=bbox_iou, area_func=bbox_areas):
+    """
+    Evaluates detections against a ground truth.
+
+    Args:
+        ground_truth: GroundTruthIndex
+        detections: DetectionIndex
+        workers: int
+            Number of processes matching the images, 1 runs serially
+        iou_func, area_func: callable
+            Module level IoU and area functions of the boxes (see evaluate_image), those of
+            [xmin, ymin, width, height] boxes by default
+    Returns:
+        dict with the summary 'stats', the per category 'category_ap' (AP@[0.50:0.95], all
+        areas, 100 detections), the 'precision' and 'recall' arrays
+    """
+    items = (
+        (ground_truth.image(i), detections.image(i)) for i in range(len(ground_truth))
+        if ground_truth.image_offsets[i + 1] > ground_truth.image_offsets[i]
+        or detections.image_offsets[i + 1] > detections.image_offsets[i]
+    )
+    precision, recall = accumulate(
+        map_images(partial(evaluate_image, iou_func=iou_func, area_func=area_func), items, workers=workers, desc="Evaluating images"), ground_truth.category_ids)
+    category_ap = {}
+    for k, category in enumerate(ground_truth.categories):
+        values = precision[:, :, k, 0, -1]
+        values = values[values > -1]
+        category_ap[category["name"]] = float(np.mean(values)) if len(values) else -1.0
+    return {"stats": summarize(precision, recall), "category_ap": category_ap, "precision": precision, "recall": recall}
+
+
+def coco_eval(gt_json, results_json, workers=1, output=None):
+    """
+    Prints the COCO bbox metrics of a results file.
+
+    Args:
+        gt_json: str
+            COCO ground truth file
+        results_json: str
+            COCO results file (image_id, category_id, bbox, score) or prediction cache directory
+        workers: int
+            Number of processes matching the images, 1 runs serially
+        output: str
+            If provided, the summary and per category AP are saved to this json file
+    """
+    ground_truth = load_coco_ground_truth(gt_json)
+    metrics = evaluate(ground_truth, load_detections(results_json, ground_truth), workers=workers)
+    print_summary(metrics["stats"])
+    for name, ap in metrics["category_ap"].items():
+        print(" {:<18} {:0.3f}".format(name, ap))
+    if output is not None:
+        save_json(
+            {"gt": str(gt_json), "results": str(results_json), "stats": metrics["stats"], "category_ap": metrics["category_ap"]},
+            output, compact=False,
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(coco_eval)
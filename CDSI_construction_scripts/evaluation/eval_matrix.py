@@ -0,0 +1,131 @@
+"""
+train-on-X / test-on-Y evaluation matrix: scores a grid of detection results files against
+their test sets and writes the whole matrix as one table
+
+The grid is a json file naming the test sets (COCO ground truth files) and, for every model
+(training set), its results file on each test set:
+
+    {
+        "test_sets": {"VME": "../VME_annotations/annotations_HBB/test.json", "CDSI": "CDSI_test.json"},
+        "predictions": {
+            "VME": {"VME": "results/vme_on_vme.json", "CDSI": "results/vme_on_cdsi.json"},
+            "xView": {"VME": "results/xview_on_vme.json", "CDSI": "results/xview_on_cdsi.json"}
+        }
+    }
+
+Every ground truth file is read and indexed by image once (evaluation.coco_eval.GroundTruthIndex)
+before the cells are scored, and the index is reused by all the cells of its test set. The cells
+are spread over worker processes, which inherit the loaded indexes (a process started without
+them loads each test set it needs once).
+
+usage:
+    python evaluation/eval_matrix.py grid.json eval_matrix.csv --workers 8
+    python evaluation/eval_matrix.py grid.json eval_matrix_ap50.csv --metric AP50
+"""
+import csv
+from pathlib import Path
+
+import fire
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from evaluation.coco_eval import SUMMARY, evaluate, load_coco_ground_truth, load_detections
+from utils.json_io import load_json, save_json
+from utils.parallel import map_images
+
+# GroundTruthIndex of every ground truth file loaded by this process, by path
+_ground_truths = {}
+
+
+def get_ground_truth(gt_json):
+    """
+    Returns the GroundTruthIndex of a ground truth file, read on the first call only
+    """
+    key = str(gt_json)
+    if key not in _ground_truths:
+        _ground_truths[key] = load_coco_ground_truth(gt_json)
+    return _ground_truths[key]
+
+
+def evaluate_cell(cell):
+    """
+    Scores a (model, test set, gt file, results file) cell, returns its summary metrics
+    """
+    _, _, gt_json, results_json = cell
+    ground_truth = get_ground_truth(gt_json)
+    return evaluate(ground_truth, load_detections(results_json, ground_truth))["stats"]
+
+
+def read_grid(grid_json):
+    """
+    Returns the test set names, the model names and the (model, test set, gt file, results
+    file) cells of a grid file, results paths being relative to the grid file
+    """
+    grid = load_json(grid_json)
+    root = Path(grid_json).parent
+    test_sets = {name: root / path for name, path in grid["test_sets"].items()}
+    cells = []
+    for model, results in grid["predictions"].items():
+        for test_set, results_json in results.items():
+            if test_set not in test_sets:
+                raise ValueError("{}: unknown test set '{}' of model '{}'".format(grid_json, test_set, model))
+            cells.append((model, test_set, str(test_sets[test_set]), str(root / results_json)))
+    return list(test_sets), list(grid["predictions"]), cells
+
+
+def write_matrix(path, test_sets, models, values):
+    """
+    Writes a models x test sets csv table, empty where a cell is missing
+    """
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["train \\ test"] + test_sets)
+        for model in models:
+            writer.writerow([model] + [
+                "" if (model, test_set) not in values else "{:.4f}".format(values[model, test_set])
+                for test_set in test_sets
+            ])
+
+
+def eval_matrix(grid_json, output, metric="AP", workers=1):
+    """
+    Scores all the cells of a grid and writes the matrix of a metric.
+
+    Args:
+        grid_json: str
+            Grid file (test sets and per model results files)
+        output: str
+            Output csv table, the 12 metrics of every cell are also saved to the same path
+            with a .json suffix
+        metric: str
+            Metric of the table, one of AP, AP50, AP75, APs, APm, APl, AR1, AR10, AR100, ARs,
+            ARm, ARl
+        workers: int
+            Number of processes scoring the cells, 1 runs serially
+    """
+    metric_names = [name for name, *_ in SUMMARY]
+    if metric not in metric_names:
+        raise ValueError("metric must be one of {}".format(metric_names))
+    test_sets, models, cells = read_grid(grid_json)
+
+    # every test set is read once, before the workers are started
+    for gt_json in sorted({cell[2] for cell in cells}):
+        get_ground_truth(gt_json)
+    cell_stats = {}
+    for (model, test_set, _, _), stats in zip(
+            cells, map_images(evaluate_cell, cells, workers=workers, chunksize=1, desc="Evaluating cells")):
+        cell_stats[model, test_set] = stats
+
+    write_matrix(output, test_sets, models, {key: stats[metric] for key, stats in cell_stats.items()})
+    save_json(
+        [{"train": model, "test": test_set, "results": results_json, "stats": cell_stats[model, test_set]}
+         for model, test_set, _, results_json in cells],
+        Path(output).with_suffix(".json"), compact=False,
+    )
+    with open(output) as f:
+        print(f.read(), end="")
+    print("matrix saved to {}".format(output))
+
+
+if __name__ == "__main__":
+    fire.Fire(eval_matrix)
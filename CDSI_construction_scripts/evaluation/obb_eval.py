@@ -0,0 +1,107 @@
+"""
+COCO style mAP of oriented box (OBB) detections against the VME annotations_OBB files
+
+Detections are read from a folder holding one text file per tile, named like the annotation
+files (VME0001.txt), with one 'x1 y1 x2 y2 x3 y3 x4 y4 class score' line per detection; a
+missing file means no detection. Ground truths are read from the annotations_OBB folder or a
+pack made by vme/obb_pack.py. The matching and accumulation are those of evaluation/coco_eval.py
+with the rotated IoU of evaluation/rotated_iou.py, the area ranges using the polygon areas.
+
+usage:
+    python evaluation/obb_eval.py predictions_OBB --split_images_path original_test --workers 8
+    python evaluation/obb_eval.py predictions_OBB --obb_annotations annotations_OBB.pack --output obb_metrics.json
+"""
+import os
+from pathlib import Path
+
+import fire
+import numpy as np
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from evaluation.coco_eval import DetectionIndex, GroundTruthIndex, evaluate, print_summary
+from evaluation.rotated_iou import polygon_areas, rotated_iou
+from utils.json_io import save_json
+from utils.split_manifest import load_split_members
+from vme.vme_to_coco import CATEGORY_ID_TO_NAME, VME_OBB_DIR, read_obb_annotations
+
+
+def load_obb_ground_truth(image_filenames, obb_annotations=str(VME_OBB_DIR)):
+    """
+    Reads the OBB annotations of the tiles into a GroundTruthIndex, the images being numbered
+    from 1 in image_filenames order
+    """
+    corners, class_ids, counts = read_obb_annotations(image_filenames, obb_annotations)
+    categories = [{"id": int(class_id), "name": name} for class_id, name in CATEGORY_ID_TO_NAME.items()]
+    return GroundTruthIndex(
+        np.arange(1, len(image_filenames) + 1),
+        categories,
+        np.repeat(np.arange(1, len(image_filenames) + 1), counts),
+        class_ids,
+        corners,
+        polygon_areas(corners),
+        np.arange(1, len(class_ids) + 1),
+    )
+
+
+def read_obb_detections(image_filenames, results_dir):
+    """
+    Reads the detection files of the tiles in a single batched parse.
+
+    Returns:
+        (corners, class_ids, scores, counts) where corners is the (N, 8) array of all the
+        detections and counts the number of detections of every image
+    """
+    texts = []
+    counts = np.zeros(len(image_filenames), dtype=np.int64)
+    for i, image_filename in enumerate(image_filenames):
+        path = os.path.join(results_dir, os.path.splitext(image_filename)[0] + ".txt")
+        if not os.path.isfile(path):
+            texts.append("")
+            continue
+        with open(path) as f:
+            text = f.read()
+        counts[i] = sum(1 for line in text.split("\n") if line.strip())
+        texts.append(text)
+    values = np.fromstring(" ".join(texts), sep=" ", dtype=np.float64) if counts.sum() else np.zeros(0)
+    if values.size != 10 * counts.sum():
+        raise ValueError("detection lines must be 'x1 y1 x2 y2 x3 y3 x4 y4 class score'")
+    values = values.reshape(-1, 10)
+    return values[:, :8], values[:, 8].astype(np.int64), values[:, 9], counts
+
+
+def obb_eval(results_dir, split_images_path="original_test", obb_annotations=str(VME_OBB_DIR), workers=1, output=None):
+    """
+    Prints the COCO metrics of OBB detections.
+
+    Args:
+        results_dir: str
+            Folder of the per-tile detection files
+        split_images_path: str
+            split list txt file or split name of the manifest (e.g. original_test)
+        obb_annotations: str
+            annotations_OBB folder or pack file, VME_annotations/annotations_OBB if not provided
+        workers: int
+            Number of processes matching the images, 1 runs serially
+        output: str
+            If provided, the summary and per category AP are saved to this json file
+    """
+    image_filenames = load_split_members(split_images_path, "VME")
+    ground_truth = load_obb_ground_truth(image_filenames, obb_annotations)
+    corners, class_ids, scores, counts = read_obb_detections(image_filenames, results_dir)
+    detections = DetectionIndex(
+        ground_truth, np.repeat(np.arange(1, len(image_filenames) + 1), counts), class_ids, corners, scores)
+    metrics = evaluate(ground_truth, detections, workers=workers, iou_func=rotated_iou, area_func=polygon_areas)
+    print_summary(metrics["stats"])
+    for name, ap in metrics["category_ap"].items():
+        print(" {:<18} {:0.3f}".format(name, ap))
+    if output is not None:
+        save_json(
+            {"gt": str(obb_annotations), "split": str(split_images_path), "results": str(results_dir),
+             "stats": metrics["stats"], "category_ap": metrics["category_ap"]},
+            output, compact=False,
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(obb_eval)
@@ -0,0 +1,194 @@
+"""
+streaming ingest of large COCO detection results files into a compact columnar cache
+
+A results file (json list of image_id, category_id, bbox, score dicts) is streamed one item at
+a time (utils.json_stream), detections under score_floor are dropped and only the top_k
+highest scoring detections of every image (of every image and category by default) are kept.
+The kept detections are bounded to top_k per group plus one chunk: every chunk_size read
+detections are merged with the kept ones and cut back to their per-group top_k with a single
+sort. Ties keep the results file order.
+
+The cache is a directory of .npy arrays, detections grouped by image and category, by
+decreasing score:
+    image_ids.npy       (N,) int64
+    category_ids.npy    (N,) int64
+    boxes.npy           (N, 4) [xmin, ymin, width, height], float64 (or float32)
+    scores.npy          (N,) float64 (or float32)
+    meta.json           source file, top_k, score_floor and the read/kept counts
+With the default top_k of 100 per image and category, the COCOeval maxDets, and a float64 cache,
+evaluating the cache gives exactly the metrics of the full results file. evaluation/coco_eval.py
+(and eval_matrix.py) accept a cache directory in place of a results file.
+
+usage:
+    python evaluation/prediction_cache.py build results.json results_cache --score_floor 0.01
+    python evaluation/prediction_cache.py info results_cache
+    python evaluation/prediction_cache.py export results_cache results_top100.json
+"""
+from pathlib import Path
+
+import fire
+import numpy as np
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.json_io import dumps, load_json, save_json
+from utils.json_stream import iter_json_array
+
+ARRAY_NAMES = ["image_ids", "category_ids", "boxes", "scores"]
+DTYPES = ["float64", "float32"]
+CHUNK_SIZE = 1 << 20
+
+
+def top_k_per_group(columns, top_k, per_category=True):
+    """
+    Keeps the top_k highest scoring rows of every image (and category).
+
+    Args:
+        columns: dict
+            image_ids, category_ids, boxes, scores and sequence (read order) arrays
+    Returns:
+        the kept columns, grouped by image (and category) by decreasing score, ties in read order
+    """
+    image_ids, category_ids, scores = columns["image_ids"], columns["category_ids"], columns["scores"]
+    keys = (columns["sequence"], -scores, category_ids, image_ids) if per_category else (
+        columns["sequence"], -scores, image_ids)
+    order = np.lexsort(keys)
+    group_keys = [image_ids[order]] + ([category_ids[order]] if per_category else [])
+    # rank of every row in its group
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = np.any([key[1:] != key[:-1] for key in group_keys], axis=0)
+    group_starts = np.maximum.accumulate(np.where(new_group, np.arange(len(order)), 0))
+    keep = order[np.arange(len(order)) - group_starts < top_k]
+    return {name: values[keep] for name, values in columns.items()}
+
+
+def build_prediction_cache(
+    results_json,
+    output_dir,
+    top_k=100,
+    score_floor=0.0,
+    per_category=True,
+    dtype="float64",
+    chunk_size=CHUNK_SIZE,
+):
+    """
+    Streams a results file into a prediction cache.
+
+    Args:
+        results_json: str
+            COCO results file
+        output_dir: str
+            Output directory of the .npy arrays and meta.json
+        top_k: int
+            Number of detections kept per image (and category), None keeps them all
+        score_floor: float
+            Detections scoring under it are dropped
+        per_category: bool
+            top_k applies to every image and category (as COCOeval maxDets), else to every image
+        dtype: str
+            float64 or float32 boxes and scores (float32 halves them but rounds them)
+        chunk_size: int
+            Number of detections read between two top_k cuts
+    """
+    if dtype not in DTYPES:
+        raise ValueError("dtype must be one of {}".format(DTYPES))
+    kept = None
+    num_read = num_below_floor = 0
+    rows = []
+
+    def merge(kept, rows):
+        sequence, image_ids, category_ids, bboxes, scores = zip(*rows)
+        chunk = {
+            "image_ids": np.array(image_ids, dtype=np.int64),
+            "category_ids": np.array(category_ids, dtype=np.int64),
+            "boxes": np.array(bboxes, dtype=np.float64).reshape(-1, 4),
+            "scores": np.array(scores, dtype=np.float64),
+            "sequence": np.array(sequence, dtype=np.int64),
+        }
+        if kept is not None:
+            chunk = {name: np.concatenate([kept[name], values]) for name, values in chunk.items()}
+        return chunk if top_k is None else top_k_per_group(chunk, top_k, per_category)
+
+    for result in iter_json_array(results_json):
+        num_read += 1
+        if result["score"] < score_floor:
+            num_below_floor += 1
+            continue
+        rows.append((num_read, result["image_id"], result["category_id"], result["bbox"], result["score"]))
+        if len(rows) == chunk_size:
+            kept = merge(kept, rows)
+            rows = []
+    if rows:
+        kept = merge(kept, rows)
+    if kept is None:
+        kept = {"image_ids": np.zeros(0, dtype=np.int64), "category_ids": np.zeros(0, dtype=np.int64),
+                "boxes": np.zeros((0, 4)), "scores": np.zeros(0), "sequence": np.zeros(0, dtype=np.int64)}
+    elif top_k is None:
+        kept = top_k_per_group(kept, len(kept["scores"]), per_category)
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name in ARRAY_NAMES:
+        values = kept[name]
+        np.save(output_dir / "{}.npy".format(name), values.astype(dtype) if values.dtype == np.float64 else values)
+    save_json(
+        {"source": str(results_json), "top_k": top_k, "score_floor": score_floor, "per_category": per_category,
+         "num_read": num_read, "num_below_floor": num_below_floor, "num_kept": len(kept["scores"])},
+        output_dir / "meta.json",
+    )
+    print("{}: {} detections read, {} under the score floor, {} kept".format(
+        output_dir, num_read, num_below_floor, len(kept["scores"])))
+
+
+class PredictionCache:
+    """
+    Memory-mapped reader of a build_prediction_cache directory
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(self.path / "{}.npy".format(name), mmap_mode="r"))
+        self.meta = load_json(self.path / "meta.json")
+
+    def __len__(self):
+        return len(self.scores)
+
+    def iter_results(self):
+        """
+        Yields the detections as COCO results dicts
+        """
+        for image_id, category_id, bbox, score in zip(
+                self.image_ids.tolist(), self.category_ids.tolist(), self.boxes.tolist(), self.scores.tolist()):
+            yield {"image_id": image_id, "category_id": category_id, "bbox": bbox, "score": score}
+
+
+def is_prediction_cache(path):
+    return Path(path).is_dir() and (Path(path) / "meta.json").is_file()
+
+
+def info(path):
+    """
+    Prints the content summary of a cache
+    """
+    cache = PredictionCache(path)
+    for key, value in cache.meta.items():
+        print(key, value)
+    print("images", len(np.unique(cache.image_ids)))
+
+
+def export_results(path, output_json):
+    """
+    Writes the detections of a cache back to a COCO results file
+    """
+    cache = PredictionCache(path)
+    with open(output_json, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, result in enumerate(cache.iter_results()):
+            f.write("," + dumps(result) if i else dumps(result))
+        f.write("]")
+    print("{}: {} detections".format(output_json, len(cache)))
+
+
+if __name__ == "__main__":
+    fire.Fire({"build": build_prediction_cache, "info": info, "export": export_results})
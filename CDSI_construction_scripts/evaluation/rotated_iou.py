@@ -0,0 +1,122 @@
+"""
+batched IoU of oriented (rotated) boxes given by their 4 corners, as in the VME
+annotations_OBB files ('x1 y1 x2 y2 x3 y3 x4 y4 class')
+
+The horizontal boxes of the corners are compared first, only the overlapping pairs are
+intersected. Their intersection polygons are computed for all the pairs at once by clipping
+each detection quadrilateral with the 4 edges of the ground truth one (Sutherland-Hodgman on
+(P, 8, 2) vertex arrays, the intersection of two convex quadrilaterals having at most 8
+vertices), and their areas with the shoelace formula. The quadrilaterals must be convex (rotated
+rectangles, as all the VME boxes are), in either vertex order.
+
+usage:
+    ious = rotated_iou(dt_corners, gt_corners)    # (D, 8), (G, 8) -> (D, G)
+"""
+import numpy as np
+
+# vertices of the intersection of two convex quadrilaterals
+MAX_VERTICES = 8
+
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _signed_areas(vertices, counts):
+    """
+    Returns the shoelace signed areas of (P, M, 2) polygons with counts[p] vertices
+    """
+    index = np.arange(vertices.shape[1])[None, :]
+    next_index = np.where(index + 1 < counts[:, None], index + 1, 0)
+    following = np.take_along_axis(vertices, next_index[..., None], axis=1)
+    terms = np.where(index < counts[:, None], _cross(vertices, following), 0.0)
+    return terms.sum(axis=1) / 2
+
+
+def quadrilaterals(corners):
+    """
+    Returns the (N, 4, 2) vertices of (N, 8) corners, in the order of a positive signed area
+    """
+    vertices = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+    reverse = _signed_areas(vertices, np.full(len(vertices), 4)) < 0
+    vertices[reverse] = vertices[reverse, ::-1]
+    return vertices
+
+
+def polygon_areas(corners):
+    """
+    Returns the areas of (N, 8) quadrilateral corners
+    """
+    vertices = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+    return np.abs(_signed_areas(vertices, np.full(len(vertices), 4)))
+
+
+def _clip(subject, counts, edge_start, edge_end):
+    """
+    Clips (P, MAX_VERTICES, 2) convex polygons by the half planes left of the (P, 2) edges
+    """
+    index = np.arange(subject.shape[1])[None, :]
+    valid = index < counts[:, None]
+    previous_index = np.where(index == 0, np.maximum(counts[:, None] - 1, 0), index - 1)
+    previous = np.take_along_axis(subject, previous_index[..., None], axis=1)
+    side = _cross((edge_end - edge_start)[:, None, :], subject - edge_start[:, None, :])
+    previous_side = np.take_along_axis(side, previous_index, axis=1)
+    inside = valid & (side >= 0)
+    crossing = valid & ((side >= 0) != (previous_side >= 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(crossing, previous_side / (previous_side - side), 0.0)
+    intersections = previous + t[..., None] * (subject - previous)
+
+    # every vertex outputs the edge crossing before it, then itself when inside
+    num_outputs = crossing.astype(np.int64) + inside
+    positions = np.cumsum(num_outputs, axis=1) - num_outputs
+    clipped = np.zeros_like(subject)
+    for mask, offset, points in ((crossing, 0, intersections), (inside, crossing, subject)):
+        target = positions + offset
+        # round-off can add vertices to degenerate polygons, they are dropped
+        mask = mask & (target < MAX_VERTICES)
+        rows = np.broadcast_to(np.arange(len(subject))[:, None], mask.shape)
+        clipped[rows[mask], target[mask]] = points[mask]
+    return clipped, np.minimum(num_outputs.sum(axis=1), MAX_VERTICES)
+
+
+def intersection_areas(dt_vertices, gt_vertices):
+    """
+    Returns the intersection areas of (P, 4, 2) pairs of positively oriented convex
+    quadrilaterals
+    """
+    subject = np.zeros((len(dt_vertices), MAX_VERTICES, 2))
+    subject[:, :4] = dt_vertices
+    counts = np.full(len(dt_vertices), 4)
+    for k in range(4):
+        subject, counts = _clip(subject, counts, gt_vertices[:, k], gt_vertices[:, (k + 1) % 4])
+    return np.maximum(_signed_areas(subject, counts), 0.0)
+
+
+def rotated_iou(dt_corners, gt_corners, iscrowd=None):
+    """
+    Returns the (D, G) IoU matrix of (D, 8) and (G, 8) quadrilateral corners, the union of a
+    crowd ground truth being the detection area (as in COCOeval)
+    """
+    dt_vertices, gt_vertices = quadrilaterals(dt_corners), quadrilaterals(gt_corners)
+    ious = np.zeros((len(dt_vertices), len(gt_vertices)))
+    if len(dt_vertices) == 0 or len(gt_vertices) == 0:
+        return ious
+
+    # horizontal box prefilter
+    dt_min, dt_max = dt_vertices.min(axis=1), dt_vertices.max(axis=1)
+    gt_min, gt_max = gt_vertices.min(axis=1), gt_vertices.max(axis=1)
+    overlap = np.all(
+        (np.minimum(dt_max[:, None], gt_max[None, :]) > np.maximum(dt_min[:, None], gt_min[None, :])), axis=2)
+    d, g = np.nonzero(overlap)
+    if len(d) == 0:
+        return ious
+
+    intersections = intersection_areas(dt_vertices[d], gt_vertices[g])
+    dt_areas = np.abs(_signed_areas(dt_vertices, np.full(len(dt_vertices), 4)))[d]
+    gt_areas = np.abs(_signed_areas(gt_vertices, np.full(len(gt_vertices), 4)))[g]
+    crowd = np.zeros(len(g), dtype=bool) if iscrowd is None else np.asarray(iscrowd, dtype=bool)[g]
+    unions = np.where(crowd, dt_areas, dt_areas + gt_areas - intersections)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ious[d, g] = np.where(unions > 0, intersections / unions, 0.0)
+    return ious
@@ -0,0 +1,475 @@
+"""
+SQLite index of the annotations of all CDSI sources (converter outputs, VME HBB and OBB
+annotations) for querying subsets without reading the json files again
+
+Every indexed file is a (source, split, mode, box_type) entry of the files table; its
+categories, images and annotations are stored with the file id and their ids of the json file:
+    files           id, source, split, mode, box_type (hbb or obb), path, size, mtime_ns
+    categories      file_id, id, name, supercategory
+    images          file_id, id, file_name, width, height
+    annotations     id, file_id, image_id, category_id, x, y, w, h, area, iscrowd, coco_id
+    obb_corners     annotation_id, x1, y1, ... x4, y4 (VME annotations_OBB rows)
+Annotations are indexed by (file, category, area), (file, area) and (file, image), images by
+file name and files by (source, split, mode), so a query reads only the rows it returns.
+
+Queries take the filters source, split, mode, box_type, category (case insensitive names, a
+comma separated string or a list), min_area <= area < max_area (as coco_filter_cat_area.py) and
+file_name.
+
+usage:
+    python utils/annotation_index.py build cdsi.db --outputs_root converted
+    python utils/annotation_index.py count cdsi.db --source fair1m --split CDSI_val --mode car --category car --max_area 400
+    python utils/annotation_index.py images cdsi.db --source VME --box_type obb --category Car --min_objects 200
+    python utils/annotation_index.py export cdsi.db fair1m_val_small_cars.json --source fair1m --split CDSI_val --max_area 400
+"""
+import sqlite3
+from pathlib import Path
+
+import fire
+import numpy as np
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.annotation_store import AnnotationStore
+from utils.coco_merge import merge_categories
+from utils.coco_writer import CocoJsonWriter
+from utils.json_stream import iter_json_sections
+from utils.modes import MODES, get_split_name
+from utils.split_manifest import load_split_members
+from vme.vme_to_coco import CATEGORY_ID_TO_NAME, NAME_TO_COCO_CATEGORY, VME_OBB_DIR, obb_to_hbb, read_obb_annotations
+
+VME_HBB_DIR = VME_OBB_DIR.parent / "annotations_HBB"
+VME_SPLITS = ["original_train", "original_val", "original_test"]
+# the VME annotations_OBB rows are given in 512x512 tile coordinates
+VME_TILE_SIZE = 512
+FILE_FILTERS = ["source", "split", "mode", "box_type"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, source TEXT NOT NULL, split TEXT NOT NULL, mode TEXT NOT NULL,
+    box_type TEXT NOT NULL, path TEXT, size INTEGER, mtime_ns INTEGER,
+    UNIQUE (source, split, mode, box_type)
+);
+CREATE TABLE IF NOT EXISTS categories (
+    file_id INTEGER NOT NULL, id INTEGER NOT NULL, name TEXT NOT NULL, supercategory TEXT,
+    PRIMARY KEY (file_id, id)
+);
+CREATE TABLE IF NOT EXISTS images (
+    file_id INTEGER NOT NULL, id INTEGER NOT NULL, file_name TEXT NOT NULL, width INTEGER, height INTEGER,
+    PRIMARY KEY (file_id, id)
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY, file_id INTEGER NOT NULL, image_id INTEGER NOT NULL, category_id INTEGER NOT NULL,
+    x REAL, y REAL, w REAL, h REAL, area REAL NOT NULL, iscrowd INTEGER NOT NULL, coco_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS obb_corners (
+    annotation_id INTEGER PRIMARY KEY,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL, x3 REAL, y3 REAL, x4 REAL, y4 REAL
+);
+CREATE INDEX IF NOT EXISTS files_source_split_mode ON files (source, split, mode);
+CREATE INDEX IF NOT EXISTS images_file_name ON images (file_name);
+CREATE INDEX IF NOT EXISTS annotations_category_area ON annotations (file_id, category_id, area);
+CREATE INDEX IF NOT EXISTS annotations_area ON annotations (file_id, area);
+CREATE INDEX IF NOT EXISTS annotations_image ON annotations (file_id, image_id);
+"""
+
+
+def parse_names(names):
+    """
+    Returns a list of names given as one name, a comma separated string or a list, None for all
+    """
+    if names is None:
+        return None
+    if isinstance(names, str):
+        return [name.strip() for name in names.split(',') if name.strip()]
+    return [str(name) for name in names]
+
+
+def _annotation_row(file_id, annotation):
+    bbox = annotation.get("bbox") or [None] * 4
+    return (file_id, annotation["image_id"], annotation["category_id"], bbox[0], bbox[1], bbox[2], bbox[3],
+            annotation.get("area", 0), annotation.get("iscrowd", 0), annotation.get("id"))
+
+
+class AnnotationIndex:
+    """
+    Annotation database of a sqlite file, created if missing
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(str(self.db_path))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _replace_file(self, source, split, mode, box_type, path=None):
+        """
+        Deletes the rows of a (source, split, mode, box_type) file, then adds it back empty and
+        returns its id. Returns None if the file (a folder is always replaced) is indexed and
+        unchanged since.
+        """
+        size = mtime_ns = None
+        if path is not None:
+            path = Path(path).resolve()
+        if path is not None and path.is_file():
+            stat = path.stat()
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        row = self.connection.execute(
+            "SELECT id, path, size, mtime_ns FROM files WHERE source = ? AND split = ? AND mode = ? AND box_type = ?",
+            (source, split, mode, box_type),
+        ).fetchone()
+        if row is not None:
+            if size is not None and (row["path"], row["size"], row["mtime_ns"]) == (str(path), size, mtime_ns):
+                return None
+            file_id = row["id"]
+            self.connection.execute(
+                "DELETE FROM obb_corners WHERE annotation_id IN (SELECT id FROM annotations WHERE file_id = ?)",
+                (file_id,))
+            for table in ["annotations", "images", "categories", "files"]:
+                self.connection.execute(
+                    "DELETE FROM {} WHERE {} = ?".format(table, "id" if table == "files" else "file_id"), (file_id,))
+        return self.connection.execute(
+            "INSERT INTO files (source, split, mode, box_type, path, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (source, split, mode, box_type, None if path is None else str(path), size, mtime_ns),
+        ).lastrowid
+
+    def add_coco(self, coco_json, source, split=None, mode="original"):
+        """
+        Indexes a COCO file (converter output, annotations_HBB file), streamed one item at a time.
+        A file already indexed under the same (source, split, mode) is replaced, unless it is
+        the same path and is unchanged since.
+
+        Args:
+            coco_json: str
+                COCO json file path
+            source: str
+                Source name (xview, DOTA-v2.0, vedai, DIOR, fair1m, VME ...)
+            split: str
+                Split name, the file name without extension if not provided
+            mode: str
+                Conversion mode of the file
+        Returns:
+            True if the file was (re)indexed
+        """
+        split = get_split_name(coco_json) if split is None else split
+        with self.connection:
+            file_id = self._replace_file(source, split, mode, "hbb", path=coco_json)
+            if file_id is None:
+                return False
+            for key, value in iter_json_sections(coco_json):
+                if key == "images":
+                    self.connection.executemany(
+                        "INSERT INTO images VALUES (?, ?, ?, ?, ?)",
+                        ((file_id, image["id"], image["file_name"], image.get("width"), image.get("height"))
+                         for image in value),
+                    )
+                elif key == "annotations":
+                    self.connection.executemany(
+                        "INSERT INTO annotations (file_id, image_id, category_id, x, y, w, h, area, iscrowd, coco_id)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (_annotation_row(file_id, annotation) for annotation in value),
+                    )
+                elif key == "categories":
+                    self.connection.executemany(
+                        "INSERT INTO categories VALUES (?, ?, ?, ?)",
+                        ((file_id, category["id"], category["name"], category.get("supercategory"))
+                         for category in value),
+                    )
+        return True
+
+    def add_vme_obb(self, split, obb_annotations=VME_OBB_DIR):
+        """
+        Indexes the VME OBB annotations of a split (box_type obb, mode original). The rows keep
+        their corners and get the horizontal boxes and areas of the annotations_HBB files.
+
+        Args:
+            split: str
+                split list txt file or split name of the manifest (e.g. original_test)
+            obb_annotations: str
+                annotations_OBB folder or a pack made by vme/obb_pack.py
+        Returns:
+            True if the annotations were (re)indexed, a pack file is skipped when unchanged
+        """
+        with self.connection:
+            file_id = self._replace_file("VME", get_split_name(split), "original", "obb", path=obb_annotations)
+            if file_id is None:
+                return False
+            image_filenames = load_split_members(split, 'VME')
+            corners, class_ids, counts = read_obb_annotations(image_filenames, str(obb_annotations))
+            store = AnnotationStore()
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            for i, image_filename in enumerate(image_filenames):
+                store.add_image(image_filename, VME_TILE_SIZE, VME_TILE_SIZE, class_ids[offsets[i]:offsets[i + 1]],
+                                obb_to_hbb(corners[offsets[i]:offsets[i + 1]]))
+            boxes, areas, empty = store.coco_boxes_and_areas()
+            boxes[empty] = np.nan
+            image_ids = store.image_index + 1
+
+            self.connection.executemany(
+                "INSERT INTO categories VALUES (?, ?, ?, ?)",
+                ((file_id, int(category_id), NAME_TO_COCO_CATEGORY[name]["name"],
+                  NAME_TO_COCO_CATEGORY[name]["supercategory"]) for category_id, name in CATEGORY_ID_TO_NAME.items()),
+            )
+            self.connection.executemany(
+                "INSERT INTO images VALUES (?, ?, ?, ?, ?)",
+                ((file_id, i + 1, file_name, VME_TILE_SIZE, VME_TILE_SIZE)
+                 for i, file_name in enumerate(store.file_names)),
+            )
+            first_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM annotations").fetchone()[0]
+            annotation_ids = range(first_id, first_id + len(boxes))
+            # sqlite stores the nan bounds of empty boxes as NULL
+            self.connection.executemany(
+                "INSERT INTO annotations (id, file_id, image_id, category_id, x, y, w, h, area, iscrowd, coco_id)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                ((annotation_id, file_id, image_id, category_id, *box, area, annotation_id - first_id + 1)
+                 for annotation_id, image_id, category_id, box, area in zip(
+                    annotation_ids, image_ids.tolist(), class_ids.tolist(), boxes.tolist(), areas.tolist())),
+            )
+            self.connection.executemany(
+                "INSERT INTO obb_corners VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((annotation_id, *row) for annotation_id, row in zip(annotation_ids, corners.tolist())),
+            )
+        return True
+
+    def files(self, source=None, split=None, mode=None, box_type=None):
+        """
+        Returns the rows of the indexed files matching the filters
+        """
+        conditions, params = [], []
+        for column, names in zip(FILE_FILTERS, (source, split, mode, box_type)):
+            names = parse_names(names)
+            if names is not None:
+                conditions.append("{} IN ({})".format(column, ",".join("?" * len(names))))
+                params.extend(names)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return self.connection.execute(
+            "SELECT * FROM files" + where + " ORDER BY source, split, mode, box_type", params).fetchall()
+
+    def _file_queries(self, source=None, split=None, mode=None, box_type=None, category=None, min_area=None,
+                      max_area=None, file_name=None):
+        """
+        Yields (file row, category rows, where clause, params) selecting the annotations matching
+        the filters in every matching file, files without a matching category are left out
+        """
+        categories = parse_names(category)
+        if categories is not None:
+            categories = {name.lower() for name in categories}
+        for file_row in self.files(source, split, mode, box_type):
+            category_rows = self.connection.execute(
+                "SELECT * FROM categories WHERE file_id = ? ORDER BY id", (file_row["id"],)).fetchall()
+            conditions, params = ["a.file_id = ?"], [file_row["id"]]
+            if categories is not None:
+                category_rows = [row for row in category_rows if row["name"].lower() in categories]
+                if not category_rows:
+                    continue
+                conditions.append("a.category_id IN ({})".format(",".join("?" * len(category_rows))))
+                params.extend(row["id"] for row in category_rows)
+            if min_area is not None:
+                conditions.append("a.area >= ?")
+                params.append(min_area)
+            if max_area is not None:
+                conditions.append("a.area < ?")
+                params.append(max_area)
+            if file_name is not None:
+                conditions.append("a.image_id IN (SELECT id FROM images WHERE file_id = ? AND file_name = ?)")
+                params.extend([file_row["id"], file_name])
+            yield file_row, category_rows, " AND ".join(conditions), params
+
+    def count(self, **filters):
+        """
+        Returns the number of annotations matching the filters
+        """
+        return sum(
+            self.connection.execute("SELECT COUNT(*) FROM annotations a WHERE " + where, params).fetchone()[0]
+            for _, _, where, params in self._file_queries(**filters)
+        )
+
+    @staticmethod
+    def _having(min_objects=None, max_objects=None):
+        """
+        Returns the HAVING clause and params of a per-image annotation count range
+        """
+        conditions, params = ["COUNT(*) >= ?"], [0 if min_objects is None else min_objects]
+        if max_objects is not None:
+            conditions.append("COUNT(*) <= ?")
+            params.append(max_objects)
+        return " AND ".join(conditions), params
+
+    def images(self, min_objects=1, max_objects=None, **filters):
+        """
+        Returns (source, split, mode, box_type, file_name, number of objects) of the images with
+        min_objects <= matching annotations (<= max_objects)
+        """
+        results = []
+        having, having_params = self._having(min_objects, max_objects)
+        for file_row, _, where, params in self._file_queries(**filters):
+            rows = self.connection.execute(
+                "SELECT i.file_name, COUNT(*) FROM annotations a"
+                " JOIN images i ON i.file_id = a.file_id AND i.id = a.image_id"
+                " WHERE " + where + " GROUP BY a.image_id HAVING " + having + " ORDER BY a.image_id",
+                params + having_params,
+            )
+            results.extend(
+                (file_row["source"], file_row["split"], file_row["mode"], file_row["box_type"], file_name, num_objects)
+                for file_name, num_objects in rows)
+        return results
+
+    def export_coco(self, output_json, keep_empty=False, min_objects=None, max_objects=None, **filters):
+        """
+        Writes the annotations matching the filters and their images to a COCO file. The
+        categories of the files are merged by name (as utils/coco_merge.py), the OBB corners are
+        written as the annotation segmentation.
+
+        Args:
+            output_json: str
+                Output COCO json file path
+            keep_empty: bool
+                Also writes the images of the matching files without a matching annotation
+            min_objects, max_objects: int
+                Only writes the images with that many matching annotations
+        Returns:
+            (number of images, number of annotations) written
+        """
+        coco = CocoJsonWriter(output_json)
+        for file_row, category_rows, where, params in self._file_queries(**filters):
+            category_id_map = merge_categories(coco, [
+                {"id": row["id"], "name": row["name"], "supercategory": row["supercategory"] or row["name"]}
+                for row in category_rows])
+            # plain tuples, sqlite3.Row lookups by name would dominate large exports
+            cursor = self.connection.cursor()
+            cursor.row_factory = None
+            if min_objects is not None or max_objects is not None:
+                having, having_params = self._having(min_objects, max_objects)
+                where, params = where + (
+                    " AND a.image_id IN (SELECT a.image_id FROM annotations a WHERE " + where
+                    + " GROUP BY a.image_id HAVING " + having + ")"), params + params + having_params
+            annotations = {}
+            for row in cursor.execute(
+                    "SELECT a.image_id, a.category_id, a.x, a.y, a.w, a.h, a.area, a.iscrowd,"
+                    " c.x1, c.y1, c.x2, c.y2, c.x3, c.y3, c.x4, c.y4 FROM annotations a"
+                    " LEFT JOIN obb_corners c ON c.annotation_id = a.id"
+                    " WHERE " + where + " ORDER BY a.image_id, a.id", params):
+                annotations.setdefault(row[0], []).append(row)
+            if keep_empty:
+                image_filter, image_params = "", [file_row["id"]]
+                if filters.get("file_name") is not None:
+                    image_filter, image_params = " AND file_name = ?", [file_row["id"], filters["file_name"]]
+                image_rows = self.connection.execute(
+                    "SELECT * FROM images WHERE file_id = ?" + image_filter + " ORDER BY id", image_params).fetchall()
+            else:
+                image_rows = []
+                for image_ids in np.array_split(list(annotations), len(annotations) // 500 + 1) if annotations else []:
+                    image_rows.extend(self.connection.execute(
+                        "SELECT * FROM images WHERE file_id = ? AND id IN ({}) ORDER BY id".format(
+                            ",".join("?" * len(image_ids))), [file_row["id"]] + image_ids.tolist()))
+
+            for image_row in image_rows:
+                rows = annotations.get(image_row["id"], [])
+                if (min_objects is not None and len(rows) < min_objects) or (
+                        max_objects is not None and len(rows) > max_objects):
+                    continue
+                image_id = coco.add_image(image_row["file_name"], image_row["height"], image_row["width"])
+                for _, category_id, x, y, w, h, area, iscrowd, *corners in rows:
+                    coco.add_annotation(
+                        image_id, [] if x is None else [x, y, w, h], category_id_map[category_id],
+                        int(area) if area == int(area) else area,
+                        segmentation=[] if corners[0] is None else [corners], iscrowd=iscrowd,
+                    )
+        coco.close()
+        print("{}: {} images, {} annotations".format(output_json, coco.num_images, coco.num_annotations))
+        return coco.num_images, coco.num_annotations
+
+
+def index_converter_outputs(index, outputs_root, mode="original"):
+    """
+    Indexes the converter outputs found under outputs_root/SOURCE, written as SOURCE/SPLIT.json
+    or SOURCE/MODE/SPLIT.json (several modes in one run). mode is the mode of the SOURCE/SPLIT.json
+    files.
+    """
+    outputs_root = Path(outputs_root)
+    for coco_json in sorted(outputs_root.glob("*/**/*.json")):
+        if coco_json.name.endswith(".stats.json"):
+            continue
+        parts = coco_json.relative_to(outputs_root).parts
+        file_mode = parts[-2] if len(parts) > 2 and parts[-2] in MODES else mode
+        if index.add_coco(coco_json, parts[0], mode=file_mode):
+            print("indexed {} ({}, {})".format(coco_json, parts[0], file_mode))
+
+
+def build(db_path, outputs_root=None, mode="original", vme_hbb=str(VME_HBB_DIR), vme_obb=str(VME_OBB_DIR),
+          vme_splits=",".join(VME_SPLITS)):
+    """
+    Creates or updates an annotation database. Files already indexed and unchanged are skipped.
+
+    Args:
+        db_path: str
+            sqlite database file
+        outputs_root: str
+            Folder of the converter outputs, one sub folder per source (see
+            index_converter_outputs), none if not provided
+        mode: str
+            Mode of the outputs written without a mode folder (single mode runs)
+        vme_hbb: str
+            annotations_HBB folder, indexed as source VME, splits original_<file name>. False
+            skips it
+        vme_obb: str
+            annotations_OBB folder or pack file, False skips it
+        vme_splits: str or list
+            Splits of the OBB annotations to index
+    """
+    index = AnnotationIndex(db_path)
+    if outputs_root is not None:
+        index_converter_outputs(index, outputs_root, mode=mode)
+    if vme_hbb:
+        for coco_json in sorted(Path(vme_hbb).glob("*.json")):
+            if index.add_coco(coco_json, "VME", split="original_{}".format(coco_json.stem)):
+                print("indexed {}".format(coco_json))
+    if vme_obb:
+        for split in parse_names(vme_splits):
+            if index.add_vme_obb(split, vme_obb):
+                print("indexed VME OBB {}".format(split))
+    for row in index.files():
+        num_annotations = index.count(source=row["source"], split=row["split"], mode=row["mode"],
+                                      box_type=row["box_type"])
+        print("{:<12}{:<20}{:<12}{:<5}{:>10} annotations".format(
+            row["source"], row["split"], row["mode"], row["box_type"], num_annotations))
+    index.close()
+
+
+def files(db_path, source=None, split=None, mode=None, box_type=None):
+    """
+    Prints the indexed files
+    """
+    index = AnnotationIndex(db_path)
+    for row in index.files(source, split, mode, box_type):
+        print("{:<12}{:<20}{:<12}{:<5}{}".format(row["source"], row["split"], row["mode"], row["box_type"], row["path"]))
+
+
+def count(db_path, **filters):
+    """
+    Prints the number of annotations matching the filters
+    """
+    print(AnnotationIndex(db_path).count(**filters))
+
+
+def images(db_path, min_objects=1, max_objects=None, **filters):
+    """
+    Prints the images with min_objects <= matching annotations (<= max_objects)
+    """
+    for source, split, mode, box_type, file_name, num_objects in AnnotationIndex(db_path).images(
+            min_objects, max_objects, **filters):
+        print("{}\t{}\t{}\t{}\t{}\t{}".format(source, split, mode, box_type, file_name, num_objects))
+
+
+def export(db_path, output_json, keep_empty=False, min_objects=None, max_objects=None, **filters):
+    """
+    Writes the annotations matching the filters to a COCO file
+    """
+    AnnotationIndex(db_path).export_coco(output_json, keep_empty, min_objects, max_objects, **filters)
+
+
+if __name__ == "__main__":
+    fire.Fire({"build": build, "files": files, "count": count, "images": images, "export": export})
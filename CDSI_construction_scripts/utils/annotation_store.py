@@ -0,0 +1,196 @@
+"""
+columnar (struct-of-arrays) annotation store filled by the converters
+
+Each box costs a few array slots (image index, source label code, x, y, w, h) instead of a
+CocoAnnotation object. Area filtering, category remapping and the COCO export run as vectorized
+operations over the whole dataset.
+"""
+import numpy as np
+
+from utils.instrumentation import count, stage
+
+INITIAL_CAPACITY = 1024
+
+
+class AnnotationStore:
+    """
+    Image table (file_name, width, height) and annotation columns (image_index, label_code,
+    x, y, w, h) where label_code indexes self.labels, the source category keys.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.file_names = []
+        self.widths = []
+        self.heights = []
+        self.labels = []
+        self._label_to_code = {}
+        self.num_annotations = 0
+        self._image_index = np.zeros(capacity, dtype=np.int32)
+        self._label_code = np.zeros(capacity, dtype=np.int32)
+        self._boxes = np.zeros((capacity, 4), dtype=np.float64)
+
+    @property
+    def num_images(self):
+        return len(self.file_names)
+
+    @property
+    def image_index(self):
+        return self._image_index[:self.num_annotations]
+
+    @property
+    def label_code(self):
+        return self._label_code[:self.num_annotations]
+
+    @property
+    def boxes(self):
+        """
+        (N, 4) [xmin, ymin, width, height] source boxes
+        """
+        return self._boxes[:self.num_annotations]
+
+    def _reserve(self, size):
+        capacity = len(self._image_index)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        self._image_index = np.resize(self._image_index, capacity)
+        self._label_code = np.resize(self._label_code, capacity)
+        self._boxes = np.resize(self._boxes, (capacity, 4))
+
+    def label_codes(self, labels):
+        """
+        Returns the codes of the given source category keys, adding unseen ones to self.labels
+        """
+        codes = []
+        for label in labels:
+            code = self._label_to_code.get(label)
+            if code is None:
+                code = self._label_to_code[label] = len(self.labels)
+                self.labels.append(label)
+            codes.append(code)
+        return codes
+
+    def add_image(self, file_name, width, height, labels=(), boxes=()):
+        """
+        Adds an image and its boxes.
+
+        Args:
+            file_name: str
+            width: int
+            height: int
+            labels: sequence
+                Source category key of every box (category name or source id)
+            boxes: sequence or np.ndarray
+                [xmin, ymin, width, height] of every box
+        Returns:
+            index of the image
+        """
+        image_index = self.num_images
+        self.file_names.append(file_name)
+        self.widths.append(int(width))
+        self.heights.append(int(height))
+
+        num_boxes = len(labels)
+        if num_boxes:
+            start, end = self.num_annotations, self.num_annotations + num_boxes
+            self._reserve(end)
+            self._image_index[start:end] = image_index
+            self._label_code[start:end] = self.label_codes(labels)
+            self._boxes[start:end] = boxes
+            self.num_annotations = end
+        return image_index
+
+    def coco_boxes_and_areas(self):
+        """
+        Vectorized utils.coco_writer.coco_bbox_and_area over all boxes.
+
+        Returns:
+            (coco_boxes, areas, empty) where coco_boxes are the float bounds as
+            [xmin, ymin, width, height], areas the truncated int areas and empty marks zero area
+            boxes (exported with an empty bbox)
+        """
+        boxes = self.boxes
+        x0, y0 = boxes[:, 0], boxes[:, 1]
+        x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+        minx, maxx = np.minimum(x0, x1), np.maximum(x0, x1)
+        miny, maxy = np.minimum(y0, y1), np.maximum(y0, y1)
+        width, height = maxx - minx, maxy - miny
+        area = width * height
+        coco_boxes = np.stack([minx, miny, width, height], axis=1)
+        return coco_boxes, np.trunc(area).astype(np.int64), area == 0
+
+    def remapped_category_ids(self, category_id_remapping):
+        """
+        Returns the remapped category id of every box, -1 for labels missing from the mapping
+        """
+        lut = np.array(
+            [int(category_id_remapping[label]) if label in category_id_remapping else -1 for label in self.labels]
+            + [-1],
+            dtype=np.int64,
+        )
+        return lut[self.label_code] if self.num_annotations else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def area_mask(areas, min_area=None, max_area=None):
+        """
+        Returns min_area < areas < max_area, a missing bound is not checked
+        """
+        mask = np.ones(len(areas), dtype=bool)
+        if min_area is not None:
+            mask &= areas > min_area
+        if max_area is not None:
+            mask &= areas < max_area
+        return mask
+
+    def write_coco(self, writer, category_id_remapping, min_area=None, max_area=None, image_indices=None, group=None):
+        """
+        Writes the images and the boxes whose label is in category_id_remapping and whose area
+        satisfies min_area < area < max_area to a CocoJsonWriter (categories must already be added).
+        image_indices (increasing store indices) restricts the export to a subset of the images,
+        all images are written if not provided. The kept and dropped (per reason) annotation
+        counts are recorded in the instrumentation counter group 'group' (e.g. the mode).
+
+        Returns:
+            number of written annotations
+        """
+        if image_indices is None:
+            image_indices = np.arange(self.num_images)
+        image_indices = np.asarray(image_indices, dtype=np.int64)
+        with stage("serialization"):
+            # store image index -> written image id, 0 for images left out
+            image_ids = np.zeros(self.num_images + 1, dtype=np.int64)
+            image_ids[image_indices] = np.arange(writer.num_images + 1, writer.num_images + 1 + len(image_indices))
+            for image_index in image_indices.tolist():
+                writer.add_image(
+                    file_name=self.file_names[image_index],
+                    height=self.heights[image_index],
+                    width=self.widths[image_index],
+                )
+
+        with stage("filter_remap"):
+            coco_boxes, areas, empty = self.coco_boxes_and_areas()
+            category_ids = self.remapped_category_ids(category_id_remapping)
+            annotation_image_ids = image_ids[self.image_index]
+            in_images = annotation_image_ids > 0
+            in_categories = in_images & (category_ids >= 0)
+            keep_mask = in_categories & self.area_mask(areas, min_area, max_area)
+            keep = np.flatnonzero(keep_mask)
+
+        count("images_written", len(image_indices), group=group)
+        count("annotations_kept", len(keep), group=group)
+        count("dropped_category", int(in_images.sum() - in_categories.sum()), group=group)
+        count("dropped_area", int(in_categories.sum() - len(keep)), group=group)
+        count("empty_bbox", int(empty[keep].sum()), group=group)
+
+        with stage("serialization"):
+            bbox_list = coco_boxes[keep].tolist()
+            for i in np.flatnonzero(empty[keep]).tolist():
+                bbox_list[i] = []
+            writer.add_annotations(
+                annotation_image_ids[keep].tolist(),
+                bbox_list,
+                category_ids[keep].tolist(),
+                areas[keep].tolist(),
+            )
+        return len(keep)
@@ -0,0 +1,160 @@
+"""
+packed binary export of COCO files (converter outputs, merged CDSI splits, annotations_HBB)
+for training data loaders
+
+The export is a directory of .npy arrays, annotations grouped by image:
+    boxes.npy           (N, 4) float32 [xmin, ymin, width, height], zeros for empty bboxes
+    category_ids.npy    (N,) int32
+    areas.npy           (N,) float64, the areas of the COCO file (exact for int areas)
+    annotation_ids.npy  (N,) int64
+    image_offsets.npy   (num_images + 1,) int64, annotations of image i are [offsets[i], offsets[i + 1])
+    image_ids.npy       (num_images,) int64
+    image_sizes.npy     (num_images, 2) int32 width, height
+    meta.json           file names (in image order) and categories
+The arrays are opened with np.load(mmap_mode='r'), so the loader workers share one page-cache
+copy and the annotations of an image are a zero copy slice.
+
+usage:
+    python coco_binary.py export test.json test_bin
+    python coco_binary.py info test_bin
+"""
+from pathlib import Path
+
+import fire
+import numpy as np
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.json_io import load_json, save_json
+from utils.json_stream import iter_json_sections
+
+ARRAY_NAMES = ["boxes", "category_ids", "areas", "annotation_ids", "image_offsets", "image_ids", "image_sizes"]
+INITIAL_CAPACITY = 1024
+
+
+def export_coco_binary(coco_json, output_dir):
+    """
+    Streams a COCO json file into the packed binary format.
+
+    Args:
+        coco_json: str
+            COCO json file path
+        output_dir: str
+            Output directory of the .npy arrays and meta.json
+    """
+    image_ids, file_names, image_sizes = [], [], []
+    categories = []
+    num_annotations = 0
+    capacity = INITIAL_CAPACITY
+    boxes = np.zeros((capacity, 4), dtype=np.float32)
+    ann_image_ids = np.zeros(capacity, dtype=np.int64)
+    category_ids = np.zeros(capacity, dtype=np.int32)
+    areas = np.zeros(capacity, dtype=np.float64)
+    annotation_ids = np.zeros(capacity, dtype=np.int64)
+
+    for key, value in iter_json_sections(coco_json):
+        if key == "images":
+            for image in value:
+                image_ids.append(image["id"])
+                file_names.append(image["file_name"])
+                image_sizes.append((image["width"], image["height"]))
+        elif key == "categories":
+            categories = list(value)
+        elif key == "annotations":
+            for annotation in value:
+                if num_annotations == capacity:
+                    capacity *= 2
+                    boxes = np.resize(boxes, (capacity, 4))
+                    ann_image_ids = np.resize(ann_image_ids, capacity)
+                    category_ids = np.resize(category_ids, capacity)
+                    areas = np.resize(areas, capacity)
+                    annotation_ids = np.resize(annotation_ids, capacity)
+                bbox = annotation["bbox"]
+                boxes[num_annotations] = bbox if len(bbox) == 4 else 0
+                ann_image_ids[num_annotations] = annotation["image_id"]
+                category_ids[num_annotations] = annotation["category_id"]
+                areas[num_annotations] = annotation["area"]
+                annotation_ids[num_annotations] = annotation["id"]
+                num_annotations += 1
+
+    image_ids = np.array(image_ids, dtype=np.int64)
+    ann_image_ids = ann_image_ids[:num_annotations]
+
+    # group the annotations by image, in image order (stable, so each image keeps its file order)
+    image_order = np.argsort(image_ids, kind="stable")
+    sorted_image_ids = image_ids[image_order]
+    positions = np.searchsorted(sorted_image_ids, ann_image_ids)
+    known = positions < len(sorted_image_ids)
+    known[known] = sorted_image_ids[positions[known]] == ann_image_ids[known]
+    if not known.all():
+        raise ValueError("{} has annotations of unknown images".format(coco_json))
+    ann_image_index = image_order[positions]
+    annotation_order = np.argsort(ann_image_index, kind="stable")
+    image_offsets = np.zeros(len(image_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ann_image_index, minlength=len(image_ids)), out=image_offsets[1:])
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    arrays = {
+        "boxes": boxes[:num_annotations][annotation_order],
+        "category_ids": category_ids[:num_annotations][annotation_order],
+        "areas": areas[:num_annotations][annotation_order],
+        "annotation_ids": annotation_ids[:num_annotations][annotation_order],
+        "image_offsets": image_offsets,
+        "image_ids": image_ids,
+        "image_sizes": np.array(image_sizes, dtype=np.int32).reshape(-1, 2),
+    }
+    for name in ARRAY_NAMES:
+        np.save(output_dir / "{}.npy".format(name), arrays[name])
+    save_json({"file_names": file_names, "categories": categories}, output_dir / "meta.json")
+    print("{}: {} images, {} annotations".format(output_dir, len(image_ids), num_annotations))
+
+
+class CocoBinary:
+    """
+    Memory-mapped reader of an export_coco_binary directory
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(self.path / "{}.npy".format(name), mmap_mode="r"))
+        meta = load_json(self.path / "meta.json")
+        self.file_names = meta["file_names"]
+        self.categories = meta["categories"]
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def image(self, index):
+        """
+        Returns the COCO image dict of the index-th image
+        """
+        width, height = self.image_sizes[index]
+        return {
+            "height": int(height),
+            "width": int(width),
+            "id": int(self.image_ids[index]),
+            "file_name": self.file_names[index],
+        }
+
+    def annotations(self, index):
+        """
+        Returns the (boxes, category_ids) of the index-th image, read-only views of the memmaps
+        """
+        start, end = self.image_offsets[index], self.image_offsets[index + 1]
+        return self.boxes[start:end], self.category_ids[start:end]
+
+
+def info(path):
+    """
+    Prints the content summary of an export
+    """
+    data = CocoBinary(path)
+    print("images", len(data))
+    print("annotations", len(data.boxes))
+    print("categories", data.categories)
+
+
+if __name__ == "__main__":
+    fire.Fire({"export": export_coco_binary, "info": info})
@@ -1,9 +1,12 @@
-import json
 import argparse
-from collections import Counter
-import pandas as pd
-import numpy as np    # to create dummy data
+import os
+import numpy as np
 import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.instrumentation import count, stage, start_run
+from utils.json_io import load_json, save_json
 
 
 def read_json_data(filename):
@@ -12,9 +15,7 @@ def read_json_data(filename):
     :param filename: path with filename
     :return: json data
     """
-    with open(filename) as json_file:
-        data = json.load(json_file)
-    return data
+    return load_json(filename)
 
 
 def write_to_json(data, filename):
@@ -25,8 +26,54 @@ def write_to_json(data, filename):
     :return: None
     """
     print('writing the result in json file', filename)
-    with open(filename, 'w') as outfile:
-        json.dump(data, outfile)
+    save_json(data, filename)
+
+
+def parse_spec(spec):
+    """
+    Parses a 'category:min:max' filter spec (the category name may contain spaces)
+    :param spec: spec string
+    :return: (category, min, max)
+    """
+    cat, min_area, max_area = spec.rsplit(':', 2)
+    return cat, int(min_area), int(max_area)
+
+
+def annotation_arrays(data):
+    """
+    Columns of the annotations used by the filters, built once per input file
+    :param data: coco json data
+    :return: (category ids, areas, image ids) of the annotations and the image ids of the images
+    """
+    anns = data['annotations']
+    ann_cat = np.fromiter((i['category_id'] for i in anns), dtype=np.int64, count=len(anns))
+    ann_area = np.fromiter((i['area'] for i in anns), dtype=np.float64, count=len(anns))
+    ann_img = np.fromiter((i['image_id'] for i in anns), dtype=np.int64, count=len(anns))
+    img_ids = np.fromiter((img['id'] for img in data['images']), dtype=np.int64, count=len(data['images']))
+    return ann_cat, ann_area, ann_img, img_ids
+
+
+def filter_cat_area(data, arrays, cat_id, min, max, group=None):
+    """
+    Keeps the annotations of cat_id with min <= area < max and the images that have one of them
+    :param data: coco json data
+    :param arrays: annotation_arrays of data
+    :param group: instrumentation counter group of the kept/dropped counts (e.g. the spec)
+    :return: filtered coco json data (other keys are shared with data)
+    """
+    ann_cat, ann_area, ann_img, img_ids = arrays
+    in_cat = ann_cat == cat_id
+    ann_inds = np.flatnonzero(in_cat & (ann_area >= min) & (ann_area < max))
+    count('annotations_kept', len(ann_inds), group=group)
+    count('dropped_category', int(len(in_cat) - in_cat.sum()), group=group)
+    count('dropped_area', int(in_cat.sum() - len(ann_inds)), group=group)
+    img_inds = np.flatnonzero(np.isin(img_ids, ann_img[ann_inds]))
+    annotations = data['annotations']
+    images = data['images']
+    new_data = dict(data)
+    new_data['images'] = [images[i] for i in img_inds.tolist()]
+    new_data['annotations'] = [annotations[i] for i in ann_inds.tolist()]
+    return new_data
 
 
 parser = argparse.ArgumentParser(description='coco files checker')
@@ -35,56 +82,54 @@ parser.add_argument('-i', '--input-file', dest='input_file', required=True, help
 parser.add_argument('-m', '--min', dest='min', type=int, metavar='N', help='min area')
 parser.add_argument('-x', '--max', dest='max', type=int, metavar='N', help='max area')
 parser.add_argument('-c', '--cat', dest='cat', help='category')
+parser.add_argument('--no-stats', dest='stats', action='store_false',
+                    help='do not save the run statistics to <out-file>.stats.json')
+parser.add_argument('-s', '--spec', dest='specs', action='append', default=[], metavar='CAT:MIN:MAX',
+                    help='category and area range filter, can be repeated to write several subsets in one run')
 
 args = parser.parse_args()
 coco_json_file = args.input_file
 out_json_file = args.out_file
-min = args.min
-max = args.max
-cat = args.cat
-
-data = read_json_data(coco_json_file)
+specs = [parse_spec(spec) for spec in args.specs]
+if args.cat is not None:
+    specs.insert(0, (args.cat, args.min, args.max))
+if not specs:
+    parser.error('give a category and area range with -c/-m/-x or --spec')
+
+run = start_run('coco_filter_cat_area', input_file=coco_json_file, specs=specs)
+with stage('input_parse'):
+    data = read_json_data(coco_json_file)
+count('bytes_read', os.path.getsize(coco_json_file))
+count('images', len(data['images']))
+count('annotations_parsed', len(data['annotations']))
 
 print('orig annotation len', len(data['annotations']))
 print('orig images len', len(data['images']))
 print('orig categories', data['categories'])
 
-cat_id = -1
-for i in data['categories']:
-    if i['name'] == cat:
-        cat_id = i['id']
-
-print('processing category:', cat, ', with id:', cat_id)
-
-imgs = set()
-obj_imgs = set()
-new_ann = []
-obj_range_area = []
-cnt = 0
-for i in data['annotations']:
-
-    if i['category_id'] == cat_id:
-        # get cars or others categories that are between min & max
-        if i['area'] >= min and i['area'] < max:
-            obj_range_area.append(i)
-            obj_imgs.add(i['image_id'])
-            new_ann.append(i)
-            imgs.add(i['image_id'])
-
-
-# print('obj-area > 1024:', cnt)
-print('len of small objects between min & max', len(new_ann))
-print('len images-small between min & max', len(imgs))
-########################
-new_images = []
-for img in data['images']:
-    if img['id'] in obj_imgs:
-        new_images.append(img)
-
-data['images'] = new_images
-data['annotations'] = obj_range_area
-
-out_file = '{}/{}_{}_{}_{}.json'.format('/'.join(out_json_file.split('/')[:-1]), out_json_file.split('/')[-1].split('.')[0], cat, min, max)
-if len(obj_range_area) > 0:
-    write_to_json(data, out_file)
+with stage('filter_remap'):
+    arrays = annotation_arrays(data)
+for cat, min, max in specs:
+    cat_id = -1
+    for i in data['categories']:
+        if i['name'] == cat:
+            cat_id = i['id']
+
+    print('processing category:', cat, ', with id:', cat_id)
+
+    spec = '{}:{}:{}'.format(cat, min, max)
+    with stage('filter_remap'):
+        new_data = filter_cat_area(data, arrays, cat_id, min, max, group=spec)
+    count('images_written', len(new_data['images']), group=spec)
+
+    print('len of small objects between min & max', len(new_data['annotations']))
+    print('len images-small between min & max', len(new_data['images']))
+
+    out_file = '{}/{}_{}_{}_{}.json'.format('/'.join(out_json_file.split('/')[:-1]), out_json_file.split('/')[-1].split('.')[0], cat, min, max)
+    if len(new_data['annotations']) > 0:
+        with stage('serialization'):
+            write_to_json(new_data, out_file)
+        count('bytes_written', os.path.getsize(out_file))
 
+if args.stats:
+    run.save('{}.stats.json'.format(os.path.splitext(out_json_file)[0]))
@@ -0,0 +1,112 @@
+"""
+streaming N-way COCO merge, a single pass replacement for chaining ``pyodi coco merge``
+
+The inputs are read one item at a time and written through a CocoJsonWriter, so memory is
+bounded by the image id map of one input instead of the size of the merged dataset.
+Categories are reconciled by name as pyodi does: a category name already in the output keeps
+the output id, a new name gets the largest output id + 1 (the categories of the first input are
+kept as they are). Image and annotation ids are renumbered from 1 in input order.
+
+usage:
+    python coco_merge.py CDSI_train.json xview_train.json DOTA_train.json vedai_train.json ...
+"""
+import tempfile
+from pathlib import Path
+
+import fire
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.coco_writer import CocoJsonWriter
+from utils.json_io import dumps, loads
+from utils.json_stream import iter_json_sections
+
+
+def merge_categories(writer, categories):
+    """
+    Adds the categories of an input to the writer and returns the input id -> output id map
+    """
+    name_to_id = {category["name"]: category["id"] for category in writer.categories}
+    first_input = not writer.categories
+    category_id_map = {}
+    for category in categories:
+        category_id = name_to_id.get(category["name"])
+        if category_id is None:
+            if first_input:
+                category_id = int(category["id"])
+            else:
+                category_id = max(output_category["id"] for output_category in writer.categories) + 1
+            writer.categories.append(dict(category, id=category_id))
+            name_to_id[category["name"]] = category_id
+        category_id_map[category["id"]] = category_id
+    return category_id_map
+
+
+def _merge_input(writer, input_file):
+    """
+    Streams one COCO file into the writer. Annotations found before the images and categories
+    they refer to are spooled and written once the input has been read.
+    """
+    image_id_map = {}
+    category_id_map = None
+    images_done = False
+    num_annotations = 0
+    with tempfile.TemporaryFile("w+", encoding="utf-8", dir=writer.save_path.parent) as spool:
+        for key, value in iter_json_sections(input_file):
+            if key == "images":
+                for image in value:
+                    image_id_map[image["id"]] = writer.add_image_entry(image)
+                images_done = True
+            elif key == "categories":
+                category_id_map = merge_categories(writer, value)
+            elif key == "annotations":
+                for annotation in value:
+                    num_annotations += 1
+                    if images_done and category_id_map is not None:
+                        writer.add_annotation_entry(
+                            annotation,
+                            image_id_map[annotation["image_id"]],
+                            category_id_map[annotation["category_id"]],
+                        )
+                    else:
+                        spool.write(dumps(annotation))
+                        spool.write("\n")
+
+        spool.seek(0)
+        for line in spool:
+            annotation = loads(line)
+            writer.add_annotation_entry(
+                annotation,
+                image_id_map[annotation["image_id"]],
+                category_id_map[annotation["category_id"]],
+            )
+    return len(image_id_map), num_annotations
+
+
+def coco_merge(output_file, *input_files):
+    """
+    Merges COCO json files into output_file in a single streaming pass.
+
+    Args:
+        output_file: str
+            Merged COCO json path
+        input_files: str
+            COCO json files to merge, in order (e.g. the converter outputs and the VME
+            annotations_HBB split of the same split)
+    """
+    if not input_files:
+        raise ValueError("no input file to merge")
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    with CocoJsonWriter(output_file) as writer:
+        for input_file in input_files:
+            num_images, num_annotations = _merge_input(writer, input_file)
+            print("{}: {} images, {} annotations".format(input_file, num_images, num_annotations))
+    print(
+        "{}: {} images, {} annotations, {} categories".format(
+            output_file, writer.num_images, writer.num_annotations, len(writer.categories)
+        )
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(coco_merge)
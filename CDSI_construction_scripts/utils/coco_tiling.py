@@ -0,0 +1,254 @@
+"""
+slices the large source images of a converter output (xView, DOTA-v2.0, FAIR1M) into VME
+sized chips, 512x512 by default, and writes the chip images with a chip-level COCO file
+
+Every image is cut on a grid of tile_size chips overlapping by overlap pixels (the last
+row/column is aligned to the image border, images smaller than a chip give one zero padded
+chip). The boxes of an image are clipped to all its chips at once (N boxes x T chips arrays):
+a clipped box is kept when at least min_visibility of its area is inside the chip and its
+clipped area passes min_area < area < max_area (the car modes area filter, e.g.
+--max_area 400, is thus applied after clipping). Chips are cut and saved by worker processes.
+
+usage:
+    python coco_tiling.py xview_train.json ../xview/train_images chips/xview_train --max_area 400 --workers 8
+    python coco_tiling.py DOTA-v2.json ../dota2 chips/dota --tile_size 512 --overlap 128
+"""
+from functools import partial
+from pathlib import Path
+
+import fire
+import numpy as np
+from PIL import Image
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.coco_writer import CocoJsonWriter
+from utils.instrumentation import count, stage, start_run
+from utils.json_stream import iter_json_sections
+from utils.parallel import map_images
+
+# decompression bomb check off, xView/FAIR1M images are legitimately large
+Image.MAX_IMAGE_PIXELS = None
+
+
+def tile_starts(length, tile_size, overlap):
+    """
+    Returns the chip offsets along an image side, the last chip ending at the border
+    """
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError("overlap must be smaller than tile_size")
+    starts = list(range(0, length - tile_size, stride))
+    return starts + [length - tile_size]
+
+
+def tile_grid(width, height, tile_size, overlap):
+    """
+    Returns the (T, 2) x, y offsets of the chips of an image, row by row
+    """
+    xs = tile_starts(width, tile_size, overlap)
+    ys = tile_starts(height, tile_size, overlap)
+    return np.array([(x, y) for y in ys for x in xs], dtype=np.float64).reshape(-1, 2)
+
+
+def clip_boxes(boxes, offsets, tile_size, min_visibility=0.5, min_area=0, max_area=None):
+    """
+    Clips boxes to every chip at once.
+
+    Args:
+        boxes: np.ndarray
+            (N, 4) [xmin, ymin, width, height] boxes of an image
+        offsets: np.ndarray
+            (T, 2) chip offsets (tile_grid)
+        tile_size: int
+        min_visibility: float
+            Fraction of a box area that must be inside a chip to keep it
+        min_area, max_area: int
+            The truncated clipped area must satisfy min_area < area < max_area, a bound is
+            not checked if None
+    Returns:
+        (keep, clipped, areas, visible, covered) where keep is the (N, T) mask of the kept
+        boxes, clipped the (N, T, 4) chip relative [xmin, ymin, width, height] boxes, areas
+        their (N, T) truncated areas, visible the (N, T) mask of the boxes overlapping a chip
+        and covered the visible boxes passing min_visibility
+    """
+    x0, y0 = boxes[:, 0:1], boxes[:, 1:2]
+    x1, y1 = x0 + boxes[:, 2:3], y0 + boxes[:, 3:4]
+    tx, ty = offsets[:, 0][None, :], offsets[:, 1][None, :]
+    cx0, cy0 = np.maximum(x0, tx), np.maximum(y0, ty)
+    cx1, cy1 = np.minimum(x1, tx + tile_size), np.minimum(y1, ty + tile_size)
+    widths, heights = cx1 - cx0, cy1 - cy0
+    visible = (widths > 0) & (heights > 0)
+    clipped_area = np.where(visible, widths * heights, 0.0)
+    box_area = (boxes[:, 2] * boxes[:, 3])[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        visibility = np.where(box_area > 0, clipped_area / box_area, 0.0)
+    areas = np.trunc(clipped_area).astype(np.int64)
+
+    covered = visible & (visibility >= min_visibility)
+    keep = covered.copy()
+    if min_area is not None:
+        keep &= areas > min_area
+    if max_area is not None:
+        keep &= areas < max_area
+    clipped = np.stack([cx0 - tx, cy0 - ty, widths, heights], axis=2)
+    return keep, clipped, areas, visible, covered
+
+
+def tile_image(item, images_dir, chips_dir, tile_size, overlap, min_visibility, min_area, max_area, keep_empty, chip_ext):
+    """
+    Cuts the chips of one image and saves them.
+
+    Args:
+        item: tuple
+            (image dict, (N, 4) boxes, (N,) category ids) of the image
+    Returns:
+        list of (chip file name, chip boxes, category ids, areas), one per saved chip
+    """
+    image, boxes, category_ids = item
+    offsets = tile_grid(image["width"], image["height"], tile_size, overlap)
+    with stage("tile_clip"):
+        keep, clipped, areas, visible, covered = clip_boxes(boxes, offsets, tile_size, min_visibility, min_area, max_area)
+    count("dropped_visibility", int((visible & ~covered).sum()))
+    count("dropped_area", int((covered & ~keep).sum()))
+    chip_inds = [t for t in range(len(offsets)) if keep_empty or keep[:, t].any()]
+    if not chip_inds:
+        return []
+
+    stem = Path(image["file_name"]).stem
+    chips = []
+    with stage("chip_write"), Image.open(Path(images_dir) / image["file_name"]) as source:
+        for t in chip_inds:
+            x, y = int(offsets[t, 0]), int(offsets[t, 1])
+            chip_name = "{}_{}_{}.{}".format(stem, x, y, chip_ext)
+            # crop pads the chips that go past the border (images smaller than a chip) with zeros
+            source.crop((x, y, x + tile_size, y + tile_size)).save(Path(chips_dir) / chip_name)
+            inds = np.flatnonzero(keep[:, t])
+            chips.append((chip_name, clipped[inds, t].tolist(), category_ids[inds].tolist(), areas[inds, t].tolist()))
+    count("chips", len(chips))
+    count("annotations_kept", int(keep[:, chip_inds].sum()))
+    return chips
+
+
+def read_coco_images(coco_json):
+    """
+    Streams a COCO file and returns its images, categories and the (boxes, category ids) of
+    every image, in image order
+    """
+    images, categories = [], []
+    image_ids, boxes, category_ids = [], [], []
+    for key, value in iter_json_sections(coco_json):
+        if key == "images":
+            images = list(value)
+        elif key == "categories":
+            categories = list(value)
+        elif key == "annotations":
+            for annotation in value:
+                # zero area boxes are written with an empty bbox
+                if len(annotation["bbox"]) != 4:
+                    continue
+                image_ids.append(annotation["image_id"])
+                boxes.append(annotation["bbox"])
+                category_ids.append(annotation["category_id"])
+
+    image_ids = np.array(image_ids, dtype=np.int64)
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    category_ids = np.array(category_ids, dtype=np.int64)
+    # group the boxes by image (stable, each image keeps its file order)
+    order = np.argsort(image_ids, kind="stable")
+    sorted_ids = image_ids[order]
+    per_image = []
+    for image in images:
+        start, end = np.searchsorted(sorted_ids, [image["id"], image["id"] + 1])
+        inds = order[start:end]
+        per_image.append((image, boxes[inds], category_ids[inds]))
+    return per_image, categories
+
+
+def tile_coco(
+    coco_json,
+    images_dir,
+    output_dir,
+    tile_size=512,
+    overlap=64,
+    min_visibility=0.5,
+    min_area=0,
+    max_area=None,
+    keep_empty=False,
+    chip_ext="png",
+    workers=1,
+    prefetch=0,
+    stats=True,
+):
+    """
+    Slices the images of a COCO file into chips and writes <output_dir>/images/*.<chip_ext>
+    and the chip COCO file <output_dir>/<coco file name>.
+
+    Args:
+        coco_json: str
+            COCO file made by a converter
+        images_dir: str
+            Folder the file_name of the images are relative to (the converter's images/data dir)
+        output_dir: str
+            Output folder of the chips and of the chip COCO file
+        tile_size: int
+            Chip side, 512 like the VME tiles
+        overlap: int
+            Overlap of neighbour chips in pixels
+        min_visibility: float
+            Fraction of a box that must be inside a chip to keep the clipped box
+        min_area: int
+            Clipped boxes must have a (truncated) area > min_area, None disables it
+        max_area: int
+            Clipped boxes must have a (truncated) area < max_area, e.g. 400 for the car modes
+        keep_empty: bool
+            Also writes the chips without boxes
+        chip_ext: str
+            Chip image format (png keeps the source pixels)
+        workers: int
+            Number of processes cutting and saving the chips, 1 runs serially
+        prefetch: int
+            Number of images handled ahead on a thread pool when running serially
+        stats: bool
+            Saves the run statistics to <output_dir>/<coco file stem>.stats.json
+    """
+    output_dir = Path(output_dir)
+    chips_dir = output_dir / "images"
+    chips_dir.mkdir(parents=True, exist_ok=True)
+    run = start_run("coco_tiling", coco_json=str(coco_json), tile_size=tile_size, overlap=overlap, workers=workers)
+
+    with stage("input_parse"):
+        per_image, categories = read_coco_images(coco_json)
+    count("images", len(per_image))
+    count("annotations_parsed", sum(len(boxes) for _, boxes, _ in per_image))
+
+    cut_chips = partial(
+        tile_image,
+        images_dir=images_dir,
+        chips_dir=chips_dir,
+        tile_size=tile_size,
+        overlap=overlap,
+        min_visibility=min_visibility,
+        min_area=min_area,
+        max_area=max_area,
+        keep_empty=keep_empty,
+        chip_ext=chip_ext,
+    )
+    coco = CocoJsonWriter(output_dir / Path(coco_json).name)
+    for category in categories:
+        coco.add_category(category["id"], category["name"], category.get("supercategory"))
+    for chips in map_images(cut_chips, per_image, workers=workers, prefetch=prefetch, desc="Tiling images"):
+        with stage("serialization"):
+            for chip_name, chip_boxes, chip_category_ids, chip_areas in chips:
+                image_id = coco.add_image(file_name="images/" + chip_name, height=tile_size, width=tile_size)
+                coco.add_annotations([image_id] * len(chip_boxes), chip_boxes, chip_category_ids, chip_areas)
+    coco.close()
+    print("{}: {} chips, {} annotations".format(coco.save_path, coco.num_images, coco.num_annotations))
+    if stats:
+        run.save(output_dir / "{}.stats.json".format(Path(coco_json).stem))
+
+
+if __name__ == "__main__":
+    fire.Fire(tile_coco)
@@ -0,0 +1,193 @@
+"""
+incremental COCO json writer used by the converters instead of building a sahi Coco object
+
+Images are written to the output as they come and annotations are spooled to a temporary file
+that is appended when the writer is closed, so memory stays constant whatever the dataset size.
+The output is the same as sahi's save_json(data=coco.json): same key order, same ids (starting
+at 1, assigned in insertion order) and compact separators.
+"""
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from utils.instrumentation import count, stage
+from utils.json_io import dumps
+
+
+def coco_bbox_and_area(bbox):
+    """
+    Returns the (bbox, area) sahi's CocoAnnotation gives for a [xmin, ymin, width, height] box:
+    float bounds of the box, int (truncated) area and an empty bbox for zero area boxes.
+    """
+    x0, y0 = bbox[0], bbox[1]
+    x1, y1 = x0 + bbox[2], y0 + bbox[3]
+    minx, maxx = float(min(x0, x1)), float(max(x0, x1))
+    miny, maxy = float(min(y0, y1)), float(max(y0, y1))
+    area = (maxx - minx) * (maxy - miny)
+    if area == 0:
+        return [], 0
+    return [minx, miny, maxx - minx, maxy - miny], int(area)
+
+
+# same text as dumps of the annotation dict (floats are written with float.__repr__)
+_ANNOTATION_TEMPLATE = '{"iscrowd":0,"image_id":%d,"bbox":%s,"segmentation":[],"category_id":%d,"id":%d,"area":%d}'
+
+
+def _dumps_bbox(bbox, float_precision=None):
+    if float_precision is not None:
+        return "[" + ",".join([repr(round(float(v), float_precision)) for v in bbox]) + "]"
+    return "[" + ",".join([repr(float(v)) for v in bbox]) + "]"
+
+
+class CocoJsonWriter:
+    """
+    Streams a COCO json (images, annotations, categories) to save_path.
+    The json is written to '<save_path>.partial' and renamed to save_path on close, so a failed
+    run never leaves a truncated output behind. float_precision rounds the written floats
+    (bboxes) to a number of decimals, they are written in full if not provided.
+    """
+
+    def __init__(self, save_path, float_precision=None):
+        self.save_path = Path(save_path)
+        self.float_precision = float_precision
+        self.categories = []
+        self.num_images = 0
+        self.num_annotations = 0
+        self._partial_path = self.save_path.with_name(self.save_path.name + ".partial")
+        self._file = None
+        self._spool = None
+
+    def _open(self):
+        self.save_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._partial_path, "w", encoding="utf-8")
+        self._file.write('{"images":[')
+        # spool next to the output so that the final copy stays on the same disk
+        self._spool = tempfile.TemporaryFile("w+", encoding="utf-8", dir=self.save_path.parent)
+
+    def add_category(self, id, name, supercategory=None):
+        self.categories.append(
+            {"id": int(id), "name": name, "supercategory": supercategory if supercategory else name}
+        )
+
+    def add_image(self, file_name, height, width):
+        """
+        Writes an image entry and returns its id
+        """
+        if self._file is None:
+            self._open()
+        self.num_images += 1
+        if self.num_images > 1:
+            self._file.write(",")
+        self._file.write(
+            dumps({"height": int(height), "width": int(width), "id": self.num_images, "file_name": file_name})
+        )
+        return self.num_images
+
+    def add_image_entry(self, image):
+        """
+        Writes an image dict taken from another COCO file, keeping all its keys but the id,
+        and returns its new id
+        """
+        if self._file is None:
+            self._open()
+        self.num_images += 1
+        if self.num_images > 1:
+            self._file.write(",")
+        self._file.write(dumps(dict(image, id=self.num_images), float_precision=self.float_precision))
+        return self.num_images
+
+    def add_annotation(self, image_id, bbox, category_id, area, segmentation=None, iscrowd=0):
+        """
+        Spools an annotation entry and returns its id
+        """
+        if self._file is None:
+            self._open()
+        self.num_annotations += 1
+        if self.num_annotations > 1:
+            self._spool.write(",")
+        self._spool.write(
+            dumps(
+                {
+                    "iscrowd": iscrowd,
+                    "image_id": image_id,
+                    "bbox": bbox,
+                    "segmentation": segmentation if segmentation is not None else [],
+                    "category_id": int(category_id),
+                    "id": self.num_annotations,
+                    "area": area,
+                },
+                float_precision=self.float_precision,
+            )
+        )
+        return self.num_annotations
+
+    def add_annotation_entry(self, annotation, image_id, category_id):
+        """
+        Spools an annotation dict taken from another COCO file with new image and category ids,
+        keeping all its other keys, and returns its new id
+        """
+        if self._file is None:
+            self._open()
+        self.num_annotations += 1
+        if self.num_annotations > 1:
+            self._spool.write(",")
+        self._spool.write(
+            dumps(
+                dict(annotation, image_id=image_id, category_id=category_id, id=self.num_annotations),
+                float_precision=self.float_precision,
+            )
+        )
+        return self.num_annotations
+
+    def add_annotations(self, image_ids, bboxes, category_ids, areas):
+        """
+        Spools many bbox-only annotations at once (python sequences of int image ids,
+        [xmin, ymin, width, height] float lists or [], int category ids and int areas)
+        """
+        if self._file is None:
+            self._open()
+        lines = []
+        for image_id, bbox, category_id, area in zip(image_ids, bboxes, category_ids, areas):
+            self.num_annotations += 1
+            lines.append(_ANNOTATION_TEMPLATE % (image_id, _dumps_bbox(bbox, self.float_precision), category_id, self.num_annotations, area))
+        if lines:
+            if self.num_annotations > len(lines):
+                self._spool.write(",")
+            self._spool.write(",".join(lines))
+
+    def close(self):
+        """
+        Appends the spooled annotations and the categories, and closes the output file
+        """
+        with stage("serialization"):
+            if self._file is None:
+                self._open()
+            self._file.write('],"annotations":[')
+            self._spool.seek(0)
+            shutil.copyfileobj(self._spool, self._file)
+            self._spool.close()
+            self._file.write('],"categories":')
+            self._file.write(dumps(self.categories))
+            self._file.write("}")
+            self._file.close()
+            os.replace(self._partial_path, self.save_path)
+        count("bytes_written", self.save_path.stat().st_size)
+
+    def abort(self):
+        """
+        Closes and removes a partially written output
+        """
+        if self._file is not None:
+            self._spool.close()
+            self._file.close()
+            os.remove(self._partial_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,114 @@
+"""
+image header probing shared by the converters, backed by a persistent size cache
+
+Only the image header is read (PIL opens images lazily) and the handle is closed right away.
+Sizes are cached on disk keyed by (path, file size, mtime), so later runs (other modes, other
+splits) do not touch the images at all.
+"""
+import os
+from collections import namedtuple
+from pathlib import Path
+
+from PIL import Image
+
+from utils.instrumentation import count, stage
+from utils.json_io import load_json, save_json
+
+CACHE_PATH = Path.home() / ".cache" / "cdsi" / "image_sizes.json"
+
+ImageInfo = namedtuple("ImageInfo", ["path", "width", "height", "file_size", "mtime_ns"])
+
+# cache visible to probe_image, set by ImageSizeCache.activate (inherited by forked workers)
+_active_cache = None
+
+
+def read_image_size(image_path):
+    """
+    Returns the (width, height) of an image reading only its header
+    """
+    with Image.open(image_path) as image:
+        return image.size
+
+
+def probe_image(image_path):
+    """
+    Returns the ImageInfo of an image, from the active cache when it is up to date
+    """
+    with stage("image_probe"):
+        image_path = os.path.abspath(image_path)
+        stat = os.stat(image_path)
+        if _active_cache is not None:
+            cached = _active_cache.lookup(image_path, stat.st_size, stat.st_mtime_ns)
+            if cached is not None:
+                count("image_size_cache_hits")
+                return cached
+        width, height = read_image_size(image_path)
+        count("image_headers_read")
+        return ImageInfo(image_path, width, height, stat.st_size, stat.st_mtime_ns)
+
+
+class ImageSizeCache:
+    """
+    On-disk (path, file size, mtime) -> (width, height) cache
+    """
+
+    def __init__(self, cache_path=CACHE_PATH):
+        self.cache_path = Path(cache_path)
+        self.entries = self._read(self.cache_path)
+        self.dirty = False
+
+    @staticmethod
+    def _read(cache_path):
+        if not cache_path.exists():
+            return {}
+        try:
+            return load_json(cache_path)
+        except ValueError:
+            # a broken cache is just rebuilt
+            return {}
+
+    def activate(self):
+        """
+        Makes probe_image use this cache, call it before starting worker processes
+        """
+        global _active_cache
+        _active_cache = self
+        return self
+
+    def lookup(self, image_path, file_size, mtime_ns):
+        entry = self.entries.get(image_path)
+        if entry is None or entry[0] != file_size or entry[1] != mtime_ns:
+            return None
+        return ImageInfo(image_path, entry[2], entry[3], file_size, mtime_ns)
+
+    def store(self, image_info):
+        entry = [image_info.file_size, image_info.mtime_ns, image_info.width, image_info.height]
+        if self.entries.get(image_info.path) != entry:
+            self.entries[image_info.path] = entry
+            self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache, merged with entries saved meanwhile by other runs
+        """
+        if not self.dirty:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        entries = self._read(self.cache_path)
+        entries.update(self.entries)
+        tmp_path = self.cache_path.with_name(self.cache_path.name + ".{}.tmp".format(os.getpid()))
+        save_json(entries, tmp_path)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
+
+
+def open_image_size_cache(image_size_cache=None):
+    """
+    Returns the activated cache for the converters' image_size_cache argument:
+    None uses the default cache file, False disables caching, anything else is a cache path.
+    """
+    global _active_cache
+    if image_size_cache is False:
+        _active_cache = None
+        return None
+    return ImageSizeCache(CACHE_PATH if image_size_cache is None else image_size_cache).activate()
@@ -0,0 +1,173 @@
+"""
+per-stage timing, counters and peak memory of the converter and filter runs, saved as a json
+report next to their output
+
+A run is started with start_run, which makes its RunStats the active one. The helpers of the
+pipeline (split loading, image probing, label parsing, the writer) record into the active run
+through stage() and count(), so they do not need to be handed the object:
+
+    stats = start_run("dota2_to_coco", split=split_images_path)
+    with stage("split_load"):
+        ...
+    count("annotations_parsed", len(boxes))
+    stats.save(report_path)
+
+Functions run by utils.parallel.map_images record into a fresh RunStats of their own (in the
+worker process or prefetch thread), which is sent back with their result and merged into the
+run (see instrumented). Nothing is kept when no run is active.
+
+Stage names used by the scripts: split_load, dir_listing, image_probe, label_parse,
+input_parse (json input of the filters), filter_remap, serialization.
+"""
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+from utils.json_io import save_json
+
+# run recorded into by stage() and count(), None when no run is started
+_active_run = None
+# per-item RunStats of instrumented(), thread local so that prefetch threads do not mix them
+_local = threading.local()
+
+
+def peak_rss_mb(who="self"):
+    """
+    Returns the peak resident memory in MB of this process ('self') or of its finished
+    children ('children', e.g. the map_images workers), None if it can not be measured
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS, in KB elsewhere
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class RunStats:
+    """
+    Accumulated stage times (seconds and number of calls) and counters of a run. Counters can be
+    grouped, e.g. the kept/dropped annotations of every conversion mode.
+    """
+
+    def __init__(self, name=None, **info):
+        self.name = name
+        self.info = info
+        self.stages = {}
+        self.counters = {}
+        self.groups = {}
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += time.perf_counter() - start
+            entry[1] += 1
+
+    def add(self, name, value=1, group=None):
+        counters = self.counters if group is None else self.groups.setdefault(group, {})
+        counters[name] = counters.get(name, 0) + value
+
+    def snapshot(self):
+        """
+        Returns the picklable (stages, counters, groups) of the run
+        """
+        return self.stages, self.counters, self.groups
+
+    def merge(self, snapshot):
+        """
+        Adds a snapshot (e.g. recorded in a worker process) to the run
+        """
+        stages, counters, groups = snapshot
+        for name, (seconds, calls) in stages.items():
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+        for name, value in counters.items():
+            self.add(name, value)
+        for group, group_counters in groups.items():
+            for name, value in group_counters.items():
+                self.add(name, value, group=group)
+
+    def report(self):
+        """
+        Returns the json report of the run. Stage times of work spread over worker processes
+        are summed over the workers, so they can exceed the wall time.
+        """
+        return {
+            "name": self.name,
+            "info": self.info,
+            "wall_seconds": time.perf_counter() - self.start_time,
+            "stages": {name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in self.stages.items()},
+            "counters": self.counters,
+            "groups": self.groups,
+            "peak_rss_mb": peak_rss_mb("self"),
+            "peak_rss_children_mb": peak_rss_mb("children"),
+        }
+
+    def save(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        save_json(self.report(), path, compact=False)
+        print("run statistics saved to {}".format(path))
+
+
+def start_run(name, **info):
+    """
+    Starts recording a run and returns its RunStats
+    """
+    global _active_run
+    _active_run = RunStats(name, **info)
+    return _active_run
+
+
+def active_run():
+    return _active_run
+
+
+def _recording_run():
+    run = getattr(_local, "run", None)
+    return _active_run if run is None else run
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a stage of the active run, a no-op without one
+    """
+    run = _recording_run()
+    if run is None:
+        yield
+        return
+    with run.stage(name):
+        yield
+
+
+def count(name, value=1, group=None):
+    """
+    Adds value to a counter of the active run, a no-op without one
+    """
+    run = _recording_run()
+    if run is not None:
+        run.add(name, value, group=group)
+
+
+def instrumented(func, item):
+    """
+    Calls func(item) recording into a fresh RunStats, returns (result, snapshot of the stats)
+    """
+    outer_run = getattr(_local, "run", None)
+    _local.run = item_run = RunStats()
+    try:
+        return func(item), item_run.snapshot()
+    finally:
+        _local.run = outer_run
@@ -0,0 +1,85 @@
+"""
+json load/save used by every script, backed by orjson when it is installed and by the
+standard library json module otherwise
+
+Output is compact (no spaces) by default. float_precision rounds every float to a number of
+decimals before writing, e.g. 2 to write bboxes at 1/100 px.
+
+usage:
+    from utils.json_io import load_json, save_json
+    data = load_json("test.json")
+    save_json(data, "test_copy.json", float_precision=2)
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _round_floats(obj, float_precision):
+    if isinstance(obj, float):
+        return round(obj, float_precision)
+    if isinstance(obj, dict):
+        return {key: _round_floats(value, float_precision) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_round_floats(value, float_precision) for value in obj]
+    return obj
+
+
+def loads(text):
+    """
+    Parses a json str or bytes
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def dumps(obj, compact=True, float_precision=None):
+    """
+    Returns the json text of obj.
+
+    Args:
+        obj: json serializable object
+        compact: bool
+            No spaces after separators, as in the converter outputs. False gives the
+            json.dumps default ', ' and ': ' separators (always written by the json module).
+        float_precision: int
+            If provided, floats are rounded to this number of decimals
+    """
+    if float_precision is not None:
+        obj = _round_floats(obj, float_precision)
+    if orjson is not None and compact:
+        return orjson.dumps(obj).decode("utf-8")
+    if compact:
+        return json.dumps(obj, separators=(",", ":"))
+    return json.dumps(obj)
+
+
+def load_json(path):
+    """
+    Loads a json file
+    """
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(data, path, compact=True, float_precision=None):
+    """
+    Writes data to a json file, see dumps for the arguments
+    """
+    if orjson is not None and compact:
+        if float_precision is not None:
+            data = _round_floats(data, float_precision)
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(data))
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(dumps(data, compact=compact, float_precision=float_precision))
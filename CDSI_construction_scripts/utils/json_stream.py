@@ -0,0 +1,160 @@
+"""
+incremental json reader for files that are too big to load at once (xView geojson, COCO files,
+detection results)
+
+Only one array item is decoded at a time, so memory does not depend on the file size.
+"""
+import json
+
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = " \t\n\r"
+
+
+class _JsonScanner:
+    """
+    Buffered reader that decodes one json value at a time from a text file
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        chunk = self.fp.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """
+        Returns the next non whitespace character without consuming it, '' at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._fill()
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("expected '{}' at offset {} but found '{}'".format(char, self.pos, found))
+        self.pos += 1
+
+    def decode_value(self):
+        """
+        Decodes the next json value
+        """
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number ending exactly at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # the value is cut by the end of the buffer, read more (growing reads keep big values linear)
+            self._fill(size)
+            size *= 2
+
+    def iter_array(self):
+        """
+        Yields the items of the array that starts at the current position
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError("expected ',' or ']' at offset {} but found '{}'".format(self.pos - 1, char))
+
+
+class JsonArray:
+    """
+    Lazy iterator over the items of a json array found by iter_json_sections
+    """
+
+    def __init__(self, items):
+        self._items = items
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._items)
+
+    def drain(self):
+        for _ in self._items:
+            pass
+
+
+def iter_json_sections(path, chunk_size=CHUNK_SIZE):
+    """
+    Yields (key, value) for every top-level key of a json object file, in file order.
+    Array values are returned as JsonArray iterators which must be consumed before the next
+    section is read (whatever is left is skipped).
+    """
+    with open(path, encoding="utf-8") as fp:
+        scanner = _JsonScanner(fp, chunk_size)
+        scanner.expect("{")
+        if scanner.peek() == "}":
+            return
+        while True:
+            key = scanner.decode_value()
+            scanner.expect(":")
+            if scanner.peek() == "[":
+                value = JsonArray(scanner.iter_array())
+                yield key, value
+                value.drain()
+            else:
+                yield key, scanner.decode_value()
+            char = scanner.peek()
+            scanner.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError("expected ',' or '}}' at offset {} but found '{}'".format(scanner.pos - 1, char))
+
+
+def iter_json_array(path, key=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields the items of a json array one by one.
+
+    Args:
+        path: str
+            json file path
+        key: str
+            Top-level key of the array (e.g. 'features', 'annotations'). If None the file itself
+            must be an array, as in COCO detection result files.
+        chunk_size: int
+            Number of characters read at once
+    """
+    if key is None:
+        with open(path, encoding="utf-8") as fp:
+            yield from _JsonScanner(fp, chunk_size).iter_array()
+        return
+
+    for section_key, value in iter_json_sections(path, chunk_size):
+        if section_key == key:
+            if isinstance(value, JsonArray):
+                yield from value
+            return
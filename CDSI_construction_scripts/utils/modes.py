@@ -0,0 +1,47 @@
+"""
+conversion modes shared by the *_to_coco converters
+"""
+from pathlib import Path
+
+MODES = ['original', 'car_other', 'car']
+
+
+def parse_modes(mode):
+    """
+    Returns the list of modes to convert.
+
+    Args:
+        mode: str or list
+            One of MODES, 'all', a comma separated string or a list of modes
+    """
+    if isinstance(mode, str):
+        if mode == 'all':
+            return list(MODES)
+        return [m.strip() for m in mode.split(',') if m.strip()]
+    return list(mode)
+
+
+def get_split_name(split_images_path):
+    """
+    Returns the name of a split given as a split list file or a manifest split name
+    """
+    # named after the split list file (or manifest split name), wherever the list is
+    return Path(str(split_images_path)).name.split('.')[0]
+
+
+def get_output_path(output_dir, split_images_path, mode, modes):
+    """
+    Returns <output_dir>/<split>.json when a single mode is converted and
+    <output_dir>/<mode>/<split>.json when several modes are written in the same pass.
+    """
+    json_name = "{}.json".format(get_split_name(split_images_path))
+    if len(modes) == 1:
+        return Path(output_dir) / json_name
+    return Path(output_dir) / mode / json_name
+
+
+def get_report_path(output_dir, split_images_path):
+    """
+    Returns <output_dir>/<split>.stats.json, the run statistics of a conversion (all modes)
+    """
+    return Path(output_dir) / "{}.stats.json".format(get_split_name(split_images_path))
@@ -0,0 +1,81 @@
+"""
+helpers to spread the per-image work of the *_to_coco converters over a process pool, or to
+prefetch it on threads
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+from utils import instrumentation
+
+_END = object()
+
+
+def map_images(func, items, workers=1, desc=None, chunksize=None, prefetch=0):
+    """
+    Applies func to every item and yields the results in input order.
+
+    Args:
+        func: callable
+            Picklable (module level) function that handles a single item
+        items: iterable
+            Items to process, e.g. image filenames of a split
+        workers: int
+            Number of worker processes, 1 runs everything in the current process
+        desc: str
+            tqdm description
+        chunksize: int
+            Number of items sent to a worker at once, picked from the item count if not provided
+        prefetch: int
+            When running in the current process, number of items handled ahead on a thread
+            pool (their file reads overlap with the handling of the current item), 0 disables it.
+            Worker processes already overlap their reads, so it is not used with workers > 1.
+    """
+    items = list(items)
+    run = instrumentation.active_run()
+    if run is not None:
+        # stages and counters recorded by func (in the workers) are merged into the active run
+        instrumented_func = partial(instrumentation.instrumented, func)
+        for result, snapshot in _map(instrumented_func, items, workers, desc, chunksize, prefetch):
+            run.merge(snapshot)
+            yield result
+        return
+    yield from _map(func, items, workers, desc, chunksize, prefetch)
+
+
+def prefetch_map(func, items, depth):
+    """
+    Yields func(item) in input order, computing up to depth items ahead on a thread pool
+    """
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=depth)
+    try:
+        pending = deque(executor.submit(func, item) for _, item in zip(range(depth), items))
+        while pending:
+            result = pending.popleft().result()
+            # keep depth items in flight while the current result is consumed
+            item = next(items, _END)
+            if item is not _END:
+                pending.append(executor.submit(func, item))
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _map(func, items, workers, desc, chunksize, prefetch=0):
+    if workers is None or int(workers) <= 1:
+        if prefetch and int(prefetch) > 0:
+            yield from tqdm(prefetch_map(func, items, int(prefetch)), desc=desc, total=len(items))
+            return
+        yield from tqdm(map(func, items), desc=desc, total=len(items))
+        return
+
+    workers = int(workers)
+    if chunksize is None:
+        chunksize = max(1, len(items) // (workers * 16))
+    with Pool(processes=workers) as pool:
+        # imap keeps the input order, so ids are assigned exactly as in the serial run
+        yield from tqdm(pool.imap(func, items, chunksize=chunksize), desc=desc, total=len(items))
@@ -0,0 +1,208 @@
+"""
+compiled split-membership manifest built from the nine data_utils/*.txt split lists
+
+Every (source, filename) pair gets a bitmask with one bit per split (see SPLIT_NAMES), so
+membership tests are O(1) and the converters can loop over the members of a split directly
+instead of listing the image directories.
+
+usage:
+    python split_manifest.py build
+    python split_manifest.py members xview CDSI_train
+"""
+import os
+import sys
+from pathlib import Path
+
+import fire
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.instrumentation import count, stage
+from utils.json_io import load_json, save_json
+
+DATA_UTILS_DIR = Path(__file__).resolve().parents[1] / "data_utils"
+MANIFEST_PATH = DATA_UTILS_DIR / "split_manifest.json"
+
+# bit i of a membership mask is set when the image is listed in SPLIT_NAMES[i]
+SPLIT_NAMES = [
+    "original_train",
+    "original_val",
+    "original_test",
+    "CDSI_other_train",
+    "CDSI_other_val",
+    "CDSI_other_test",
+    "CDSI_train",
+    "CDSI_val",
+    "CDSI_test",
+]
+
+
+def parse_split_line(line):
+    """
+    Splits a 'source/filename' split list line, returns (source, filename).
+    Lines without a source prefix return None as source.
+    """
+    broken = line.strip().split('/')
+    if len(broken) > 1:
+        return broken[0], broken[1]
+    return None, broken[0]
+
+
+def build_manifest(split_dir=DATA_UTILS_DIR, manifest_path=MANIFEST_PATH):
+    """
+    Compiles the split lists into a manifest and saves it.
+
+    Args:
+        split_dir: str
+            Directory holding the SPLIT_NAMES txt files
+        manifest_path: str
+            Output manifest json path, nothing is saved if None
+    Returns:
+        manifest dict with, per source, the filenames, their membership masks and the ordered
+        filename indices of every split
+    """
+    sources = {}
+    for bit, split_name in enumerate(SPLIT_NAMES):
+        with open(Path(split_dir) / "{}.txt".format(split_name), 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                source, filename = parse_split_line(line)
+                entry = sources.setdefault(source, {"filenames": [], "masks": [], "members": {}, "index": {}})
+                ind = entry["index"].get(filename)
+                if ind is None:
+                    ind = len(entry["filenames"])
+                    entry["index"][filename] = ind
+                    entry["filenames"].append(filename)
+                    entry["masks"].append(0)
+                if not entry["masks"][ind] & (1 << bit):
+                    entry["masks"][ind] |= 1 << bit
+                    entry["members"].setdefault(split_name, []).append(ind)
+
+    for entry in sources.values():
+        del entry["index"]
+    manifest = {"splits": SPLIT_NAMES, "sources": sources}
+
+    if manifest_path is not None:
+        save_json(manifest, manifest_path)
+    return manifest
+
+
+class SplitManifest:
+    """
+    O(1) split membership lookups keyed by source and filename.
+    """
+
+    @classmethod
+    def load(cls, manifest_path=MANIFEST_PATH, split_dir=DATA_UTILS_DIR):
+        """
+        Loads the manifest, (re)building it first when it is missing or older than a split list.
+        """
+        manifest_path = Path(manifest_path)
+        split_mtimes = [os.path.getmtime(Path(split_dir) / "{}.txt".format(s)) for s in SPLIT_NAMES]
+        if not manifest_path.exists() or manifest_path.stat().st_mtime < max(split_mtimes):
+            return cls(build_manifest(split_dir, manifest_path))
+        return cls(load_json(manifest_path))
+
+    def __init__(self, manifest):
+        self.splits = manifest["splits"]
+        self.sources = manifest["sources"]
+        self._split_bits = {split_name: 1 << bit for bit, split_name in enumerate(self.splits)}
+        self._masks = {
+            source: dict(zip(entry["filenames"], entry["masks"])) for source, entry in self.sources.items()
+        }
+
+    def split_bit(self, split_name):
+        if split_name not in self._split_bits:
+            raise ValueError("unknown split '{}', pick one of {}".format(split_name, self.splits))
+        return self._split_bits[split_name]
+
+    def mask(self, source, filename):
+        """
+        Returns the membership bitmask of an image, 0 if it is in no split
+        """
+        return self._masks.get(source, {}).get(filename, 0)
+
+    def contains(self, source, filename, split_name):
+        return bool(self.mask(source, filename) & self.split_bit(split_name))
+
+    def splits_of(self, source, filename):
+        mask = self.mask(source, filename)
+        return [split_name for split_name in self.splits if mask & self._split_bits[split_name]]
+
+    def members(self, source, split_name):
+        """
+        Returns the filenames of a source that belong to a split, in split list order
+        """
+        self.split_bit(split_name)
+        entry = self.sources.get(source)
+        if entry is None:
+            return []
+        filenames = entry["filenames"]
+        return [filenames[ind] for ind in entry["members"].get(split_name, [])]
+
+
+def parse_split_paths(split_images_path):
+    """
+    Returns the list of splits given to a converter: one split, a comma separated string or a
+    list of split list files / manifest split names, 'all' for every manifest split
+    """
+    if isinstance(split_images_path, str):
+        if split_images_path == 'all':
+            return list(SPLIT_NAMES)
+        return [path.strip() for path in split_images_path.split(',') if path.strip()]
+    return [str(path) for path in split_images_path]
+
+
+def load_split_members(split_images_path, source, image_folder=None):
+    """
+    Returns the ordered, de-duplicated image filenames of a split.
+
+    Args:
+        split_images_path: str
+            Either a split list txt file ('source/filename' per line, e.g. made with grep)
+            or a split name of the manifest (e.g. CDSI_train)
+        source: str
+            Source prefix used in the split lists (xview, DOTA-v2.0, vedai, DIOR, fair1m, VME)
+        image_folder: str
+            If provided, members that are missing from this folder are dropped
+    """
+    with stage("split_load"):
+        split_images_lst = _read_split_members(split_images_path, source)
+    count("split_members", len(split_images_lst))
+    if image_folder is None:
+        return split_images_lst
+
+    with stage("dir_listing"):
+        existing_lst = [filename for filename in split_images_lst if os.path.isfile(os.path.join(image_folder, filename))]
+    if len(existing_lst) < len(split_images_lst):
+        count("split_members_missing", len(split_images_lst) - len(existing_lst))
+        print('skipping {} split images missing from {}'.format(len(split_images_lst) - len(existing_lst), image_folder))
+    return existing_lst
+
+
+def _read_split_members(split_images_path, source):
+    if os.path.isfile(split_images_path):
+        split_images_lst = []
+        seen = set()
+        with open(split_images_path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                _, filename = parse_split_line(line)
+                if filename not in seen:
+                    seen.add(filename)
+                    split_images_lst.append(filename)
+        return split_images_lst
+    return SplitManifest.load().members(source, split_images_path)
+
+
+def members(source, split_name):
+    """
+    Prints the 'source/filename' lines of a split, a replacement for grepping the split lists.
+    """
+    for filename in SplitManifest.load().members(source, split_name):
+        print("{}/{}".format(source, filename))
+
+
+if __name__ == "__main__":
+    fire.Fire({"build": build_manifest, "members": members})
@@ -0,0 +1,169 @@
+"""
+fast readers of the DIOR (VOC) and FAIR1M xml label files
+
+Only the object names and boxes are extracted, no element tree is built:
+    - the fast path scans the raw bytes of the file for the <object> blocks and the <name>,
+      <bndbox> / <point> fields in them, and converts all the coordinates of the file at once
+    - files the fast path can not read exactly (comments, CDATA, entities, attributes on the
+      read tags, unexpected layout) are read with iterparse, each object element being cleared
+      once read
+Both give the same labels and boxes as walking the ET.parse tree of the file.
+
+usage:
+    labels, boxes = read_fair1m_labels("labelXml/0.xml")
+"""
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+_NAME = re.compile(rb"<name>([^<]*)</name>")
+_POINT = re.compile(rb"<point>([^<]*)</point>")
+# a DIOR object starting with its name and holding one bndbox
+_DIOR_OBJECT = re.compile(
+    rb"<object>\s*<name>([^<]*)</name>(?:(?!<object[\s/>]|</object>).)*?"
+    rb"<bndbox>\s*<xmin>([^<]*)</xmin>\s*<ymin>([^<]*)</ymin>\s*<xmax>([^<]*)</xmax>\s*<ymax>([^<]*)</ymax>\s*</bndbox>",
+    re.S,
+)
+_DECLARED_ENCODING = re.compile(rb"""^\s*<\?xml[^>]*encoding=["']([^"']+)""")
+_SCANNED_ENCODINGS = {b"utf-8", b"utf8", b"us-ascii", b"ascii"}
+# read tags with attributes or spaces ('<object id="1">', '<name >'), plural wrappers are fine
+_UNSCANNED_TAG = re.compile(rb"<(?:object|name|point|bndbox)(?!s?>)")
+
+
+class _FastPathError(Exception):
+    """
+    Raised when the byte scan can not read a file exactly, the file is then read with iterparse
+    """
+
+
+def _check_scannable(data):
+    """
+    Raises _FastPathError for files using markup or an encoding the byte scan does not handle
+    """
+    # comments, CDATA, doctype and entity references
+    if data[:2] in (b"\xff\xfe", b"\xfe\xff") or b"<!" in data or b"&" in data:
+        raise _FastPathError()
+    if _UNSCANNED_TAG.search(data):
+        raise _FastPathError()
+    encoding = _DECLARED_ENCODING.match(data)
+    if encoding is not None and encoding.group(1).lower() not in _SCANNED_ENCODINGS:
+        raise _FastPathError()
+
+
+def _parse_numbers(text, sep, dtype, expected):
+    """
+    Converts the sep separated numbers of text at once, expecting a number of values
+    """
+    if not expected:
+        return np.zeros(0, dtype=dtype)
+    try:
+        values = np.fromstring(text, sep=sep, dtype=dtype)
+    except ValueError:
+        # text that is not only numbers (numpy >= 2 raises, older versions stop early)
+        raise _FastPathError()
+    if values.size != expected:
+        raise _FastPathError()
+    return values
+
+
+def _iterparse_objects(annotation_filepath, tag):
+    """
+    Yields the elements of the given tag, cleared after use so the tree never holds them all
+    """
+    for _, elem in ET.iterparse(annotation_filepath):
+        if elem.tag == tag:
+            yield elem
+            elem.clear()
+
+
+def _fair1m_fast(data):
+    _check_scannable(data)
+    header, *objects = data.split(b"<object>")
+    # a name in every object and as many names as objects, every point tag read by the scan
+    if b"<name>" in header or b"<point>" in header or not all(b"<name>" in obj for obj in objects):
+        raise _FastPathError()
+    counts = [obj.count(b"<point>") for obj in objects]
+    labels = [name.decode("utf-8") for name in _NAME.findall(data)]
+    points = _POINT.findall(data)
+    if len(labels) != len(objects) or not all(labels) or len(points) != sum(counts):
+        raise _FastPathError()
+    # x,y of every point of the file in a single conversion
+    values = _parse_numbers(b",".join(points).decode("ascii"), ",", np.float64, 2 * len(points))
+    return labels, values.reshape(-1, 2), counts
+
+
+def _fair1m_iterparse(annotation_filepath):
+    labels, points, counts = [], [], []
+    for obj in _iterparse_objects(annotation_filepath, "object"):
+        obj_points = [point.text.split(",") for point in obj.find("points")]
+        labels.append(obj.find("possibleresult/name").text)
+        points.extend((float(x), float(y)) for x, y in obj_points)
+        counts.append(len(obj_points))
+    return labels, np.array(points, dtype=np.float64).reshape(-1, 2), counts
+
+
+def read_fair1m_labels(annotation_filepath):
+    """
+    Reads a FAIR1M xml label file.
+
+    Returns:
+        (labels, boxes) where labels holds the category name and boxes the (N, 4)
+        [xmin, ymin, width, height] horizontal boxes of the oriented objects
+    """
+    with open(annotation_filepath, "rb") as f:
+        data = f.read()
+    try:
+        labels, points, counts = _fair1m_fast(data)
+    except (_FastPathError, UnicodeDecodeError):
+        labels, points, counts = _fair1m_iterparse(annotation_filepath)
+    if not labels:
+        return labels, np.zeros((0, 4))
+    if min(counts) == 0:
+        raise ValueError("{} has an object without points".format(annotation_filepath))
+    # min/max over the points of every object
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    mins = np.minimum.reduceat(points, starts, axis=0)
+    maxs = np.maximum.reduceat(points, starts, axis=0)
+    return labels, np.concatenate([mins, maxs - mins], axis=1)
+
+
+def _dior_fast(data):
+    _check_scannable(data)
+    objects = _DIOR_OBJECT.findall(data)
+    if data.count(b"<object>") != len(objects) or data.count(b"<bndbox>") != len(objects):
+        raise _FastPathError()
+    labels = [obj[0].decode("utf-8") for obj in objects]
+    if not all(labels):
+        raise _FastPathError()
+    # xmin ymin xmax ymax of every object of the file in a single conversion
+    coordinates = b" ".join([value for obj in objects for value in obj[1:]]).decode("ascii")
+    return labels, _parse_numbers(coordinates, " ", np.int64, 4 * len(objects)).reshape(-1, 4)
+
+
+def _dior_iterparse(annotation_filepath):
+    labels, coordinates = [], []
+    for obj in _iterparse_objects(annotation_filepath, "object"):
+        bndbox = obj.find("bndbox")
+        labels.append(obj.find("name").text)
+        coordinates.append([int(bndbox.find(tag).text) for tag in ("xmin", "ymin", "xmax", "ymax")])
+    return labels, np.array(coordinates, dtype=np.int64).reshape(-1, 4)
+
+
+def read_dior_labels(annotation_filepath):
+    """
+    Reads a DIOR (VOC) xml label file.
+
+    Returns:
+        (labels, boxes) where labels holds the category name and boxes the (N, 4)
+        [xmin, ymin, width, height] boxes
+    """
+    with open(annotation_filepath, "rb") as f:
+        data = f.read()
+    try:
+        labels, coordinates = _dior_fast(data)
+    except (_FastPathError, UnicodeDecodeError):
+        labels, coordinates = _dior_iterparse(annotation_filepath)
+    boxes = coordinates.copy()
+    boxes[:, 2:] -= coordinates[:, :2]
+    return labels, boxes
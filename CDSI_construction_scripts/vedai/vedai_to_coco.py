@@ -1,12 +1,18 @@
 import os
+from functools import partial
 from pathlib import Path
 import fire
-from PIL import Image
-from sahi.utils.coco import Coco, CocoAnnotation, CocoCategory, CocoImage
-from sahi.utils.file import save_json
-from tqdm import tqdm
 import sys
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.annotation_store import AnnotationStore
+from utils.coco_writer import CocoJsonWriter
+from utils.instrumentation import count, stage, start_run
+from utils.modes import get_output_path, get_report_path, parse_modes
+from utils.image_meta import open_image_size_cache, probe_image
+from utils.parallel import map_images
+from utils.split_manifest import load_split_members
+
 
 CATEGORY_ID_TO_NAME = {
 "1": "car",
@@ -52,12 +58,110 @@ NAME_TO_COCO_CATEGORY = {
 }
 
 
+def parse_vedai_image(image_name, data_folder_dir, input_image_folder, input_ann_folder):
+    """
+    Reads the size and the oriented boxes (as horizontal boxes) of a single vedai image.
+
+    Returns:
+        (cocoimage_filename, image_info, labels, boxes) where labels holds the
+        category_id and boxes the [xmin, ymin, width, height] of every object
+    """
+    # get image properties
+    image_filepath = str(Path(input_image_folder) / image_name)
+    annotation_filename = image_name.split("_co.png")[0] + ".txt"
+    annotation_filepath = str(Path(input_ann_folder) / annotation_filename)
+    image_info = probe_image(image_filepath)
+    cocoimage_filename = str(Path(image_filepath)).split(str(Path(data_folder_dir)))[1]
+    if cocoimage_filename[0] == os.sep:
+        cocoimage_filename = cocoimage_filename[1:]
+    # parse annotation file
+    with stage("label_parse"):
+        labels, boxes = parse_vedai_labels(annotation_filepath)
+    return cocoimage_filename, image_info, labels, boxes
+
+
+def parse_vedai_labels(annotation_filepath):
+    """
+    Returns the (labels, boxes) of a vedai annotation file, oriented boxes as horizontal boxes
+    """
+    with open(annotation_filepath, "r") as file:
+        lines = file.readlines()
+    count("label_files")
+    count("bytes_read", sum(len(line) for line in lines))
+    labels = []
+    boxes = []
+    for line in lines:
+        # parse annotation bboxes
+        new_line = line.strip("\n").split(" ")
+        y_corners = [int(x) for x in new_line[-4:]]
+        x_corners = [int(x) for x in new_line[-8:-4]]
+        #top left point
+        minx = min(x_corners)
+        miny = min(y_corners)
+        # width = maxx-minx, height = maxy-miny
+        width = max(x_corners) - minx
+        height = max(y_corners) - miny
+
+        bbox = [minx,
+                miny,
+                width,
+                height]
+        labels.append(new_line[3])
+        boxes.append(bbox)
+
+    return labels, boxes
+
+
+# (min_area, max_area) of the boxes kept by each mode, min_area < area < max_area
+MODE_AREA_RANGE = {'original': (0, None), 'car_other': (None, 400), 'car': (None, 400)}
+
+
+def get_mode_setup(mode, category_id_remapping):
+    """
+    Returns the coco categories and the category id remapping of a conversion mode
+    """
+    category_id_remapping = dict(category_id_remapping)
+    categories = []
+    if mode == 'original':
+        for category_id, category_name in CATEGORY_ID_TO_NAME.items():
+            if category_id in category_id_remapping.keys():
+                remapped_category_id = category_id_remapping[category_id]
+                coco_category = NAME_TO_COCO_CATEGORY[category_name]
+                categories.append(dict(
+                    id=int(remapped_category_id),
+                    name=coco_category["name"],
+                    supercategory=coco_category["supercategory"],
+                ))
+    elif mode == 'car_other':
+        print('"car_other" mode categories')
+        categories.append(dict(id=0, name='Other'))
+        categories.append(dict(id=1, name='Car'))
+        for k,v in category_id_remapping.items():
+            if k in ['1','10']:
+                category_id_remapping[k] =1
+            else:
+                category_id_remapping[k]=0
+    elif mode == 'car':
+        # car related categories: car, pickup, van
+        print('"car" mode categories')
+        categories.append(dict(id=0, name='Car'))
+        category_id_remapping = {'1': '0','10': '0'}
+    else:
+        print('pick a defined mode: [original/car_other/car]')
+        sys.exit()
+    return categories, category_id_remapping
+
+
 def vedai_to_coco(
     data_folder_dir,
     split_images_path,
     output_dir,
     mode,
     category_id_remapping=None,
+    workers=1,
+    prefetch=0,
+    image_size_cache=None,
+    stats=True,
 ):
     """
     Converts vedai annotations into coco annotation.
@@ -66,132 +170,72 @@ def vedai_to_coco(
         data_folder_dir: str
             'vedai' folder directory
         split_images_path: str
-            split_images_path txt file
+            split list txt file or split name of the manifest (e.g. CDSI_train)
         output_file_path: str
             Output file path
-        mode: str
-            mode original|car_other|car
+        mode: str or list
+            mode original|car_other|car, 'all' or several modes (e.g. original,car) converted
+            in a single pass, each written to <output>/<mode>/<split>.json
         category_id_remapping: dict
             Used for selecting desired category ids and mapping them.
             If not provided, vedai mapping will be used.
             format: str(id) to str(id)
+        workers: int
+            Number of processes used to parse the images, 1 runs serially
+        prefetch: int
+            Number of images parsed ahead on a thread pool when running serially, so that their
+            file reads overlap with the current one, 0 disables it
+        image_size_cache: str
+            Image size cache file, the default one if not provided, False disables it
+        stats: bool
+            Saves the run statistics (stage times, counters, peak memory) to
+            <output>/<split>.stats.json
     """
 
     # init paths/folders
     input_image_folder = str(Path(data_folder_dir) / "Vehicules512")
     input_ann_folder = str(Path(data_folder_dir) / "Annotations512")
 
-    image_filepath_list = os.listdir(input_image_folder)
-
 #     Path(output_dir).parents[0].mkdir(parents=True, exist_ok=True)
 
     if category_id_remapping is None:
         category_id_remapping = CATEGORY_ID_REMAPPING
 
-    # init coco object
-    coco = Coco()
-
-    # append categories
-    if mode == 'original':
-        for category_id, category_name in CATEGORY_ID_TO_NAME.items():
-            if category_id in category_id_remapping.keys():
-                remapped_category_id = category_id_remapping[category_id]
-                coco_category = NAME_TO_COCO_CATEGORY[category_name]
-                coco.add_category(
-                    CocoCategory(
-                        id=int(remapped_category_id),
-                        name=coco_category["name"],
-                        supercategory=coco_category["supercategory"],
-                    )
-                )
-    elif mode == 'car_other':
-        print('"car_other" mode categories')
-        coco.add_category(CocoCategory(id=0, name='Other'))
-        coco.add_category(CocoCategory(id=1, name='Car'))
-        for k,v in category_id_remapping.items():
-            if k in ['1','10']:
-                category_id_remapping[k] =1
-            else:
-                category_id_remapping[k]=0
-    elif mode == 'car':
-        # car related categories: car, pickup, van
-        print('"car" mode categories')
-        coco.add_category(CocoCategory(id=0, name='Car'))
-        category_id_remapping = {'1': '0','10': '0'}
-    else:
-        print('pick a defined mode: [original/car_other/car]')
-        sys.exit()
-    
-    split_images_lst = []
-    with open(split_images_path, 'r') as f:
-        for line in f:
-            split_images_lst.append(line.strip().split('/')[1])
+    modes = parse_modes(mode)
+    mode_setups = [get_mode_setup(m, category_id_remapping) for m in modes]
+    run = start_run("vedai_to_coco", split=str(split_images_path), modes=modes, workers=workers, prefetch=prefetch)
     
+    # split members, in split list order
+    image_name_list = load_split_members(split_images_path, 'vedai', input_image_folder)
+    image_cache = open_image_size_cache(image_size_cache)
+    parse_image = partial(
+        parse_vedai_image,
+        data_folder_dir=data_folder_dir,
+        input_image_folder=input_image_folder,
+        input_ann_folder=input_ann_folder,
+    )
+
     # convert vedai annotations to coco
-    for image_name in tqdm(image_filepath_list):
-        # get image properties
-        if image_name in split_images_lst:
-            image_filepath = str(Path(input_image_folder) / image_name)
-            annotation_filename = image_name.split("_co.png")[0] + ".txt"
-            annotation_filepath = str(Path(input_ann_folder) / annotation_filename)
-            image = Image.open(image_filepath)
-            cocoimage_filename = str(Path(image_filepath)).split(str(Path(data_folder_dir)))[1]
-            if cocoimage_filename[0] == os.sep:
-                cocoimage_filename = cocoimage_filename[1:]
-            # create coco image object
-            coco_image = CocoImage(file_name=cocoimage_filename, height=image.size[1], width=image.size[0])
-            # parse annotation file
-            file = open(annotation_filepath, "r")
-            lines = file.readlines()
-            for line in lines:
-                # parse annotation bboxes
-                new_line = line.strip("\n").split(" ")
-                y_corners = [int(x) for x in new_line[-4:]]
-                x_corners = [int(x) for x in new_line[-8:-4]]
-                minx_miny = (min(x_corners), min(y_corners))
-                maxx_maxy = (max(x_corners), max(y_corners))
-                #
-                i_bbox = [minx_miny[0], minx_miny[1], maxx_maxy[0], maxx_maxy[1]]
-                # width = maxx-minx, height = maxy-miny
-                width = i_bbox[2] - i_bbox[0]
-                height = i_bbox[3] - i_bbox[1]
-
-                #top left point
-                minx = min(x_corners)
-                miny = min(y_corners)
-
-                bbox = [minx,
-                        miny,
-                        width,
-                        height]
-                # parse category id and name
-                category_id = new_line[3]
-                if category_id in category_id_remapping.keys():
-                    category_name = CATEGORY_ID_TO_NAME[category_id]
-                    remapped_category_id = category_id_remapping[category_id]
-                else:
-                    continue
-
-                # create coco annotation and append it to coco image
-                coco_annotation = CocoAnnotation.from_coco_bbox(
-                    bbox=bbox,
-                    category_id=int(remapped_category_id),
-                    category_name=category_name,
-                )
-                if mode == 'original':
-                    if coco_annotation.area > 0:
-                        coco_image.add_annotation(coco_annotation)
-                elif mode == 'car_other':
-                    if coco_annotation.area < 400:
-                        coco_image.add_annotation(coco_annotation)
-                elif mode == 'car':
-                    if coco_annotation.area < 400:
-                        coco_image.add_annotation(coco_annotation)
-            coco.add_image(coco_image)
-
-    save_path = output_dir
-    all_json_path = Path(save_path) / "{}.json".format(split_images_path.split('.')[0])
-    save_json(data=coco.json, save_path=all_json_path)
+    store = AnnotationStore()
+    for cocoimage_filename, image_info, labels, boxes in map_images(parse_image, image_name_list, workers=workers, prefetch=prefetch):
+        count("images")
+        count("annotations_parsed", len(boxes))
+        if image_cache is not None:
+            image_cache.store(image_info)
+        store.add_image(cocoimage_filename, image_info.width, image_info.height, labels, boxes)
+
+    if image_cache is not None:
+        image_cache.save()
+    # write every mode from the same parsed data
+    for m, (categories, mode_category_id_remapping) in zip(modes, mode_setups):
+        coco = CocoJsonWriter(get_output_path(output_dir, split_images_path, m, modes))
+        for category in categories:
+            coco.add_category(**category)
+        min_area, max_area = MODE_AREA_RANGE[m]
+        store.write_coco(coco, mode_category_id_remapping, min_area=min_area, max_area=max_area, group=m)
+        coco.close()
+    if stats:
+        run.save(get_report_path(output_dir, split_images_path))
     
 
 
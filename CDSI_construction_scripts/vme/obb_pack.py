@@ -0,0 +1,229 @@
+"""
+single-file packed store of the VME annotations_OBB text files (one 'x1 y1 ... x4 y4 class'
+line per object, one file per tile)
+
+Layout of the pack file:
+    8 bytes   magic b'OBBPACK1'
+    8 bytes   little endian uint64 length of the json header
+    header    json: dtype, number of rows and the index {filename: [first row, row count]}
+              (files whose text can not be rebuilt from the rows, e.g. the '\n' of tiles
+              without objects, are stored as raw text, {filename: [offset, length]} in 'raw')
+    rows      packed records (8 corner coordinates, class id, integer-text bit mask), one per
+              object, the rows of a tile are contiguous
+    raw       raw text of the files listed in 'raw'
+
+Reading a tile reads only its rows. With the default float64 corners the per-file text is
+rebuilt byte for byte: the annotation files write the shortest repr of every coordinate, and
+integer coordinates ('0') are flagged in the mask. float32 corners halve the rows but the
+rebuilt text is then the float32 repr, not the original digits.
+
+usage:
+    python obb_pack.py pack ../../VME_annotations/annotations_OBB annotations_OBB.pack
+    python obb_pack.py show annotations_OBB.pack VME0001.txt
+    python obb_pack.py unpack annotations_OBB.pack annotations_OBB
+"""
+import os
+import struct
+from pathlib import Path
+
+import fire
+import numpy as np
+from tqdm import tqdm
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.json_io import dumps, loads
+
+MAGIC = b"OBBPACK1"
+DTYPES = ["float64", "float32"]
+
+
+def row_dtype(dtype):
+    """
+    Record of an object: corners (x1, y1, ..., x4, y4), class id and the mask of the corners
+    written as integers
+    """
+    return np.dtype([("corners", "<f8" if dtype == "float64" else "<f4", (8,)), ("class_id", "<i4"), ("int_mask", "u1")])
+
+
+def parse_obb_text(text):
+    """
+    Parses the lines of an OBB file
+    :return: (corners, class ids, integer-text masks) lists, None if a line is not 'x1 y1 ... x4 y4 class'
+    """
+    corners, class_ids, int_masks = [], [], []
+    for line in text.split("\n"):
+        if not line:
+            continue
+        parts = line.split(" ")
+        if len(parts) != 9:
+            return None
+        try:
+            corners.append([float(part) for part in parts[:8]])
+            class_ids.append(int(parts[8]))
+        except ValueError:
+            return None
+        int_masks.append(sum(1 << i for i, part in enumerate(parts[:8]) if "." not in part))
+    return corners, class_ids, int_masks
+
+
+def format_obb_rows(rows):
+    """
+    Rebuilds the text of an OBB file from its rows
+    """
+    float64 = rows["corners"].dtype == np.float64
+    # python floats repr the float64 digits, numpy float32 scalars print their shortest float32 repr
+    corner_rows = rows["corners"].tolist() if float64 else rows["corners"]
+    lines = []
+    for corners, class_id, int_mask in zip(corner_rows, rows["class_id"].tolist(), rows["int_mask"].tolist()):
+        values = [
+            str(int(value)) if int_mask >> i & 1 else (repr(value) if float64 else str(value))
+            for i, value in enumerate(corners)
+        ]
+        lines.append(" ".join(values) + " {}\n".format(class_id))
+    return "".join(lines)
+
+
+def pack_obb(obb_dir, pack_path, dtype="float64"):
+    """
+    Packs all the .txt files of obb_dir into pack_path.
+
+    Args:
+        obb_dir: str
+            annotations_OBB directory
+        pack_path: str
+            Output pack file
+        dtype: str
+            float64 (lossless) or float32 corners
+    """
+    if dtype not in DTYPES:
+        raise ValueError("dtype must be one of {}".format(DTYPES))
+    record = row_dtype(dtype)
+    filenames = sorted(filename for filename in os.listdir(obb_dir) if filename.endswith(".txt"))
+
+    index, raw = {}, {}
+    row_chunks, raw_chunks = [], []
+    num_rows = raw_size = 0
+    for filename in tqdm(filenames, "Packing OBB annotations"):
+        with open(os.path.join(obb_dir, filename), encoding="utf-8", newline="") as f:
+            text = f.read()
+        parsed = parse_obb_text(text)
+        rows = None
+        if parsed is not None:
+            corners, class_ids, int_masks = parsed
+            rows = np.zeros(len(class_ids), dtype=record)
+            rows["corners"] = np.array(corners, dtype=np.float64).reshape(-1, 8)
+            rows["class_id"] = class_ids
+            rows["int_mask"] = int_masks
+            # float64 rows must give back the exact text, float32 coordinates are lossy by choice
+            if (dtype == "float64" or not len(rows)) and format_obb_rows(rows) != text:
+                rows = None
+        if rows is None:
+            data = text.encode("utf-8")
+            raw[filename] = [raw_size, len(data)]
+            raw_chunks.append(data)
+            raw_size += len(data)
+            continue
+        index[filename] = [num_rows, len(rows)]
+        row_chunks.append(rows)
+        num_rows += len(rows)
+
+    header = dumps({"dtype": dtype, "num_rows": num_rows, "index": index, "raw": raw}).encode("utf-8")
+    Path(pack_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(pack_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for rows in row_chunks:
+            f.write(rows.tobytes())
+        for data in raw_chunks:
+            f.write(data)
+    print("{}: {} files, {} objects, {} raw files".format(pack_path, len(filenames), num_rows, len(raw)))
+
+
+class ObbPack:
+    """
+    Reader of a pack_obb file, only the header is read when opening it
+    """
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        with open(pack_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not an OBB pack file".format(pack_path))
+            header_size = struct.unpack("<Q", f.read(8))[0]
+            header = loads(f.read(header_size))
+        self.dtype = header["dtype"]
+        self.record = row_dtype(self.dtype)
+        self.index = header["index"]
+        self.raw = header["raw"]
+        self.rows_offset = len(MAGIC) + 8 + header_size
+        self.raw_offset = self.rows_offset + header["num_rows"] * self.record.itemsize
+
+    @property
+    def filenames(self):
+        return sorted(list(self.index) + list(self.raw))
+
+    def __contains__(self, filename):
+        return filename in self.index or filename in self.raw
+
+    def _read(self, offset, size):
+        with open(self.pack_path, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def rows(self, filename):
+        """
+        Returns the packed rows of a tile (corners, class_id and int_mask fields)
+        """
+        if filename in self.raw:
+            parsed = parse_obb_text(self.text(filename))
+            if parsed is None:
+                raise ValueError("{} is not in the 'x1 y1 ... x4 y4 class' format".format(filename))
+            corners, class_ids, int_masks = parsed
+            rows = np.zeros(len(class_ids), dtype=self.record)
+            rows["corners"] = np.array(corners, dtype=np.float64).reshape(-1, 8)
+            rows["class_id"] = class_ids
+            rows["int_mask"] = int_masks
+            return rows
+        first_row, num_rows = self.index[filename]
+        data = self._read(self.rows_offset + first_row * self.record.itemsize, num_rows * self.record.itemsize)
+        return np.frombuffer(data, dtype=self.record)
+
+    def read(self, filename):
+        """
+        Returns the (corners (N, 8), class ids (N,)) of a tile
+        """
+        rows = self.rows(filename)
+        return rows["corners"], rows["class_id"]
+
+    def text(self, filename):
+        """
+        Returns the text of a tile annotation file
+        """
+        if filename in self.raw:
+            offset, size = self.raw[filename]
+            return self._read(self.raw_offset + offset, size).decode("utf-8")
+        return format_obb_rows(self.rows(filename))
+
+
+def unpack_obb(pack_path, output_dir):
+    """
+    Writes back the per-tile text files of a pack
+    """
+    pack = ObbPack(pack_path)
+    os.makedirs(output_dir, exist_ok=True)
+    for filename in tqdm(pack.filenames, "Unpacking OBB annotations"):
+        with open(os.path.join(output_dir, filename), "w", encoding="utf-8", newline="") as f:
+            f.write(pack.text(filename))
+
+
+def show(pack_path, filename):
+    """
+    Prints the text of a tile annotation file
+    """
+    print(ObbPack(pack_path).text(filename), end="")
+
+
+if __name__ == "__main__":
+    fire.Fire({"pack": pack_obb, "unpack": unpack_obb, "show": show})
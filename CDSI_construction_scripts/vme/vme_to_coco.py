@@ -0,0 +1,217 @@
+import os
+from pathlib import Path
+import fire
+import numpy as np
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.annotation_store import AnnotationStore
+from utils.coco_writer import CocoJsonWriter
+from utils.instrumentation import count, stage, start_run
+from utils.modes import get_output_path, get_report_path, parse_modes
+from utils.image_meta import open_image_size_cache, probe_image
+from utils.parallel import map_images
+from utils.split_manifest import load_split_members
+from vme.obb_pack import ObbPack
+
+VME_OBB_DIR = Path(__file__).resolve().parents[2] / "VME_annotations" / "annotations_OBB"
+
+CATEGORY_ID_TO_NAME = {
+    "0": "Car",
+    "1": "Bus",
+    "2": "Truck"
+}
+
+CATEGORY_ID_REMAPPING = {
+    "0": "0",
+    "1": "1",
+    "2": "2"
+}
+
+NAME_TO_COCO_CATEGORY = {
+    "Car": {"name": "Car", "supercategory": "Car"},
+    "Bus": {"name": "Bus", "supercategory": "Bus"},
+    "Truck": {"name": "Truck", "supercategory": "Truck"}
+}
+
+
+def read_obb_annotations(image_filenames, obb_annotations):
+    """
+    Reads the OBB annotations of the images in a single batched parse.
+
+    Args:
+        image_filenames: list
+            VME image file names (VME0001.png ...)
+        obb_annotations: str
+            annotations_OBB folder or a pack made by vme/obb_pack.py
+    Returns:
+        (corners, class_ids, counts) where corners is the (N, 8) x1 y1 ... x4 y4 array of all
+        objects, class_ids their (N,) class and counts the number of objects of every image
+    """
+    annotation_filenames = [os.path.splitext(image_filename)[0] + ".txt" for image_filename in image_filenames]
+    if os.path.isfile(obb_annotations):
+        pack = ObbPack(obb_annotations)
+        rows = [pack.read(annotation_filename) for annotation_filename in annotation_filenames]
+        count("label_files")
+        count("bytes_read", sum(tile_corners.nbytes + tile_class_ids.nbytes for tile_corners, tile_class_ids in rows))
+        counts = np.array([len(class_ids) for _, class_ids in rows], dtype=np.int64)
+        corners = np.concatenate([np.zeros((0, 8))] + [tile_corners for tile_corners, _ in rows]).astype(np.float64)
+        class_ids = np.concatenate([np.zeros(0, dtype=np.int64)] + [tile_class_ids for _, tile_class_ids in rows])
+        return corners, class_ids.astype(np.int64), counts
+
+    texts = []
+    counts = np.zeros(len(annotation_filenames), dtype=np.int64)
+    for i, annotation_filename in enumerate(annotation_filenames):
+        with open(os.path.join(obb_annotations, annotation_filename)) as f:
+            text = f.read()
+        counts[i] = sum(1 for line in text.split("\n") if line.strip())
+        texts.append(text)
+    count("label_files", len(texts))
+    count("bytes_read", sum(len(text) for text in texts))
+    # one 'x1 y1 x2 y2 x3 y3 x4 y4 class' row per object, all files parsed at once
+    values = np.fromstring(" ".join(texts), sep=" ", dtype=np.float64)
+    if values.size != 9 * counts.sum():
+        raise ValueError("OBB lines must be 'x1 y1 x2 y2 x3 y3 x4 y4 class'")
+    values = values.reshape(-1, 9)
+    return values[:, :8], values[:, 8].astype(np.int64), counts
+
+
+def obb_to_hbb(corners):
+    """
+    Returns the [xmin, ymin, width, height] horizontal boxes of (N, 8) OBB corners, computed on
+    the rounded corners as in the shipped annotations_HBB files
+    """
+    # + 0.0 turns the -0.0 of rounded small negative corners into 0.0
+    corners = np.round(corners) + 0.0
+    xs, ys = corners[:, 0::2], corners[:, 1::2]
+    xmin, ymin = xs.min(axis=1), ys.min(axis=1)
+    return np.stack([xmin, ymin, xs.max(axis=1) - xmin, ys.max(axis=1) - ymin], axis=1)
+
+
+# (min_area, max_area) of the boxes kept by each mode, min_area < area < max_area
+MODE_AREA_RANGE = {'original': (0, None), 'car_other': (0, 400), 'car': (0, 400)}
+
+
+def get_mode_setup(mode, category_id_remapping):
+    """
+    Returns the coco categories and the category id remapping of a conversion mode
+    """
+    category_id_remapping = dict(category_id_remapping)
+    categories = []
+    if mode == 'original':
+        for category_id, category_name in CATEGORY_ID_TO_NAME.items():
+            if category_id in category_id_remapping.keys():
+                remapped_category_id = category_id_remapping[category_id]
+                coco_category = NAME_TO_COCO_CATEGORY[category_name]
+                categories.append(dict(
+                    id=int(remapped_category_id),
+                    name=coco_category["name"],
+                    supercategory=coco_category["supercategory"],
+                ))
+    elif mode == 'car_other':
+        print('"car_other" mode categories')
+        categories.append(dict(id=0, name='Other'))
+        categories.append(dict(id=1, name='Car'))
+        for k,v in category_id_remapping.items():
+            if k == '0':
+                category_id_remapping[k] =1
+            else:
+                category_id_remapping[k]=0
+    elif mode == 'car':
+        print('"car" mode categories')
+        categories.append(dict(id=0, name='Car'))
+        category_id_remapping = {'0': '0'}
+    else:
+        print('pick a defined mode: [original/car_other/car]')
+        sys.exit()
+    return categories, category_id_remapping
+
+
+def vme_to_coco(
+    images_dir,
+    split_images_path,
+    output_file_path,
+    mode,
+    obb_annotations=str(VME_OBB_DIR),
+    category_id_remapping=None,
+    workers=1,
+    prefetch=0,
+    image_size_cache=None,
+    stats=True,
+):
+    """
+    Converts VME OBB annotations into coco (HBB) annotation.
+
+    Args:
+        images_dir: str
+            VME images folder directory
+        split_images_path: str
+            split list txt file or split name of the manifest (e.g. CDSI_train)
+        output_file_path: str
+            Output file path
+        mode: str or list
+            mode original|car_other|car, 'all' or several modes (e.g. original,car) converted
+            in a single pass, each written to <output>/<mode>/<split>.json
+        obb_annotations: str
+            annotations_OBB folder or pack file, VME_annotations/annotations_OBB if not provided
+        category_id_remapping: dict
+            Used for selecting desired category ids and mapping them.
+            If not provided, vme mapping will be used.
+            format: str(id) to str(id)
+        workers: int
+            Number of processes used to read the image sizes, 1 runs serially
+        prefetch: int
+            Number of images probed ahead on a thread pool when running serially, so that their
+            file reads overlap with the current one, 0 disables it
+        image_size_cache: str
+            Image size cache file, the default one if not provided, False disables it
+        stats: bool
+            Saves the run statistics (stage times, counters, peak memory) to
+            <output>/<split>.stats.json
+    """
+    if category_id_remapping is None:
+        category_id_remapping = CATEGORY_ID_REMAPPING
+
+    modes = parse_modes(mode)
+    mode_setups = [get_mode_setup(m, category_id_remapping) for m in modes]
+    run = start_run("vme_to_coco", split=str(split_images_path), modes=modes, workers=workers, prefetch=prefetch)
+
+    # split members, in split list order
+    image_filename_list = load_split_members(split_images_path, 'VME', images_dir)
+    image_cache = open_image_size_cache(image_size_cache)
+    image_path_list = [Path(images_dir) / image_filename for image_filename in image_filename_list]
+    image_info_list = map_images(probe_image, image_path_list, workers=workers, prefetch=prefetch, desc="Converting VME data into COCO format")
+
+    # horizontal boxes of all objects at once
+    with stage("label_parse"):
+        corners, class_ids, counts = read_obb_annotations(image_filename_list, obb_annotations)
+        boxes = obb_to_hbb(corners)
+    count("annotations_parsed", len(boxes))
+    labels = np.array([str(class_id) for class_id in range(class_ids.max() + 1 if len(class_ids) else 0)], dtype=object)[class_ids]
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    # convert vme annotations to coco
+    store = AnnotationStore()
+    for i, (image_filename, image_info) in enumerate(zip(image_filename_list, image_info_list)):
+        if image_cache is not None:
+            image_cache.store(image_info)
+        count("images")
+        start, end = offsets[i], offsets[i + 1]
+        store.add_image(image_filename, image_info.width, image_info.height, labels[start:end], boxes[start:end])
+
+    if image_cache is not None:
+        image_cache.save()
+    # write every mode from the same parsed data
+    for m, (categories, mode_category_id_remapping) in zip(modes, mode_setups):
+        coco = CocoJsonWriter(get_output_path(output_file_path, split_images_path, m, modes))
+        for category in categories:
+            coco.add_category(**category)
+        min_area, max_area = MODE_AREA_RANGE[m]
+        store.write_coco(coco, mode_category_id_remapping, min_area=min_area, max_area=max_area, group=m)
+        coco.close()
+    if stats:
+        run.save(get_report_path(output_file_path, split_images_path))
+
+
+if __name__ == "__main__":
+    fire.Fire(vme_to_coco)
@@ -1,3 +1,4 @@
+import os
 import random
 from collections import defaultdict
 from pathlib import Path
@@ -5,23 +6,71 @@ from typing import Dict, List
 
 import fire
 import numpy as np
-from PIL import Image
-from sahi.utils.coco import Coco, CocoAnnotation, CocoCategory, CocoImage
-from sahi.utils.file import load_json, save_json
 from tqdm import tqdm
 import sys
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.annotation_store import AnnotationStore
+from utils.coco_writer import CocoJsonWriter
+from utils.instrumentation import count, stage, start_run
+from utils.modes import get_output_path, get_report_path, parse_modes
+from utils.image_meta import open_image_size_cache, probe_image
+from utils.json_io import load_json
+from utils.json_stream import iter_json_array
+from utils.parallel import map_images
+from utils.split_manifest import load_split_members, parse_split_paths
+
 # fix the seed
 random.seed(13)
 
 
+# (min_area, max_area) of the boxes kept by each mode, min_area < area < max_area
+MODE_AREA_RANGE = {'original': (0, None), 'car_other': (None, 400), 'car': (None, 400)}
+
+
+def get_mode_setup(mode, category_id_remapping, category_id_to_name):
+    """
+    Returns the coco categories and the category id remapping of a conversion mode
+    """
+    category_id_remapping = dict(category_id_remapping)
+    categories = []
+    if mode == 'original':
+        for category_id, category_name in category_id_to_name.items():
+            if category_id in category_id_remapping.keys():
+                remapped_category_id = category_id_remapping[category_id]
+                categories.append(dict(id=int(remapped_category_id), name=category_name))
+    elif mode == 'car_other':
+        print('"car_other" mode categories')
+        categories.append(dict(id=0, name='Other'))
+        categories.append(dict(id=1, name='Car'))
+        for k,v in category_id_remapping.items():
+            if k == '18':
+                category_id_remapping[k] =1
+            else:
+                category_id_remapping[k]=0
+        
+    elif mode == 'car':
+        print('"car" mode categories')
+        # xview_category_id for 'Small Car' = '18'
+        categories.append(dict(id=0, name='Car'))
+        category_id_remapping = {'18': 0}
+    else:
+        print('pick a defined mode: [original/car_other/car]')
+        sys.exit()
+    return categories, category_id_remapping
+
+
 def xview_to_coco(
     images_dir,
     split_images_path,
     train_geojson_path,
     output_dir,
     mode,
-    category_id_remapping=None
+    category_id_remapping=None,
+    workers=1,
+    prefetch=0,
+    image_size_cache=None,
+    stats=True,
 ):
     """
     Converts xView annotations into coco annotation.
@@ -29,18 +78,31 @@ def xview_to_coco(
     Args:
         images_dir: str
             'train_images' folder directory
-        split_images_path: str
-            split_images_path txt file
+        split_images_path: str or list
+            split list txt file or split name of the manifest (e.g. CDSI_train). Several splits
+            (comma separated or a list, 'all' for every manifest split) are converted from a
+            single parse of the geojson, each written to <output>/<split>.json
         train_geojson_path: str
             'xView_train.geojson' file path
         output_dir: str
             Output folder directory
-        mode: str
-            mode original|car_other|car
+        mode: str or list
+            mode original|car_other|car, 'all' or several modes (e.g. original,car) converted
+            in a single pass, each written to <output>/<mode>/<split>.json
         category_id_remapping: dict
             Used for selecting desired category ids and mapping them.
             If not provided, vedai mapping will be used.
             format: str(id) to str(id)
+        workers: int
+            Number of processes used to read the image sizes, 1 runs serially
+        prefetch: int
+            Number of images probed ahead on a thread pool when running serially, so that their
+            file reads overlap with the current one, 0 disables it
+        image_size_cache: str
+            Image size cache file, the default one if not provided, False disables it
+        stats: bool
+            Saves the run statistics (stage times, counters, peak memory) to
+            <output>/<split>.stats.json (<output>/splits.stats.json for several splits)
     """
     
 
@@ -57,85 +119,62 @@ def xview_to_coco(
         category_id_remapping = load_json("category_id_mapping.json")
     category_id_remapping
 
-    # init coco object
-    coco = Coco()
-    # append categories
-    if mode == 'original':
-        for category_id, category_name in category_id_to_name.items():
-            if category_id in category_id_remapping.keys():
-                remapped_category_id = category_id_remapping[category_id]
-                coco.add_category(
-                    CocoCategory(id=int(remapped_category_id), name=category_name)
-                )
-    elif mode == 'car_other':
-        print('"car_other" mode categories')
-        coco.add_category(CocoCategory(id=0, name='Other'))
-        coco.add_category(CocoCategory(id=1, name='Car'))
-        for k,v in category_id_remapping.items():
-            if k == '18':
-                category_id_remapping[k] =1
-            else:
-                category_id_remapping[k]=0
-        
-    elif mode == 'car':
-        print('"car" mode categories')
-        # xview_category_id for 'Small Car' = '18'
-        coco.add_category(CocoCategory(id=0, name='Car'))
-        category_id_remapping = {'18': 0}
-    else:
-        print('pick a defined mode: [original/car_other/car]')
-        sys.exit()
+    split_images_paths = parse_split_paths(split_images_path)
+    modes = parse_modes(mode)
+    mode_setups = [get_mode_setup(m, category_id_remapping, category_id_to_name) for m in modes]
+    run = start_run("xview_to_coco", split=split_images_paths, modes=modes, workers=workers, prefetch=prefetch)
 
-    # parse xview data
-    coords, chips, classes, image_name_to_annotation_ind = get_labels(
-        train_geojson_path
-    )
+    # parse xview data, once for all the splits
+    with stage("label_parse"):
+        coords, chips, classes, image_name_to_annotation_ind = get_labels(
+            train_geojson_path
+        )
+    count("label_files")
+    count("bytes_read", os.path.getsize(train_geojson_path))
     image_name_list = get_ordered_image_name_list(image_name_to_annotation_ind)
     
-    split_images_lst = []
-    with open(split_images_path, 'r') as f:
-        for line in f:
-            split_images_lst.append(line.strip().split('/')[1])
+    split_images_sets = [set(load_split_members(path, 'xview')) for path in split_images_paths]
+    all_split_images_set = set().union(*split_images_sets)
     
+    image_name_list = [image_name for image_name in image_name_list if image_name in all_split_images_set]
+    image_path_list = [Path(images_dir) / image_name for image_name in image_name_list]
+    image_cache = open_image_size_cache(image_size_cache)
+    image_info_list = map_images(probe_image, image_path_list, workers=workers, prefetch=prefetch, desc="Converting xView data into COCO format")
+
+    # source category id of every feature, as used in category_id_remapping
+    class_values, class_inverse = np.unique(classes, return_inverse=True)
+    category_ids = np.array([str(int(value)) for value in class_values], dtype=object)[class_inverse]
+
     # convert xView data to COCO format
-    for image_name in tqdm(image_name_list, "Converting xView data into COCO format"):
-        # create coco image object
-        if image_name in split_images_lst:
-            width, height = Image.open(Path(images_dir) / image_name).size
-            coco_image = CocoImage(file_name=image_name, height=height, width=width)
-
-            annotation_ind_list = image_name_to_annotation_ind[image_name]
-
-            # iterate over image annotations
-            for annotation_ind in annotation_ind_list:
-                bbox = coords[annotation_ind].tolist()
-                category_id = str(int(classes[annotation_ind].item()))
-                coco_bbox = [bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]]
-                if category_id in category_id_remapping.keys():
-                    category_name = category_id_to_name[category_id]
-                    remapped_category_id = category_id_remapping[category_id]
-                else:
-                    continue
-                # create coco annotation and append it to coco image
-                coco_annotation = CocoAnnotation(
-                    bbox=coco_bbox,
-                    category_id=int(remapped_category_id),
-                    category_name=category_name,
-                )
-                if mode == 'original':
-                    if coco_annotation.area > 0:
-                        coco_image.add_annotation(coco_annotation)
-                elif mode == 'car_other':
-                    if coco_annotation.area < 400:
-                        coco_image.add_annotation(coco_annotation)
-                elif mode == 'car':
-                    if coco_annotation.area < 400:
-                        coco_image.add_annotation(coco_annotation)
-            coco.add_image(coco_image)
-    ###
-    save_path = output_dir
-    all_json_path = Path(save_path) / "{}.json".format(split_images_path.split('.')[0])
-    save_json(data=coco.json, save_path=all_json_path)
+    store = AnnotationStore()
+    for image_name, image_info in zip(image_name_list, image_info_list):
+        if image_cache is not None:
+            image_cache.store(image_info)
+
+        count("images")
+        count("annotations_parsed", len(image_name_to_annotation_ind[image_name]))
+        annotation_inds = np.array(image_name_to_annotation_ind[image_name])
+        bbox = coords[annotation_inds]
+        coco_bbox = np.stack([bbox[:, 0], bbox[:, 1], bbox[:, 2] - bbox[:, 0], bbox[:, 3] - bbox[:, 1]], axis=1)
+        store.add_image(image_name, image_info.width, image_info.height, category_ids[annotation_inds], coco_bbox)
+
+    if image_cache is not None:
+        image_cache.save()
+    # route the images of every split to its outputs, every mode from the same parsed data
+    for split_path, split_images_set in zip(split_images_paths, split_images_sets):
+        image_indices = [i for i, image_name in enumerate(image_name_list) if image_name in split_images_set]
+        for m, (categories, mode_category_id_remapping) in zip(modes, mode_setups):
+            coco = CocoJsonWriter(get_output_path(output_dir, split_path, m, modes))
+            for category in categories:
+                coco.add_category(**category)
+            min_area, max_area = MODE_AREA_RANGE[m]
+            store.write_coco(
+                coco, mode_category_id_remapping, min_area=min_area, max_area=max_area, image_indices=image_indices,
+                group=m if len(split_images_paths) == 1 else "{}/{}".format(split_path, m),
+            )
+            coco.close()
+    if stats:
+        run.save(get_report_path(output_dir, split_images_paths[0] if len(split_images_paths) == 1 else "splits"))
 
 
 def get_ordered_image_name_list(image_name_to_annotation_ind: Dict):
@@ -149,48 +188,93 @@ def get_ordered_image_name_list(image_name_to_annotation_ind: Dict):
     return image_name_list
 
 
-def get_labels(fname):
+def get_labels(fname, chunk_size=65536):
     """
     Gets label data from a geojson label file
     Args:
         fname: file path to an xView geojson label file
+        chunk_size: number of features whose bounds are parsed at once
     Output:
         Returns three arrays: coords, chips, and classes corresponding to the
             coordinates, file-names, and classes for each ground truth.
     Modified from https://github.com/DIUx-xView.
-    """
-    data = load_json(fname)
 
-    coords = np.zeros((len(data["features"]), 4))
-    chips = np.zeros((len(data["features"])), dtype="object")
-    classes = np.zeros((len(data["features"])))
-    image_name_to_annotation_ind = defaultdict(list)
-
-    for i in tqdm(range(len(data["features"])), "Parsing xView data"):
-        if data["features"][i]["properties"]["bounds_imcoords"] != []:
-            b_id = data["features"][i]["properties"]["image_id"]
-            # https://github.com/DIUx-xView/xView1_baseline/issues/3
-            if b_id == "1395.tif":
-                continue
-            val = np.array(
-                [
-                    int(num)
-                    for num in data["features"][i]["properties"][
-                        "bounds_imcoords"
-                    ].split(",")
-                ]
-            )
-            chips[i] = b_id
-            classes[i] = data["features"][i]["properties"]["type_id"]
+    The features are streamed from the file and written into preallocated columnar arrays
+    chunk by chunk, so the geojson is never loaded as a whole.
+    """
+    capacity = chunk_size
+    coords = np.zeros((capacity, 4))
+    classes = np.zeros(capacity)
+    # index into image_names, -1 for features without bounds, -2 for skipped features
+    chip_codes = np.full(capacity, -2, dtype=np.int32)
+    image_names = []
+    image_name_to_code = {}
 
-            image_name_to_annotation_ind[b_id].append(i)
+    num_features = 0
+    chunk_inds, chunk_bounds = [], []
 
+    def parse_chunk():
+        # parse all bounds of the chunk at once, fall back to one by one if a box has != 4 values
+        if all(bounds.count(",") == 3 for bounds in chunk_bounds):
+            vals = np.fromstring(",".join(chunk_bounds), sep=",", dtype=np.int64)
+            coords[np.array(chunk_inds)] = vals.reshape(-1, 4)
+            return
+        for i, bounds in zip(chunk_inds, chunk_bounds):
+            val = np.array([int(num) for num in bounds.split(",")])
             if val.shape[0] != 4:
                 print("Issues at %d!" % i)
             else:
                 coords[i] = val
+
+    for i, feature in enumerate(tqdm(iter_json_array(fname, "features"), "Parsing xView data")):
+        if i == capacity:
+            capacity *= 2
+            coords = np.resize(coords, (capacity, 4))
+            classes = np.resize(classes, capacity)
+            chip_codes = np.resize(chip_codes, capacity)
+            coords[i:] = 0
+            classes[i:] = 0
+            chip_codes[i:] = -2
+        num_features = i + 1
+
+        properties = feature["properties"]
+        if properties["bounds_imcoords"] != []:
+            b_id = properties["image_id"]
+            # https://github.com/DIUx-xView/xView1_baseline/issues/3
+            if b_id == "1395.tif":
+                continue
+            code = image_name_to_code.get(b_id)
+            if code is None:
+                code = image_name_to_code[b_id] = len(image_names)
+                image_names.append(b_id)
+            chip_codes[i] = code
+            classes[i] = properties["type_id"]
+            chunk_inds.append(i)
+            chunk_bounds.append(properties["bounds_imcoords"])
+            if len(chunk_inds) == chunk_size:
+                parse_chunk()
+                chunk_inds, chunk_bounds = [], []
         else:
-            chips[i] = "None"
+            chip_codes[i] = -1
+    if chunk_inds:
+        parse_chunk()
+
+    coords = coords[:num_features]
+    classes = classes[:num_features]
+    chip_codes = chip_codes[:num_features]
+
+    chips = np.zeros(num_features, dtype="object")
+    chips[chip_codes == -1] = "None"
+    valid_inds = np.flatnonzero(chip_codes >= 0)
+    chips[valid_inds] = np.array(image_names, dtype="object")[chip_codes[valid_inds]]
+
+    # group the annotation indices by image, images in order of first appearance
+    image_name_to_annotation_ind = defaultdict(list)
+    valid_codes = chip_codes[valid_inds]
+    order = np.argsort(valid_codes, kind="stable")
+    splits = np.flatnonzero(np.diff(valid_codes[order])) + 1
+    for group in np.split(valid_inds[order], splits) if len(order) else []:
+        image_name_to_annotation_ind[image_names[chip_codes[group[0]]]] = group.tolist()
 
     return coords, chips, classes, image_name_to_annotation_ind
 